@@ -0,0 +1,145 @@
+"""Content-addressed store for finished downloads.
+
+Each artifact lives in ``<root>/<key>/<filename>`` where the key hashes
+everything that decides the output file (video, download mode, type, format
+selector and conversion settings). Jobs get hard-linked views of an artifact, so the link
+count doubles as a reference count: evicting a store entry never breaks a job
+that is still serving its copy, and the bytes are freed once the last view goes.
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+
+class ArtifactStore:
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        os.makedirs(root, exist_ok=True)
+        self._bytes = sum(size for _, _, size, _ in self._entries())
+
+    @staticmethod
+    def key_for(video_key, mode, download_type, format_args, output_codecs=()):
+        """Stable key for one (video, mode, type, format/conversion options) combination.
+
+        mode is the download profile's name: profiles differ in cookies, size
+        caps and transcoding, so their results are never shared.
+        """
+        material = [video_key, mode, download_type, list(format_args)]
+        if output_codecs:
+            material.append(list(output_codecs))
+        material = json.dumps(material)
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def _entry_file(self, key):
+        entry_dir = os.path.join(self.root, key)
+        try:
+            names = os.listdir(entry_dir)
+        except FileNotFoundError:
+            return None
+        return os.path.join(entry_dir, names[0]) if names else None
+
+    def _entries(self):
+        """Yield (key, path, size, last_used) for every stored artifact"""
+        for key in os.listdir(self.root):
+            if key.startswith('.'):
+                continue
+            path = self._entry_file(key)
+            if path is None:
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            yield key, path, stat.st_size, stat.st_mtime
+
+    @staticmethod
+    def _link(source, destination):
+        try:
+            os.link(source, destination)
+        except OSError:
+            # Different filesystem or no hard link support
+            shutil.copy2(source, destination)
+
+    def lookup(self, key, dest_dir):
+        """Link a cached artifact into dest_dir, returning its filename or None"""
+        with self._lock:
+            path = self._entry_file(key)
+            if path is None:
+                self.stats['misses'] += 1
+                return None
+            filename = os.path.basename(path)
+            self._link(path, os.path.join(dest_dir, filename))
+            # mtime doubles as the LRU clock
+            now = time.time()
+            os.utime(path, (now, now))
+            self.stats['hits'] += 1
+            return filename
+
+    def publish(self, key, source_path):
+        """Add a finished job's file to the store under key.
+
+        Returns the bytes of disk freed by evictions this caused.
+        """
+        with self._lock:
+            if self._entry_file(key) is not None:
+                return 0
+            staging_dir = os.path.join(self.root, f'.{key}.tmp')
+            os.makedirs(staging_dir, exist_ok=True)
+            self._link(source_path, os.path.join(staging_dir, os.path.basename(source_path)))
+            os.rename(staging_dir, os.path.join(self.root, key))
+            self._bytes += os.path.getsize(source_path)
+            return self._evict()
+
+    def _eviction_order(self):
+        """Entries least recently used first, with ones no job views first of all
+        since removing them frees disk"""
+        return sorted(
+            self._entries(),
+            key=lambda entry: (os.stat(entry[1]).st_nlink > 1, entry[3])
+        )
+
+    def _remove(self, key, path, size):
+        """Drop an entry, returns the bytes of disk this frees"""
+        # A file still linked into a job directory keeps its bytes on disk
+        unshared = os.stat(path).st_nlink == 1
+        shutil.rmtree(os.path.join(self.root, key), ignore_errors=True)
+        self._bytes -= size
+        self.stats['evictions'] += 1
+        return size if unshared else 0
+
+    def _evict(self):
+        """Drop least recently used artifacts until the store fits max_bytes,
+        returns the bytes of disk freed"""
+        freed = 0
+        if self._bytes <= self.max_bytes:
+            return freed
+        for key, path, size, _ in self._eviction_order():
+            if self._bytes <= self.max_bytes:
+                break
+            freed += self._remove(key, path, size)
+        return freed
+
+    def shrink(self, nbytes):
+        """Evict unreferenced artifacts, least recently used first, until nbytes
+        of disk are freed. Returns the bytes actually freed."""
+        freed = 0
+        with self._lock:
+            for key, path, size, _ in self._eviction_order():
+                if freed >= nbytes:
+                    break
+                # Still linked into a job directory, so removing it frees nothing
+                if os.stat(path).st_nlink > 1:
+                    continue
+                freed += self._remove(key, path, size)
+        return freed
+
+    def snapshot(self):
+        """Counters and sizes for /health"""
+        with self._lock:
+            return dict(self.stats, bytes=self._bytes, max_bytes=self.max_bytes)
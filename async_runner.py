@@ -0,0 +1,262 @@
+"""One asyncio event loop that runs child processes for the threaded app.
+
+A download used to hold four threads for its yt-dlp run: the worker blocked
+on the process, a reader per pipe and a watchdog. Here a single loop thread
+reads every child's pipes and runs every watchdog, so the worker thread only
+waits for the result, and short commands (``yt-dlp -J``, ffmpeg) start no
+threads at all.
+
+Any thread hands work to the loop through submit(), which returns a
+concurrent.futures.Future. Callbacks given to stream() and open() run on
+the loop thread and must not block.
+"""
+import asyncio
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from pipeline import OutputTail, ProcessResult
+
+# asyncio's per-line buffer; longer lines (never useful for classification) are dropped
+LINE_LIMIT = 256 * 1024
+
+
+class ProcessHandle:
+    """Kill switch for a child the loop has started or is about to start.
+
+    kill() is safe from any thread; a kill before the process exists takes
+    effect as soon as it is spawned.
+    """
+
+    def __init__(self, runner):
+        self._runner = runner
+        self._process = None
+        self.killed = False
+
+    def kill(self):
+        self._runner.call_soon(self._kill)
+
+    def _kill(self):
+        self.killed = True
+        if self._process is not None and self._process.returncode is None:
+            self._process.kill()
+
+    def _attach(self, process):
+        self._process = process
+        if self.killed:
+            process.kill()
+
+
+class PipedProcess:
+    """A child whose binary stdout the caller reads in chunks.
+
+    The reads happen on the loop and stderr is drained there into an
+    OutputTail. read(), kill() and close() are safe from any thread.
+    """
+
+    def __init__(self, runner, command, process):
+        self.args = command
+        self.stderr_tail = OutputTail()
+        self.kill_reason = None  # set when the check killed the process
+        self.returncode = None
+        self._runner = runner
+        self._process = process
+        self._handle = ProcessHandle(runner)
+        self._handle._attach(process)
+        self._supervisor = None
+
+    def read(self, size):
+        """Up to size bytes of stdout, as soon as any are available; b'' at EOF"""
+        return self._runner.submit(self._process.stdout.read, size).result()
+
+    def kill(self):
+        self._handle.kill()
+
+    def close(self):
+        """Kill the process if it is still running and wait for it, returns its exit code"""
+        self.kill()
+        self.returncode = self._runner.submit(self._close).result()
+        return self.returncode
+
+    async def _close(self):
+        # The child can't be reaped until its stdout pipe is drained
+        while await self._process.stdout.read(LINE_LIMIT):
+            pass
+        return await self._supervisor
+
+
+async def _read_lines(stream, on_line):
+    while True:
+        try:
+            line = await stream.readline()
+        except ValueError:
+            continue  # Over LINE_LIMIT; asyncio already discarded it
+        if not line:
+            return
+        on_line(line.decode('utf-8', errors='replace'))
+
+
+def _use_pidfd_watcher(loop):
+    """Wait for children on the loop through pidfds where possible.
+
+    Before Python 3.12 asyncio's default child watcher blocks one thread per
+    child in waitpid(), which would bring back a thread per download.
+    """
+    if sys.version_info >= (3, 12) or not hasattr(os, 'pidfd_open'):
+        return
+    try:
+        os.close(os.pidfd_open(os.getpid()))
+    except OSError:
+        return  # Kernel or sandbox without pidfd support
+    watcher = asyncio.PidfdChildWatcher()
+    watcher.attach_loop(loop)
+    asyncio.set_child_watcher(watcher)
+
+
+class AsyncRunner:
+    def __init__(self):
+        self._loop = None
+        self._loop_pid = None
+        self._lock = threading.Lock()
+        self.running = 0  # children alive right now, read by metrics
+
+    def start(self):
+        """Start the loop thread if this process doesn't have one, returns the loop"""
+        with self._lock:
+            # A forked worker inherits the attribute but not the thread
+            if self._loop is not None and self._loop_pid == os.getpid():
+                return self._loop
+            loop = asyncio.new_event_loop()
+            _use_pidfd_watcher(loop)
+            thread = threading.Thread(target=loop.run_forever, name='process-runner')
+            thread.daemon = True
+            thread.start()
+            self._loop = loop
+            self._loop_pid = os.getpid()
+            return loop
+
+    def call_soon(self, fn, *args):
+        self.start().call_soon_threadsafe(fn, *args)
+
+    def submit(self, coroutine_fn, *args):
+        """Run coroutine_fn(*args) on the loop, returns a concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coroutine_fn(*args), self.start())
+
+    async def _spawn(self, command):
+        process = await asyncio.create_subprocess_exec(
+            *command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE, limit=LINE_LIMIT)
+        self.running += 1
+        return process
+
+    def capture(self, command, timeout, check=False, handle=None):
+        """subprocess.run(capture_output=True, text=True) keeping only stderr's tail.
+
+        Blocks the calling thread. stdout is read in full - callers parse it,
+        e.g. ``yt-dlp -J`` - while stderr goes through an OutputTail. Returns
+        a ProcessResult and raises TimeoutExpired / CalledProcessError like
+        subprocess.run. handle, a ProcessHandle, lets other threads kill the
+        child meanwhile.
+        """
+        result = self.submit(self._capture, command, timeout, handle).result()
+        if check:
+            result.check_returncode()
+        return result
+
+    async def _capture(self, command, timeout, handle):
+        process = await self._spawn(command)
+        if handle is not None:
+            handle._attach(process)
+        stderr_tail = OutputTail()
+        try:
+            stdout, _ = await asyncio.wait_for(asyncio.gather(
+                process.stdout.read(), _read_lines(process.stderr, stderr_tail.append)), timeout)
+            returncode = await process.wait()
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise subprocess.TimeoutExpired(command, timeout, stderr=stderr_tail.text())
+        finally:
+            if process.returncode is None:
+                process.kill()
+            self.running -= 1
+        return ProcessResult(command, returncode, stdout.decode('utf-8', errors='replace'), stderr_tail.text(),
+                             stderr_tail.outcome)
+
+    def open(self, command, check=None, check_interval=1.0):
+        """Start a command whose stdout the caller reads itself, returns a PipedProcess.
+
+        Blocks until the child has started. check(elapsed) works as in
+        stream(); the reason it returns ends up in kill_reason.
+        """
+        return self.submit(self._open, command, check, check_interval).result()
+
+    async def _open(self, command, check, check_interval):
+        process = await self._spawn(command)
+        piped = PipedProcess(self, command, process)
+        piped._supervisor = asyncio.ensure_future(self._supervise(piped, check, check_interval))
+        return piped
+
+    async def _supervise(self, piped, check, check_interval):
+        process = piped._process
+        started = time.monotonic()
+        try:
+            stderr_reader = asyncio.ensure_future(_read_lines(process.stderr, piped.stderr_tail.append))
+            exited = asyncio.ensure_future(process.wait())
+            while not exited.done():
+                await asyncio.wait([exited], timeout=check_interval)
+                if check is not None and piped.kill_reason is None and not exited.done():
+                    piped.kill_reason = check(time.monotonic() - started)
+                    if piped.kill_reason:
+                        process.kill()
+            await stderr_reader
+            return exited.result()
+        finally:
+            if process.returncode is None:
+                process.kill()
+            self.running -= 1
+
+    def stream(self, command, handle_line, check=None, check_interval=1.0):
+        """Start a long-running command, returns (ProcessHandle, Future).
+
+        handle_line(line) sees every output line and returns True when it
+        consumed it; other lines go to the stream's OutputTail. check(elapsed)
+        runs every check_interval seconds and returns a reason to kill the
+        process, or None. The Future resolves to (ProcessResult with the
+        tails as its output, kill reason or None).
+        """
+        handle = ProcessHandle(self)
+        future = self.submit(self._stream, command, handle, handle_line, check, check_interval)
+        return handle, future
+
+    async def _stream(self, command, handle, handle_line, check, check_interval):
+        stdout_tail, stderr_tail = OutputTail(), OutputTail()
+
+        def reader(tail):
+            def on_line(line):
+                if not handle_line(line.rstrip('\n')):
+                    tail.append(line)
+            return on_line
+
+        process = await self._spawn(command)
+        started = time.monotonic()
+        handle._attach(process)
+        kill_reason = None
+        try:
+            readers = asyncio.gather(_read_lines(process.stdout, reader(stdout_tail)),
+                                     _read_lines(process.stderr, reader(stderr_tail)))
+            while not readers.done():
+                await asyncio.wait([readers], timeout=check_interval)
+                if check is not None and kill_reason is None and not readers.done():
+                    kill_reason = check(time.monotonic() - started)
+                    if kill_reason:
+                        process.kill()
+            readers.result()
+            returncode = await process.wait()
+        finally:
+            if process.returncode is None:
+                process.kill()
+            self.running -= 1
+        result = ProcessResult(command, returncode, stdout_tail.text(), stderr_tail.text(), stderr_tail.outcome)
+        return result, kill_reason
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""Deterministic stand-in for the yt-dlp CLI, for benchmarks.
+
+It understands the subset of options the service passes: -J, --flat-playlist,
+--load-info-json, --output/-o (including "-" for stdout), -x, --progress and
+the progress template. Behaviour is set through the environment:
+
+  FAKE_YTDLP_EXTRACT_SECONDS      time spent "extracting" unless --load-info-json is given (0.2)
+  FAKE_YTDLP_SIZE                 media size in bytes (1048576)
+  FAKE_YTDLP_BYTES_PER_SECOND     download speed when generating bytes locally (0 = unthrottled)
+  FAKE_YTDLP_MEDIA_URL            fetch media from this origin instead, e.g. http://127.0.0.1:8900
+  FAKE_YTDLP_POSTPROCESS_SECONDS  time spent "converting" with -x (0.1)
+  FAKE_YTDLP_PLAYLIST_SIZE        entries returned by --flat-playlist (5)
+  FAKE_YTDLP_FAIL_PERCENT         share of URLs that fail, picked by URL hash (0)
+  FAKE_YTDLP_FAIL_MODE            error | 429 | cookies | private | stall (error)
+
+Failures depend only on the URL, so the same run can be repeated exactly.
+"""
+import json
+import os
+import re
+import sys
+import time
+import urllib.request
+import zlib
+
+CHUNK_SIZE = 64 * 1024
+VIDEO_ID_PATTERN = re.compile(r'(?:[?&]v=|youtu\.be/|/shorts/)([A-Za-z0-9_-]{11})')
+
+FAILURES = {
+    'error': 'ERROR: [youtube] {id}: Unable to download webpage: <urlopen error [Errno 111] Connection refused>',
+    '429': 'ERROR: [youtube] {id}: Unable to download webpage: HTTP Error 429: Too Many Requests',
+    'cookies': "ERROR: [youtube] {id}: Sign in to confirm you're not a bot. Use --cookies for the authentication.",
+    'private': 'ERROR: [youtube] {id}: Private video. Sign in if you\'ve been granted access to this video'
+}
+
+
+def env_float(name, default):
+    return float(os.environ.get(name, default))
+
+
+def option_value(args, *names):
+    for name in names:
+        if name in args:
+            return args[args.index(name) + 1]
+    return None
+
+
+def video_id(url):
+    match = VIDEO_ID_PATTERN.search(url)
+    return match.group(1) if match else format(zlib.crc32(url.encode()), '011x')[:11]
+
+
+def should_fail(url):
+    percent = env_float('FAKE_YTDLP_FAIL_PERCENT', 0)
+    return zlib.crc32(url.encode()) % 100 < percent
+
+
+def info_for(url, size):
+    vid = video_id(url)
+    return {
+        'id': vid,
+        'title': f'Benchmark video {vid}',
+        'duration': 60,
+        'webpage_url': url,
+        'extractor': 'youtube',
+        'formats': [
+            {'format_id': '18', 'ext': 'mp4', 'vcodec': 'avc1', 'acodec': 'mp4a.40.2', 'filesize': size},
+            {'format_id': '140', 'ext': 'm4a', 'vcodec': 'none', 'acodec': 'mp4a.40.2', 'filesize': size // 4}
+        ]
+    }
+
+
+def media_chunks(size, vid):
+    """Yield the media bytes, from the fake origin or generated locally"""
+    origin = os.environ.get('FAKE_YTDLP_MEDIA_URL')
+    if origin:
+        with urllib.request.urlopen(f"{origin.rstrip('/')}/media/{size}?id={vid}") as response:
+            while True:
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+    speed = env_float('FAKE_YTDLP_BYTES_PER_SECOND', 0)
+    pattern = (bytes(range(256)) * (CHUNK_SIZE // 256 + 1))[:CHUNK_SIZE]
+    sent = 0
+    while sent < size:
+        chunk = pattern[:min(CHUNK_SIZE, size - sent)]
+        if speed:
+            time.sleep(len(chunk) / speed)
+        sent += len(chunk)
+        yield chunk
+
+
+def main(args):
+    if '--version' in args:
+        print('2099.01.01 (benchmark stand-in)')
+        return 0
+
+    info_file = option_value(args, '--load-info-json')
+    if info_file:
+        # A saved extraction result: no page to fetch, so no extraction delay
+        with open(info_file) as f:
+            url = json.load(f)['webpage_url']
+    else:
+        url = args[-1]
+        time.sleep(env_float('FAKE_YTDLP_EXTRACT_SECONDS', 0.2))
+    vid = video_id(url)
+    size = int(os.environ.get('FAKE_YTDLP_SIZE', 1024 * 1024))
+
+    fail_mode = os.environ.get('FAKE_YTDLP_FAIL_MODE', 'error')
+    failing = should_fail(url)
+    if failing and fail_mode in FAILURES:
+        print(FAILURES[fail_mode].format(id=vid), file=sys.stderr)
+        return 1
+
+    if '-J' in args or '--dump-single-json' in args:
+        if '--flat-playlist' in args:
+            count = int(os.environ.get('FAKE_YTDLP_PLAYLIST_SIZE', 5))
+            entries = [{'_type': 'url', 'id': f'bench{vid[:2]}{i:04d}',
+                        'url': f'https://www.youtube.com/watch?v=bench{vid[:2]}{i:04d}'} for i in range(count)]
+            print(json.dumps({'_type': 'playlist', 'id': vid, 'title': 'Benchmark playlist', 'entries': entries}))
+        else:
+            print(json.dumps(info_for(url, size)))
+        return 0
+
+    output = option_value(args, '--output', '-o') or '%(title)s [%(id)s].%(ext)s'
+    extract_audio = '-x' in args or '--extract-audio' in args
+    ext = 'm4a' if extract_audio or 'audio' in (option_value(args, '-f', '--format') or '') else 'mp4'
+    show_progress = '--progress' in args
+
+    if output == '-':
+        for chunk in media_chunks(size, vid):
+            sys.stdout.buffer.write(chunk)
+        sys.stdout.buffer.flush()
+        return 0
+
+    title = f'Benchmark video {vid}'
+    path = output.replace('%(title)s', title).replace('%(id)s', vid).replace('%(ext)s', ext)
+    started = time.time()
+    downloaded = 0
+    with open(path + '.part', 'wb') as part:
+        for chunk in media_chunks(size, vid):
+            part.write(chunk)
+            downloaded += len(chunk)
+            if failing and fail_mode == 'stall' and downloaded >= size // 2:
+                # Stop making progress without exiting, like a dead connection
+                time.sleep(3600)
+            if show_progress:
+                elapsed = max(time.time() - started, 1e-6)
+                speed = downloaded / elapsed
+                eta = int((size - downloaded) / speed) if speed else 'NA'
+                print(f'[progress] {downloaded} {size} {speed:.1f} {eta}', flush=True)
+    os.rename(path + '.part', path)
+
+    if extract_audio:
+        audio_format = option_value(args, '--audio-format') or 'mp3'
+        if show_progress:
+            # yt-dlp writes post-processor progress to stderr under --quiet
+            print('[postprocess] FFmpegExtractAudio started', file=sys.stderr, flush=True)
+        time.sleep(env_float('FAKE_YTDLP_POSTPROCESS_SECONDS', 0.1))
+        converted = os.path.splitext(path)[0] + f'.{audio_format}'
+        os.rename(path, converted)
+        if show_progress:
+            print('[postprocess] FFmpegExtractAudio finished', file=sys.stderr, flush=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
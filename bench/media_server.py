@@ -0,0 +1,59 @@
+"""Local media origin for benchmarks.
+
+GET /media/<size>?rate=<bytes per second> returns size deterministic bytes,
+optionally throttled, so downloads exercise a real socket without touching
+YouTube. Run it standalone with ``python bench/media_server.py [port]``, or
+start it in-process with serve().
+"""
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+CHUNK_SIZE = 64 * 1024
+PATTERN = (bytes(range(256)) * (CHUNK_SIZE // 256))[:CHUNK_SIZE]
+
+
+class MediaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = url.path.strip('/').split('/')
+        if len(parts) != 2 or parts[0] != 'media' or not parts[1].isdigit():
+            self.send_error(404)
+            return
+        size = int(parts[1])
+        rate = float(parse_qs(url.query).get('rate', ['0'])[0])
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Content-Length', str(size))
+        self.end_headers()
+        sent = 0
+        while sent < size:
+            chunk = PATTERN[:min(CHUNK_SIZE, size - sent)]
+            if rate:
+                time.sleep(len(chunk) / rate)
+            self.wfile.write(chunk)
+            sent += len(chunk)
+
+    def log_message(self, format, *args):
+        pass  # One line per fetch would drown the benchmark output
+
+
+def serve(port=0):
+    """Start the server on a background thread, returns it (see server_address)"""
+    server = ThreadingHTTPServer(('127.0.0.1', port), MediaHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='media-server')
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8900
+    print(f'Serving fake media on http://127.0.0.1:{port}/media/<size>')
+    ThreadingHTTPServer(('127.0.0.1', port), MediaHandler).serve_forever()
@@ -0,0 +1,319 @@
+"""Load test the job pipeline against a fake yt-dlp and a local media origin.
+
+Starts the service as a subprocess with bench/fake_yt_dlp.py first on PATH,
+then drives it at a fixed concurrency and prints latency percentiles,
+throughput, and the peak RSS and open file descriptors of the server's
+process tree (read from /proc, so Linux only).
+
+Scenarios:
+  download  POST /start_download, poll /download_status, GET /download_file
+            (with --info-token, GET /get_info first and download from its result)
+  info      GET /get_info
+  mixed     alternate the two
+
+Examples:
+  python bench/run_bench.py --requests 200 --concurrency 16
+  python bench/run_bench.py --scenario info --distinct 20
+  python bench/run_bench.py --server gunicorn --size 5000000 --fail-percent 10 --fail-mode 429
+
+Service settings come from the environment as usual. The rate governor
+and queue limits get benchmark-friendly defaults unless they are set.
+"""
+import argparse
+import json
+import os
+import secrets
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import media_server
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+FINAL_STATUSES = ('completed', 'failed', 'cancelled')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def make_shim_dir():
+    """A directory holding a `yt-dlp` executable that runs the fake"""
+    shim_dir = tempfile.mkdtemp(prefix='ytdl-bench-')
+    shim = os.path.join(shim_dir, 'yt-dlp')
+    with open(shim, 'w') as f:
+        f.write(f'#!/bin/sh\nexec "{sys.executable}" "{os.path.join(BENCH_DIR, "fake_yt_dlp.py")}" "$@"\n')
+    os.chmod(shim, 0o755)
+    return shim_dir
+
+
+def start_server(args, port, shim_dir, media_url):
+    env = dict(os.environ)
+    env['PATH'] = shim_dir + os.pathsep + env.get('PATH', '')
+    env['PORT'] = str(port)
+    # The warm pool imports the real yt_dlp package, so force the CLI engine
+    env['YT_DLP_ENGINE'] = 'subprocess'
+    env['YT_DLP_DOWNLOAD_ENGINE'] = 'subprocess'
+    env['FAKE_YTDLP_SIZE'] = str(args.size)
+    env['FAKE_YTDLP_EXTRACT_SECONDS'] = str(args.extract_seconds)
+    env['FAKE_YTDLP_FAIL_PERCENT'] = str(args.fail_percent)
+    env['FAKE_YTDLP_FAIL_MODE'] = args.fail_mode
+    env['FAKE_YTDLP_MEDIA_URL'] = media_url
+    # Every benchmark URL is on one host; don't let the governor be the bottleneck
+    env.setdefault('RATE_LIMIT_RPS', '1000')
+    env.setdefault('RATE_LIMIT_MAX_RPS', '1000')
+    env.setdefault('RATE_LIMIT_BURST', '1000')
+    env.setdefault('MAX_QUEUE_SIZE', str(max(50, args.requests)))
+
+    if args.server == 'gunicorn':
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}',
+                   '--access-logfile', '/dev/null', 'main:create_app()']
+    else:
+        command = [sys.executable, 'main.py']
+    return subprocess.Popen(command, cwd=REPO_DIR, env=env,
+                            stdout=subprocess.DEVNULL, stderr=None if args.verbose else subprocess.DEVNULL)
+
+
+def wait_until_ready(base_url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(f'{base_url}/health', timeout=5) as response:
+                if response.status == 200:
+                    return
+        except (urllib.error.URLError, ConnectionError):
+            pass
+        time.sleep(0.2)
+    raise RuntimeError('Server did not become ready')
+
+
+def http(method, url, body=None, timeout=120):
+    """Returns (status, body bytes, headers)"""
+    data = json.dumps(body).encode() if body is not None else None
+    request = urllib.request.Request(url, data=data, method=method,
+                                     headers={'Content-Type': 'application/json'} if data else {})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status, response.read(), response.headers
+    except urllib.error.HTTPError as e:
+        return e.code, e.read(), e.headers
+
+
+# Fresh video IDs per run, so the artifact cache left by an earlier run can't skew results
+RUN_TOKEN = secrets.token_hex(2)
+
+
+def video_url(n, distinct):
+    index = n % distinct if distinct else n
+    return f'https://www.youtube.com/watch?v=b{RUN_TOKEN}{index:06d}'
+
+
+def run_download(base_url, url, args):
+    request = {'url': url, 'type': args.type}
+    if args.info_token:
+        # Like the web UI: look the video up first, then download from that extraction
+        status, _, headers = http('GET', f'{base_url}/get_info?url={urllib.request.quote(url, safe="")}')
+        if status != 200:
+            return f'info_{status}'
+        request['info_token'] = headers.get('X-Info-Token')
+    status, body, _ = http('POST', f'{base_url}/start_download', request)
+    if status != 200:
+        return f'start_{status}'
+    job_id = json.loads(body)['job_id']
+    while True:
+        status, body, _ = http('GET', f'{base_url}/download_status/{job_id}')
+        if status != 200:
+            return f'status_{status}'
+        job = json.loads(body)
+        if job['status'] in FINAL_STATUSES:
+            break
+        time.sleep(args.poll_interval)
+    if job['status'] != 'completed':
+        return job['status']
+    status, body, _ = http('GET', f"{base_url}{job['download_url']}")
+    if status != 200:
+        return f'file_{status}'
+    return 'ok'
+
+
+def run_info(base_url, url, args):
+    status, _, _ = http('GET', f'{base_url}/get_info?url={urllib.request.quote(url, safe="")}')
+    return 'ok' if status == 200 else f'info_{status}'
+
+
+def process_tree(root_pid):
+    """PIDs of root_pid and all its descendants"""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # The command name is parenthesised and may contain spaces
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    pids, stack = [], [root_pid]
+    while stack:
+        pid = stack.pop()
+        pids.append(pid)
+        stack.extend(children.get(pid, ()))
+    return pids
+
+
+def sample_resources(pid):
+    """(RSS bytes, open fds) summed over the process tree"""
+    rss = fds = 0
+    for tree_pid in process_tree(pid):
+        try:
+            with open(f'/proc/{tree_pid}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        rss += int(line.split()[1]) * 1024
+            fds += len(os.listdir(f'/proc/{tree_pid}/fd'))
+        except OSError:
+            continue
+    return rss, fds
+
+
+class ResourceSampler(threading.Thread):
+    def __init__(self, pid, interval=0.1):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = self.peak_fds = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            rss, fds = sample_resources(self.pid)
+            self.peak_rss = max(self.peak_rss, rss)
+            self.peak_fds = max(self.peak_fds, fds)
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def summarize(results, elapsed):
+    summary = {}
+    for scenario in sorted({scenario for scenario, _, _ in results}):
+        latencies = [latency for name, outcome, latency in results if name == scenario and outcome == 'ok']
+        outcomes = {}
+        for name, outcome, _ in results:
+            if name == scenario:
+                outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        summary[scenario] = {
+            'requests': sum(outcomes.values()),
+            'outcomes': outcomes,
+            'p50_seconds': percentile(latencies, 0.5),
+            'p99_seconds': percentile(latencies, 0.99),
+            'mean_seconds': statistics.mean(latencies) if latencies else None,
+            'per_second': len(latencies) / elapsed if elapsed else None
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario', choices=['download', 'info', 'mixed'], default='download')
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--distinct', type=int, default=0,
+                        help='cycle through this many video IDs to exercise caching and dedup (0 = all unique)')
+    parser.add_argument('--type', choices=['audio', 'video'], default='video')
+    parser.add_argument('--size', type=int, default=1024 * 1024, help='media bytes per download')
+    parser.add_argument('--extract-seconds', type=float, default=0.2)
+    parser.add_argument('--info-token', action='store_true',
+                        help='call /get_info before each download and pass its info_token')
+    parser.add_argument('--fail-percent', type=float, default=0)
+    parser.add_argument('--fail-mode', choices=['error', '429', 'cookies', 'private', 'stall'], default='error')
+    parser.add_argument('--poll-interval', type=float, default=0.05)
+    parser.add_argument('--server', choices=['flask', 'gunicorn'], default='flask')
+    parser.add_argument('--url', help='benchmark an already running server instead of starting one')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    parser.add_argument('--verbose', action='store_true', help="show the server's log output")
+    args = parser.parse_args()
+
+    media = media_server.serve()
+    media_url = f'http://127.0.0.1:{media.server_address[1]}'
+    server = shim_dir = None
+    if args.url:
+        base_url = args.url.rstrip('/')
+    else:
+        shim_dir = make_shim_dir()
+        port = free_port()
+        base_url = f'http://127.0.0.1:{port}'
+        server = start_server(args, port, shim_dir, media_url)
+
+    try:
+        wait_until_ready(base_url)
+        sampler = ResourceSampler(server.pid) if server else None
+        if sampler:
+            sampler.start()
+
+        def one(n):
+            scenario = args.scenario
+            if scenario == 'mixed':
+                scenario = 'download' if n % 2 else 'info'
+            runner = run_download if scenario == 'download' else run_info
+            started = time.time()
+            try:
+                outcome = runner(base_url, video_url(n, args.distinct), args)
+            except Exception as e:
+                outcome = type(e).__name__
+            return scenario, outcome, time.time() - started
+
+        started = time.time()
+        with ThreadPoolExecutor(args.concurrency) as executor:
+            results = list(executor.map(one, range(args.requests)))
+        elapsed = time.time() - started
+
+        report = {
+            'elapsed_seconds': elapsed,
+            'concurrency': args.concurrency,
+            'scenarios': summarize(results, elapsed)
+        }
+        if sampler:
+            sampler.stopped.set()
+            sampler.join()
+            report['peak_rss_bytes'] = sampler.peak_rss
+            report['peak_open_fds'] = sampler.peak_fds
+    finally:
+        if server:
+            server.terminate()
+            server.wait(timeout=10)
+        if shim_dir:
+            shutil.rmtree(shim_dir, ignore_errors=True)
+        media.shutdown()
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"{args.requests} requests at concurrency {args.concurrency} in {elapsed:.2f}s")
+    for scenario, stats in report['scenarios'].items():
+        p50 = f"{stats['p50_seconds']:.3f}s" if stats['p50_seconds'] is not None else '-'
+        p99 = f"{stats['p99_seconds']:.3f}s" if stats['p99_seconds'] is not None else '-'
+        print(f"  {scenario:8} p50 {p50}  p99 {p99}  {stats['per_second']:.1f}/s  outcomes {stats['outcomes']}")
+    if 'peak_rss_bytes' in report:
+        print(f"  server peak RSS {report['peak_rss_bytes'] / 1024 / 1024:.1f} MB, peak open fds {report['peak_open_fds']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Cached results of slow environment checks.
+
+Each probe is a function whose result (or error) is kept until the next
+refresh, so /health and per-job decisions such as "is ffmpeg installed"
+read a dict instead of spawning processes or walking directories. The
+first read probes synchronously; after that a background thread refreshes
+every interval seconds.
+"""
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class CapabilityRegistry:
+    def __init__(self, probes, interval):
+        self.probes = dict(probes)  # name -> fn()
+        self.interval = interval
+        self._results = {}
+        self._probed_at = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._thread = None
+        self._thread_pid = None
+
+    def refresh(self):
+        """Run every probe now and swap in the results"""
+        with self._refresh_lock:
+            results = {}
+            for name, probe in self.probes.items():
+                try:
+                    results[name] = probe()
+                except Exception as e:
+                    logger.error(f"Capability probe {name} failed: {e}")
+                    results[name] = {'error': str(e)}
+            with self._lock:
+                self._results = results
+                self._probed_at = time.time()
+
+    def _ensure_probed(self):
+        if self._probed_at is None:
+            self.refresh()
+
+    def get(self, name, default=None):
+        self._ensure_probed()
+        with self._lock:
+            return self._results.get(name, default)
+
+    def snapshot(self):
+        """Every probe's last result, plus when they ran"""
+        self._ensure_probed()
+        with self._lock:
+            return dict(self._results, probed_at=self._probed_at)
+
+    def start(self):
+        """Probe now and keep refreshing on a daemon thread"""
+        with self._lock:
+            # A forked worker inherits the attribute but not the thread
+            if self._thread is not None and self._thread_pid == os.getpid():
+                return
+            self._thread = threading.Thread(target=self._run, name='capability-probes')
+            self._thread.daemon = True
+            self._thread_pid = os.getpid()
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            self.refresh()
+            time.sleep(self.interval)
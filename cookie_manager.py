@@ -0,0 +1,110 @@
+"""Cookie files for yt-dlp, parsed once and handed out as private copies.
+
+Each source is a Netscape cookies.txt. It is parsed into a cookie jar once
+and only re-read when its mtime changes. yt-dlp writes cookies back to the
+file it is given, so each running command leases its own copy instead of
+sharing one path. Several sources can be configured; leases rotate through
+them to spread rate limits across accounts.
+"""
+import itertools
+import logging
+import os
+import threading
+from http.cookiejar import MozillaCookieJar, LoadError
+
+logger = logging.getLogger(__name__)
+
+
+class CookieLease:
+    """A private cookie file path for one yt-dlp run; path is None without cookies"""
+
+    def __init__(self, manager, source, copy):
+        self._manager = manager
+        self._source = source
+        self._copy = copy
+        self.path = copy['path'] if copy else None
+
+    def release(self):
+        if self._copy is not None:
+            self._manager._release(self._source, self._copy)
+            self._copy = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class CookieManager:
+    def __init__(self, source_paths, work_dir):
+        self.work_dir = work_dir
+        self._sources = [{'path': path, 'mtime': None, 'jar': None, 'version': 0, 'free': []}
+                         for path in source_paths if path]
+        self._rotation = itertools.cycle(range(len(self._sources))) if self._sources else None
+        self._copy_ids = itertools.count()
+        self._lock = threading.Lock()
+        self.stats = {'loads': 0, 'load_errors': 0, 'copies_written': 0}
+
+    def _refresh(self, source):
+        """Re-parse a source if it changed on disk. Must hold the lock."""
+        try:
+            mtime = os.stat(source['path']).st_mtime
+        except OSError:
+            source['jar'] = None
+            source['mtime'] = None
+            return
+        if mtime == source['mtime']:
+            return
+        jar = MozillaCookieJar()
+        try:
+            jar.load(source['path'], ignore_discard=True, ignore_expires=True)
+        except (LoadError, OSError) as e:
+            logger.error(f"Failed to load cookie file {source['path']}: {e}")
+            self.stats['load_errors'] += 1
+            jar = None
+        source['jar'] = jar
+        source['mtime'] = mtime
+        source['version'] += 1
+        self.stats['loads'] += 1
+        logger.info(f"Loaded cookies from {source['path']}")
+
+    def acquire(self):
+        """Lease a private cookie file from the next usable source in the rotation"""
+        with self._lock:
+            for _ in range(len(self._sources)):
+                source = self._sources[next(self._rotation)]
+                self._refresh(source)
+                if source['jar'] is None:
+                    continue
+                # work_dir is shared by every server worker process, so copies carry the PID
+                copy = source['free'].pop() if source['free'] else {
+                    'path': os.path.join(self.work_dir, f'cookies-{os.getpid()}-{next(self._copy_ids)}.txt'),
+                    'version': None
+                }
+                break
+            else:
+                return CookieLease(self, None, None)
+            jar, version = source['jar'], source['version']
+
+        # Only rewrite the copy when its source changed since it was last written
+        if copy['version'] != version:
+            os.makedirs(self.work_dir, exist_ok=True)
+            jar.save(copy['path'], ignore_discard=True, ignore_expires=True)
+            copy['version'] = version
+            with self._lock:
+                self.stats['copies_written'] += 1
+        return CookieLease(self, source, copy)
+
+    def _release(self, source, copy):
+        with self._lock:
+            source['free'].append(copy)
+
+    def snapshot(self):
+        """Counters for /health"""
+        with self._lock:
+            return dict(
+                self.stats,
+                sources=len(self._sources),
+                loaded_sources=sum(1 for source in self._sources if source['jar'] is not None)
+            )
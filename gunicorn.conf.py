@@ -0,0 +1,43 @@
+# Production server settings: gunicorn -c gunicorn.conf.py "main:create_app()"
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8080)}"
+
+# Threaded workers: SSE streams and streamed downloads hold a thread each,
+# capped by MAX_SSE_SUBSCRIBERS and MAX_CONCURRENT_STREAMS so the remaining
+# threads stay free for everything else (/health, /ready, job submissions).
+# One process by default: the download pool (DOWNLOAD_WORKERS), the per-host
+# caps (PER_HOST_CONCURRENCY), the rate governor, MAX_QUEUE_SIZE and the warm
+# yt-dlp pool are all per process, so every extra worker multiplies the load
+# put on YouTube. Raise WEB_CONCURRENCY only together with lower per-process
+# limits.
+worker_class = 'gthread'
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 32))
+
+# Long enough for /stream_download, which sends data as yt-dlp produces it
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = 30
+keepalive = 5
+
+# Each worker process builds its own thread and yt-dlp pools once it is
+# running (see post_worker_init), so this also works with --preload
+preload_app = False
+
+
+def post_worker_init(worker):
+    # Start the download pool, cleanup thread and warm yt-dlp workers before
+    # the first request instead of on it
+    import main
+    main.init_runtime()
+
+# Job status has to be visible from every worker process, not just the one
+# that accepted the job, and so do /get_info extractions: /start_download
+# looks up their info_token on whichever worker it lands on
+if workers > 1:
+    os.environ.setdefault('JOB_STORE', 'sqlite')
+    os.environ.setdefault('INFO_CACHE_DB', '/tmp/yt_dlp_downloads/info_cache.db')
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('LOG_LEVEL', 'info')
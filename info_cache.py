@@ -0,0 +1,158 @@
+"""Cache for yt-dlp info extraction results.
+
+Entries are keyed by canonical video ID and hold the raw ``yt-dlp -J`` JSON
+text. The memory tier is an LRU bounded by a byte budget, an optional SQLite
+tier keeps entries across restarts, and concurrent lookups for the same key
+are coalesced so only one extraction runs at a time.
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Flight:
+    """One in-progress load that other callers can wait on"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class InfoCache:
+    def __init__(self, ttl, max_bytes, db_path=None):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self.stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'coalesced': 0, 'evictions': 0}
+
+        self._db = None
+        self._db_lock = threading.Lock()
+        if db_path:
+            os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS info_cache '
+                '(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)'
+            )
+            self._db.execute('CREATE INDEX IF NOT EXISTS info_cache_expiry ON info_cache (expires_at)')
+            self._db.commit()
+
+    def _get_memory(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= now:
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def _remove(self, key):
+        _, value = self._entries.pop(key)
+        self._bytes -= len(value)
+
+    def _put_memory(self, key, value, expires_at):
+        if len(value) > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (expires_at, value)
+        self._bytes += len(value)
+        while self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.stats['evictions'] += 1
+
+    def _get_disk(self, key, now):
+        if self._db is None:
+            return None
+        with self._db_lock:
+            row = self._db.execute(
+                'SELECT value, expires_at FROM info_cache WHERE key = ? AND expires_at > ?', (key, now)
+            ).fetchone()
+        return row
+
+    def _put_disk(self, key, value, expires_at, now):
+        if self._db is None:
+            return
+        with self._db_lock:
+            self._db.execute('DELETE FROM info_cache WHERE expires_at <= ?', (now,))
+            self._db.execute(
+                'INSERT OR REPLACE INTO info_cache (key, value, expires_at) VALUES (?, ?, ?)',
+                (key, value, expires_at)
+            )
+            self._db.commit()
+
+    def get(self, key):
+        """Return a cached value without loading, or None"""
+        now = time.time()
+        with self._lock:
+            value = self._get_memory(key, now)
+        if value is not None:
+            return value
+        row = self._get_disk(key, now)
+        return row[0] if row else None
+
+    def get_or_load(self, key, loader):
+        """Return the cached value for key, calling loader() once on a miss.
+
+        Concurrent callers for the same key wait for the first caller's load
+        instead of starting their own; the loader's exception reaches all of them.
+        """
+        now = time.time()
+        with self._lock:
+            value = self._get_memory(key, now)
+            if value is not None:
+                self.stats['hits'] += 1
+                return value
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+            else:
+                self.stats['coalesced'] += 1
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            row = self._get_disk(key, now)
+            if row:
+                value, expires_at = row
+                with self._lock:
+                    self.stats['disk_hits'] += 1
+                    self._put_memory(key, value, expires_at)
+            else:
+                with self._lock:
+                    self.stats['misses'] += 1
+                value = loader()
+                now = time.time()
+                expires_at = now + self.ttl
+                with self._lock:
+                    self._put_memory(key, value, expires_at)
+                self._put_disk(key, value, expires_at, now)
+            flight.value = value
+            return value
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            flight.event.set()
+
+    def snapshot(self):
+        """Counters and sizes for /health"""
+        with self._lock:
+            return dict(self.stats, entries=len(self._entries), bytes=self._bytes,
+                        max_bytes=self.max_bytes, ttl=self.ttl, disk_tier=self._db is not None)
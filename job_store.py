@@ -0,0 +1,399 @@
+"""Job records and the stores that hold them.
+
+Three backends share one interface:
+
+* ``MemoryJobStore`` - a locked dict, for a single process
+* ``SqliteJobStore`` - a WAL-mode SQLite file shared by every worker process
+  on the machine
+* ``RedisJobStore`` - any Redis-protocol server, shared across instances
+
+All writes go through ``modify()``, which applies a function to the current
+record atomically, so status transitions and follower lists never race.
+Every backend indexes jobs by status, creation time and expiry time, so
+cleanup only touches the jobs it removes.
+"""
+import heapq
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field, fields, asdict, replace
+from typing import Optional
+
+FINAL_STATUSES = ('completed', 'failed', 'cancelled')
+
+# Free-text fields are cut to this many characters so every record has a
+# bounded size, whatever a failing yt-dlp run printed
+MAX_TEXT_LENGTH = 1000
+TEXT_FIELDS = ('message', 'error', 'help')
+
+
+@dataclass(slots=True)
+class Job:
+    id: str
+    url: str
+    type: str
+    download_dir: str
+    status: str = 'queued'
+    message: str = ''
+    created_at: float = field(default_factory=time.time)
+    public_mode: bool = False
+    using_cookies: Optional[bool] = None
+    filename: Optional[str] = None
+    error: Optional[str] = None
+    help: Optional[str] = None
+    progress: Optional[dict] = None
+    format_args: list = field(default_factory=list)
+    audio_codecs: list = field(default_factory=list)  # acceptable outputs, preferred first
+    artifact_key: Optional[str] = None
+    info_token: Optional[str] = None  # /get_info extraction to download from
+    storage_key: Optional[str] = None  # object holding the file in remote storage
+    leader: Optional[str] = None
+    followers: list = field(default_factory=list)
+    expires_at: Optional[float] = None
+    children: list = field(default_factory=list)  # job IDs, set on batch records
+
+    def to_json(self):
+        return json.dumps(asdict(self))
+
+    @classmethod
+    def from_json(cls, data):
+        values = json.loads(data)
+        known = {f.name for f in fields(cls)}
+        return cls(**{key: value for key, value in values.items() if key in known})
+
+    def limit_text(self):
+        """Truncate the free-text fields to MAX_TEXT_LENGTH"""
+        for name in TEXT_FIELDS:
+            value = getattr(self, name)
+            if value is not None and len(value) > MAX_TEXT_LENGTH:
+                setattr(self, name, value[:MAX_TEXT_LENGTH - 3] + '...')
+
+    def copy(self):
+        return replace(
+            self,
+            progress=dict(self.progress) if self.progress is not None else None,
+            format_args=list(self.format_args),
+            audio_codecs=list(self.audio_codecs),
+            followers=list(self.followers),
+            children=list(self.children)
+        )
+
+
+class TransitionError(Exception):
+    """Raised inside modify() functions to leave a job untouched"""
+
+
+class JobStoreBase:
+    """Helpers built on each backend's atomic modify()"""
+
+    def update(self, job_id, **changes):
+        """Set fields on a job, returning the updated job or None if it is gone"""
+        def apply(job):
+            for name, value in changes.items():
+                setattr(job, name, value)
+        return self.modify(job_id, apply)
+
+    def transition(self, job_id, from_statuses, **changes):
+        """Apply changes only while the job's status is one of from_statuses.
+
+        Returns the updated job, or None when the job is missing or has
+        already moved on to another status.
+        """
+        def apply(job):
+            if job.status not in from_statuses:
+                raise TransitionError(job.status)
+            for name, value in changes.items():
+                setattr(job, name, value)
+        try:
+            return self.modify(job_id, apply)
+        except TransitionError:
+            return None
+
+    def add_follower(self, leader_id, follower_id):
+        """Attach follower_id to a leader that is still queued or processing.
+
+        Returns the updated leader, or None when it has already finished.
+        """
+        def apply(job):
+            if job.status not in ('queued', 'processing'):
+                raise TransitionError(job.status)
+            job.followers.append(follower_id)
+        try:
+            return self.modify(leader_id, apply)
+        except TransitionError:
+            return None
+
+
+class MemoryJobStore(JobStoreBase):
+    def __init__(self):
+        self._jobs = OrderedDict()  # kept in created_at order for created_before()
+        self._by_status = {}
+        self._expiry_heap = []
+        self._lock = threading.RLock()
+
+    def _index(self, job):
+        self._by_status.setdefault(job.status, set()).add(job.id)
+        if job.expires_at is not None:
+            heapq.heappush(self._expiry_heap, (job.expires_at, job.id))
+
+    def _unindex(self, job):
+        ids = self._by_status.get(job.status)
+        if ids:
+            ids.discard(job.id)
+
+    def create(self, job):
+        with self._lock:
+            stored = job.copy()
+            stored.limit_text()
+            newest = next(reversed(self._jobs.values()), None)
+            self._jobs[job.id] = stored
+            if newest is not None and stored.created_at < newest.created_at:
+                # Rare: a record with an older timestamp, e.g. created by hand
+                self._jobs = OrderedDict(sorted(self._jobs.items(), key=lambda item: item[1].created_at))
+            self._index(stored)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.copy() if job else None
+
+    def modify(self, job_id, fn):
+        """Apply fn(job) atomically and return the updated job, or None if missing.
+
+        fn may raise TransitionError to abort without changes.
+        """
+        with self._lock:
+            current = self._jobs.get(job_id)
+            if current is None:
+                return None
+            job = current.copy()
+            fn(job)
+            job.limit_text()
+            self._unindex(current)
+            self._jobs[job_id] = job
+            self._by_status.setdefault(job.status, set()).add(job.id)
+            if job.expires_at is not None and job.expires_at != current.expires_at:
+                heapq.heappush(self._expiry_heap, (job.expires_at, job.id))
+            return job.copy()
+
+    def delete(self, job_id):
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+            if job:
+                self._unindex(job)
+
+    def list(self, status=None):
+        with self._lock:
+            if status is None:
+                return [job.copy() for job in self._jobs.values()]
+            return [self._jobs[job_id].copy() for job_id in self._by_status.get(status, ())]
+
+    def count(self, status=None):
+        with self._lock:
+            if status is None:
+                return len(self._jobs)
+            return len(self._by_status.get(status, ()))
+
+    def created_before(self, cutoff):
+        """Jobs created before cutoff, oldest first"""
+        with self._lock:
+            result = []
+            for job in self._jobs.values():
+                if job.created_at >= cutoff:
+                    break
+                result.append(job.copy())
+            return result
+
+    def expiring_before(self, cutoff):
+        """Jobs whose expires_at has passed cutoff"""
+        with self._lock:
+            result = []
+            while self._expiry_heap and self._expiry_heap[0][0] <= cutoff:
+                expires_at, job_id = heapq.heappop(self._expiry_heap)
+                job = self._jobs.get(job_id)
+                # Skip heap entries left behind by a later expiry change
+                if job is not None and job.expires_at == expires_at:
+                    result.append(job.copy())
+            return result
+
+
+class SqliteJobStore(JobStoreBase):
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as db:
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'id TEXT PRIMARY KEY, status TEXT NOT NULL, created_at REAL NOT NULL, '
+                'expires_at REAL, data TEXT NOT NULL)'
+            )
+            db.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)')
+            db.execute('CREATE INDEX IF NOT EXISTS jobs_created_at ON jobs (created_at)')
+            db.execute('CREATE INDEX IF NOT EXISTS jobs_expires_at ON jobs (expires_at)')
+
+    def _connect(self):
+        # One connection per thread; WAL lets readers run alongside the writer
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+    def _write(self, db, job):
+        job.limit_text()
+        db.execute(
+            'INSERT OR REPLACE INTO jobs (id, status, created_at, expires_at, data) VALUES (?, ?, ?, ?, ?)',
+            (job.id, job.status, job.created_at, job.expires_at, job.to_json())
+        )
+
+    def create(self, job):
+        self._write(self._connect(), job)
+
+    def get(self, job_id):
+        row = self._connect().execute('SELECT data FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return Job.from_json(row[0]) if row else None
+
+    def modify(self, job_id, fn):
+        db = self._connect()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            row = db.execute('SELECT data FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            if row is None:
+                db.execute('ROLLBACK')
+                return None
+            job = Job.from_json(row[0])
+            fn(job)
+            self._write(db, job)
+            db.execute('COMMIT')
+            return job
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+
+    def delete(self, job_id):
+        self._connect().execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+
+    def _query(self, sql, params=()):
+        return [Job.from_json(row[0]) for row in self._connect().execute(sql, params)]
+
+    def list(self, status=None):
+        if status is None:
+            return self._query('SELECT data FROM jobs ORDER BY created_at')
+        return self._query('SELECT data FROM jobs WHERE status = ? ORDER BY created_at', (status,))
+
+    def count(self, status=None):
+        if status is None:
+            return self._connect().execute('SELECT COUNT(*) FROM jobs').fetchone()[0]
+        return self._connect().execute('SELECT COUNT(*) FROM jobs WHERE status = ?', (status,)).fetchone()[0]
+
+    def created_before(self, cutoff):
+        return self._query('SELECT data FROM jobs WHERE created_at < ? ORDER BY created_at', (cutoff,))
+
+    def expiring_before(self, cutoff):
+        return self._query('SELECT data FROM jobs WHERE expires_at <= ?', (cutoff,))
+
+
+class RedisJobStore(JobStoreBase):
+    """Job store on a Redis-protocol server.
+
+    Pass a client (redis-py compatible, e.g. a local stand-in in tests) or a
+    URL. Records live in ``<prefix>job:<id>``; sorted sets and per-status sets
+    index them.
+    """
+
+    def __init__(self, url=None, client=None, prefix='ytdl:'):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+        self._redis = client
+        self._prefix = prefix
+
+    def _key(self, job_id):
+        return f'{self._prefix}job:{job_id}'
+
+    def _status_key(self, status):
+        return f'{self._prefix}status:{status}'
+
+    def _write(self, pipe, job, previous=None):
+        job.limit_text()
+        pipe.set(self._key(job.id), job.to_json())
+        if previous is not None and previous.status != job.status:
+            pipe.srem(self._status_key(previous.status), job.id)
+        pipe.sadd(self._status_key(job.status), job.id)
+        pipe.zadd(f'{self._prefix}created', {job.id: job.created_at})
+        if job.expires_at is not None:
+            pipe.zadd(f'{self._prefix}expires', {job.id: job.expires_at})
+
+    def create(self, job):
+        pipe = self._redis.pipeline()
+        self._write(pipe, job)
+        pipe.execute()
+
+    def get(self, job_id):
+        data = self._redis.get(self._key(job_id))
+        return Job.from_json(data) if data else None
+
+    def modify(self, job_id, fn):
+        from redis import WatchError
+        key = self._key(job_id)
+        while True:
+            with self._redis.pipeline() as pipe:
+                try:
+                    pipe.watch(key)
+                    data = pipe.get(key)
+                    if data is None:
+                        return None
+                    previous = Job.from_json(data)
+                    job = previous.copy()
+                    fn(job)
+                    pipe.multi()
+                    self._write(pipe, job, previous)
+                    pipe.execute()
+                    return job
+                except WatchError:
+                    continue  # Someone else updated the job first, retry
+
+    def delete(self, job_id):
+        job = self.get(job_id)
+        pipe = self._redis.pipeline()
+        pipe.delete(self._key(job_id))
+        if job is not None:
+            pipe.srem(self._status_key(job.status), job_id)
+        pipe.zrem(f'{self._prefix}created', job_id)
+        pipe.zrem(f'{self._prefix}expires', job_id)
+        pipe.execute()
+
+    def _load(self, job_ids):
+        if not job_ids:
+            return []
+        values = self._redis.mget([self._key(job_id.decode() if isinstance(job_id, bytes) else job_id) for job_id in job_ids])
+        return [Job.from_json(value) for value in values if value]
+
+    def list(self, status=None):
+        if status is None:
+            return self._load(self._redis.zrange(f'{self._prefix}created', 0, -1))
+        return self._load(list(self._redis.smembers(self._status_key(status))))
+
+    def count(self, status=None):
+        if status is None:
+            return self._redis.zcard(f'{self._prefix}created')
+        return self._redis.scard(self._status_key(status))
+
+    def created_before(self, cutoff):
+        return self._load(self._redis.zrangebyscore(f'{self._prefix}created', '-inf', f'({cutoff}'))
+
+    def expiring_before(self, cutoff):
+        return self._load(self._redis.zrangebyscore(f'{self._prefix}expires', '-inf', cutoff))
+
+
+def create_job_store(kind, path=None, url=None):
+    """Build the job store named by the JOB_STORE setting"""
+    if kind == 'sqlite':
+        return SqliteJobStore(path)
+    if kind == 'redis':
+        return RedisJobStore(url=url)
+    return MemoryJobStore()
@@ -3,237 +3,1135 @@ import shutil
 import uuid
 import threading
 import time
-from flask import Flask, request, jsonify, send_from_directory, after_this_request, render_template
+import heapq
+import itertools
+import importlib.util
+import hashlib
+import tempfile
+import queue
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import urlparse, parse_qs, quote
+from flask import Flask, Response, request, jsonify, send_from_directory, after_this_request, render_template, redirect
 import subprocess
 import json
 
+import ytdlp_worker
+from info_cache import InfoCache
+from artifact_store import ArtifactStore
+from job_store import Job, FINAL_STATUSES, create_job_store
+from cookie_manager import CookieManager, CookieLease
+from storage import create_storage
+from rate_governor import RateGovernor, RateLimitedError
+from zip_stream import stream_zip
+from metrics import MetricsRegistry, BYTES_BUCKETS
+from capabilities import CapabilityRegistry
+from url_canonicalizer import UnsupportedURL, canonicalize, canonicalize_playlist
+from pipeline import DownloadProfile, ProcessResult, build_command, failure_fields, select_format
+from async_runner import AsyncRunner, ProcessHandle
+
 app = Flask(__name__)
+# Let Apache/lighttpd send finished files themselves via X-Sendfile
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE', 'false').lower() == 'true'
 
 TEMP_DOWNLOAD_BASE_DIR = "/tmp/yt_dlp_downloads"
 COOKIE_FILE_PATH = os.environ.get('YT_DLP_COOKIE_FILE', '/etc/secrets/cookies.txt')
+# Optional rotating pool of cookie files (comma separated); defaults to the single file above
+COOKIE_FILE_PATHS = [path.strip() for path in os.environ.get('YT_DLP_COOKIE_FILES', COOKIE_FILE_PATH).split(',') if path.strip()]
+
+# Background job tracking: 'memory' (single process), 'sqlite' (shared by all
+# worker processes on this machine) or 'redis' (shared across instances)
+JOB_STORE = os.environ.get('JOB_STORE', 'memory')
+JOB_STORE_PATH = os.environ.get('JOB_STORE_PATH', os.path.join(TEMP_DOWNLOAD_BASE_DIR, 'jobs.db'))
+JOB_STORE_REDIS_URL = os.environ.get('JOB_STORE_REDIS_URL', 'redis://localhost:6379/0')
+# Progress is written to the store at most this often per job
+PROGRESS_WRITE_INTERVAL = 0.5
+# Characters of yt-dlp output logged or returned in an error response
+ERROR_OUTPUT_LENGTH = 500
+
+# Finished files stay downloadable (and resumable) this long after the first fetch
+DOWNLOAD_RETENTION_SECONDS = int(os.environ.get('DOWNLOAD_RETENTION_SECONDS', 600))
+# ...and this long when nobody fetches them
+UNFETCHED_RETENTION_SECONDS = int(os.environ.get('UNFETCHED_RETENTION_SECONDS', 1800))
+# Failed and cancelled jobs stay visible to status checks this long
+FAILED_JOB_RETENTION_SECONDS = int(os.environ.get('FAILED_JOB_RETENTION_SECONDS', 300))
+# Backstop for records that never reach a final state
+MAX_JOB_AGE_SECONDS = int(os.environ.get('MAX_JOB_AGE_SECONDS', 3600))
+# nginx internal location mapped to TEMP_DOWNLOAD_BASE_DIR, e.g. /protected-downloads
+X_ACCEL_REDIRECT_PREFIX = os.environ.get('X_ACCEL_REDIRECT_PREFIX')
+# The cleanup thread wakes at the next known expiry deadline, and at least this
+# often to pick up deadlines set by other processes sharing the job store
+CLEANUP_INTERVAL_SECONDS = int(os.environ.get('CLEANUP_INTERVAL_SECONDS', 60))
+# PID that started the cleanup thread; a forked server worker inherits the value but not the thread
+cleanup_thread_pid = None
+expiry_deadlines = []  # min-heap of expiry times set by this process
+cleanup_condition = threading.Condition()
+# Directories with no job record are removed once they are this old
+ORPHAN_GRACE_SECONDS = int(os.environ.get('ORPHAN_GRACE_SECONDS', 120))
+ORPHAN_SWEEP_INTERVAL_SECONDS = int(os.environ.get('ORPHAN_SWEEP_INTERVAL_SECONDS', 600))
+
+# Disk budget for everything under TEMP_DOWNLOAD_BASE_DIR. Finished jobs are
+# evicted oldest first to stay under it, and new jobs get 507 when even that
+# can't make room for JOB_DISK_ESTIMATE_BYTES per active job
+TEMP_DIR_MAX_BYTES = int(os.environ.get('TEMP_DIR_MAX_BYTES', 5 * 1024 * 1024 * 1024))
+JOB_DISK_ESTIMATE_BYTES = int(os.environ.get('JOB_DISK_ESTIMATE_BYTES', 25 * 1024 * 1024))
+# Bytes published and evicted since the last temp dir probe, so quota checks
+# add them to the probed usage instead of walking the tree
+disk_since_probe = {'written': 0, 'freed': 0}
+disk_since_probe_lock = threading.Lock()
+# PID that ran init_runtime, so forked server workers initialize again
+runtime_pid = None
+
+# yt-dlp execution engine: 'pool' runs yt-dlp in warm worker processes through
+# its Python API, 'subprocess' spawns the CLI for every call
+YT_DLP_ENGINE = os.environ.get('YT_DLP_ENGINE', 'pool' if importlib.util.find_spec('yt_dlp') else 'subprocess')
+# Downloads default to the CLI so each job keeps its own killable process
+YT_DLP_DOWNLOAD_ENGINE = os.environ.get('YT_DLP_DOWNLOAD_ENGINE', 'subprocess')
+YT_DLP_POOL_SIZE = int(os.environ.get('YT_DLP_POOL_SIZE', 2))
+
+ytdlp_pool = ytdlp_worker.WorkerPool(YT_DLP_POOL_SIZE)
+
+# /get_info metadata cache; set INFO_CACHE_DB to a file path to keep entries
+# across restarts and share them between worker processes
+INFO_CACHE_TTL = int(os.environ.get('INFO_CACHE_TTL', 1800))
+INFO_CACHE_MAX_BYTES = int(os.environ.get('INFO_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+INFO_CACHE_DB = os.environ.get('INFO_CACHE_DB')
+
+info_cache = InfoCache(INFO_CACHE_TTL, INFO_CACHE_MAX_BYTES, INFO_CACHE_DB)
+
+# /get_info returns an X-Info-Token naming its extraction result. A job started
+# with that token downloads from the saved JSON instead of extracting the page
+# again, written here for the length of the fetch.
+INFO_JSON_DIR = os.path.join(TEMP_DOWNLOAD_BASE_DIR, '_info')
+
+# Adaptive per-host request rate: halves and cools down when the host throttles
+# us (HTTP 429, the "not a bot" check), creeps back up while runs succeed
+RATE_LIMIT_RPS = float(os.environ.get('RATE_LIMIT_RPS', 2.0))
+RATE_LIMIT_MIN_RPS = float(os.environ.get('RATE_LIMIT_MIN_RPS', 0.1))
+RATE_LIMIT_MAX_RPS = float(os.environ.get('RATE_LIMIT_MAX_RPS', 10.0))
+RATE_LIMIT_BURST = int(os.environ.get('RATE_LIMIT_BURST', 4))
+# Interactive requests answer 429 instead of waiting longer than this for a token
+RATE_LIMIT_MAX_WAIT = float(os.environ.get('RATE_LIMIT_MAX_WAIT', 5))
+
+rate_governor = RateGovernor(RATE_LIMIT_RPS, RATE_LIMIT_MIN_RPS, RATE_LIMIT_MAX_RPS, RATE_LIMIT_BURST)
+
+# Download worker pool settings
+DOWNLOAD_WORKERS = int(os.environ.get('DOWNLOAD_WORKERS', 4))
+MAX_QUEUE_SIZE = int(os.environ.get('MAX_QUEUE_SIZE', 50))
+PER_HOST_CONCURRENCY = int(os.environ.get('PER_HOST_CONCURRENCY', 2))
+QUEUE_RETRY_AFTER = int(os.environ.get('QUEUE_RETRY_AFTER', 30))
+
+# Lower value runs first - audio jobs are small so they go ahead of video
+JOB_PRIORITIES = {'audio': 0, 'video': 1}
+
+# Pending jobs are a heap of (priority, sequence, job_id, host, target, args)
+pending_jobs = []
+running_per_host = {}
+scheduler_condition = threading.Condition()
+job_sequence = itertools.count()
+worker_threads = []
+# PID that started worker_threads; a forked server worker inherits the list but not the threads
+worker_threads_pid = None
+
+# Woken whenever job progress changes so /download_events can push updates
+job_events = threading.Condition()
+SSE_KEEPALIVE_SECONDS = 15
+# Every open event stream holds a server thread, so past this many the
+# endpoint answers 429 and the page polls /download_status instead. Keep it
+# well below the server's thread count (GUNICORN_THREADS).
+MAX_SSE_SUBSCRIBERS = int(os.environ.get('MAX_SSE_SUBSCRIBERS', 16))
+sse_slots = threading.BoundedSemaphore(MAX_SSE_SUBSCRIBERS)
+# A stream closes after this long even if its job is still running; the
+# browser's EventSource reconnects on its own, so a slot is never held by
+# one subscriber for a whole video's time budget
+SSE_MAX_STREAM_SECONDS = int(os.environ.get('SSE_MAX_STREAM_SECONDS', 120))
+
+# Makes yt-dlp print one machine-readable line per progress update
+PROGRESS_ARGS = [
+    '--progress',
+    '--newline',
+    '--progress-template', 'download:[progress] %(progress.downloaded_bytes)s %(progress.total_bytes,progress.total_bytes_estimate)s %(progress.speed)s %(progress.eta)s',
+    '--progress-template', 'postprocess:[postprocess] %(progress.postprocessor)s %(progress.status)s'
+]
+
+# Streaming delivery: yt-dlp writes to stdout and the response forwards each chunk
+STREAM_CHUNK_SIZE = 64 * 1024
+MAX_CONCURRENT_STREAMS = int(os.environ.get('MAX_CONCURRENT_STREAMS', 4))
+stream_slots = threading.BoundedSemaphore(MAX_CONCURRENT_STREAMS)
+
+# File extension and Content-Type of what the stream profile's formats send.
+# Its selectors only accept these containers, so a video without one fails
+# instead of being sent under the wrong name and type.
+STREAM_FORMATS = {
+    'video': ('mp4', 'video/mp4'),
+    'audio': ('m4a', 'audio/mp4')
+}
+
+# Download watchdog: kill a job once no bytes arrived for STALL_TIMEOUT_SECONDS,
+# or once it has run longer than its type's overall budget
+STALL_TIMEOUT_SECONDS = int(os.environ.get('STALL_TIMEOUT_SECONDS', 30))
+WATCHDOG_INTERVAL_SECONDS = 1
+JOB_TIME_BUDGETS = {
+    'audio': int(os.environ.get('AUDIO_JOB_BUDGET_SECONDS', 300)),
+    'video': int(os.environ.get('VIDEO_JOB_BUDGET_SECONDS', 900))
+}
+
+# Running yt-dlp processes by job ID, so a cancel can kill them
+active_processes = {}
+active_processes_lock = threading.Lock()
+
+# Event loop thread that owns every yt-dlp and ffmpeg child: it reads their
+# output and runs the download watchdogs, so a job or stream never needs
+# extra threads
+process_runner = AsyncRunner()
+
+# Fragments fetched in parallel for DASH/HLS formats (yt-dlp -N)
+CONCURRENT_FRAGMENTS = int(os.environ.get('CONCURRENT_FRAGMENTS', 4))
+# Most child jobs one /start_batch call may create
+MAX_BATCH_SIZE = int(os.environ.get('MAX_BATCH_SIZE', 25))
+
+# Audio outputs a client can accept: the yt-dlp filter that picks a native
+# stream, file extensions that can be served as-is, and ffmpeg encoder
+# arguments for when no native stream matches
+AUDIO_CODECS = {
+    'm4a': ('ext=m4a', ('m4a',), ['-c:a', 'aac', '-b:a', '96k']),
+    'opus': ('acodec=opus', ('opus', 'webm'), ['-c:a', 'libopus', '-b:a', '64k']),
+    'mp3': ('ext=mp3', ('mp3',), ['-c:a', 'libmp3lame', '-q:a', '9'])
+}
 
-# Background job tracking
-download_jobs = {}
+# Transcodes run on their own small pool, single-threaded and niced, so
+# ffmpeg can't starve the download workers of CPU
+POSTPROCESS_WORKERS = int(os.environ.get('POSTPROCESS_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+POSTPROCESS_NICE = int(os.environ.get('POSTPROCESS_NICE', 10))
+POSTPROCESS_TIMEOUT_SECONDS = int(os.environ.get('POSTPROCESS_TIMEOUT_SECONDS', 300))
+NICE_PATH = shutil.which('nice')
+
+postprocess_pool = ThreadPoolExecutor(max_workers=POSTPROCESS_WORKERS, thread_name_prefix='postprocess')
+
+PUBLIC_AUTH_FAILURE = {'message': 'Video is private/restricted. Try normal download with cookies.',
+                       'error': 'Requires authentication'}
+
+# One profile per download mode; every path runs the same pipeline with its profile
+DOWNLOAD_PROFILES = {
+    # Queued jobs from /start_download and /start_batch
+    'standard': DownloadProfile(
+        name='standard',
+        max_filesize_mb=int(os.environ.get('JOB_MAX_FILESIZE_MB', 15)),
+        socket_timeout=8,
+        retries=1,
+        fragment_retries=1,
+        user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+        video_format='worst[ext=mp4][height<=360]/worst',  # Lowest quality for speed
+        audio_fallback='worstaudio[ext=m4a]/worstaudio',
+        default_audio_codecs=('mp3',),
+        messages={'started': 'Starting download...', 'fetching': 'Downloading...',
+                  'completed': 'Download completed successfully!'}
+    ),
+    # Queued jobs from /start_public_download: no cookies, smaller files
+    'public': DownloadProfile(
+        name='public',
+        max_filesize_mb=int(os.environ.get('PUBLIC_MAX_FILESIZE_MB', 10)),
+        socket_timeout=10,
+        retries=1,
+        fragment_retries=1,
+        user_agent='Mozilla/5.0 (compatible; bot)',
+        video_format='worst[height<=240]/worst',  # Very low quality for public mode
+        use_cookies=False,
+        transcode=False,
+        extra_args=('--no-check-certificate',),
+        messages={'started': 'Starting public download (no cookies)...',
+                  'fetching': 'Downloading without authentication...',
+                  'completed': 'Public download completed!'},
+        failure_messages={
+            'cookies': PUBLIC_AUTH_FAILURE,
+            'age_restricted': PUBLIC_AUTH_FAILURE,
+            'private': PUBLIC_AUTH_FAILURE,
+            'stalled': {'message': 'Public download stalled. {detail}.'},
+            'budget': {'message': 'Public download took longer than {detail} seconds.'},
+            'error': {'message': 'Public download failed. Video may require authentication.'}
+        }
+    ),
+    # Synchronous handle_download: better quality, delivered in the same request
+    'direct': DownloadProfile(
+        name='direct',
+        max_filesize_mb=int(os.environ.get('DIRECT_MAX_FILESIZE_MB', 25)),
+        socket_timeout=15,
+        retries=2,
+        fragment_retries=2,
+        user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36',
+        video_format='best[ext=mp4][height<=480][filesize<=50M]/best[height<=480]/worst[ext=mp4]/worst',
+        audio_quality='bestaudio',
+        audio_fallback='bestaudio[ext=m4a]/bestaudio',
+        default_audio_codecs=('mp3',),
+        encoder_args={'mp3': ['-c:a', 'libmp3lame', '-b:a', '192k']},
+        extra_args=('--no-check-certificate', '--prefer-free-formats', '--file-access-retries', '2'),
+        failure_messages={
+            'file_size': {'message': 'Video file is too large (>{limit}MB limit). Try downloading audio instead or a shorter video.'},
+            'timeout': {'message': 'Download timed out. Try again with a shorter video.'}
+        }
+    ),
+    # /stream_download: yt-dlp writes to stdout, so single-file formats only -
+    # anything that needs merging or conversion can't go to a pipe
+    'stream': DownloadProfile(
+        name='stream',
+        max_filesize_mb=int(os.environ.get('STREAM_MAX_FILESIZE_MB', 25)),
+        socket_timeout=15,
+        retries=2,
+        fragment_retries=2,
+        user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36',
+        video_format='best[ext=mp4][height<=480]/worst[ext=mp4]',  # STREAM_FORMATS containers only
+        audio_fallback='bestaudio[ext=m4a]',
+        transcode=False,
+        extra_args=('--no-part',),
+        failure_messages={
+            'format_unavailable': {'message': 'This video has no single-file MP4/M4A format that can be streamed. '
+                                              'Try a background download instead.'},
+            'error': {'message': 'Stream failed or produced no data. Try a background download instead.'}
+        }
+    )
+}
+
+# In-flight downloads by artifact key, so identical jobs share one yt-dlp run
+inflight_downloads = {}
+inflight_lock = threading.Lock()
 
 if not os.path.exists(TEMP_DOWNLOAD_BASE_DIR):
     os.makedirs(TEMP_DOWNLOAD_BASE_DIR)
 
-@app.route('/')
-def home():
-    return render_template('index.html')
+job_store = create_job_store(JOB_STORE, path=JOB_STORE_PATH, url=JOB_STORE_REDIS_URL)
+cookie_manager = CookieManager(COOKIE_FILE_PATHS, os.path.join(TEMP_DOWNLOAD_BASE_DIR, '_cookies'))
+
+# Finished downloads shared across jobs, keyed by video + format settings
+ARTIFACT_CACHE_DIR = os.path.join(TEMP_DOWNLOAD_BASE_DIR, '_artifacts')
+ARTIFACT_CACHE_MAX_BYTES = int(os.environ.get('ARTIFACT_CACHE_MAX_BYTES', 2 * 1024 * 1024 * 1024))
 
-def background_download_no_cookies(job_id, video_url, download_type):
-    """Background download function without cookies for public videos"""
+artifact_store = ArtifactStore(ARTIFACT_CACHE_DIR, ARTIFACT_CACHE_MAX_BYTES)
+
+# Where /download_file delivers from: 'local' sends files from this instance's
+# disk, 's3' uploads them to an S3-compatible bucket (set STORAGE_S3_ENDPOINT_URL
+# for MinIO and the like) and redirects to a presigned URL
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'local')
+storage = create_storage(
+    STORAGE_BACKEND,
+    bucket=os.environ.get('STORAGE_S3_BUCKET'),
+    prefix=os.environ.get('STORAGE_S3_PREFIX', 'downloads/'),
+    endpoint_url=os.environ.get('STORAGE_S3_ENDPOINT_URL'),
+    region=os.environ.get('STORAGE_S3_REGION'),
+    presign_seconds=int(os.environ.get('STORAGE_PRESIGN_SECONDS', 600)),
+    part_size=int(os.environ.get('STORAGE_PART_SIZE_BYTES', 8 * 1024 * 1024))
+)
+
+# Exposed on /metrics, so we can see where job latency goes
+metrics = MetricsRegistry()
+extraction_seconds = metrics.histogram('ytdl_extraction_seconds', 'Time yt-dlp spent extracting video info', labelnames=['type'])
+download_seconds = metrics.histogram('ytdl_download_seconds', 'Time spent downloading media', labelnames=['type'])
+postprocess_seconds = metrics.histogram('ytdl_postprocess_seconds', 'Time spent in ffmpeg post-processing', labelnames=['type'])
+queue_wait_seconds = metrics.histogram('ytdl_queue_wait_seconds', 'Time jobs waited before a worker picked them up', labelnames=['type'])
+served_bytes = metrics.histogram('ytdl_served_bytes', 'Bytes sent per file response', BYTES_BUCKETS, ['endpoint'])
+job_outcomes = metrics.counter('ytdl_job_outcomes_total', 'Finished jobs by outcome or error category', ['outcome'])
+info_token_uses = metrics.counter('ytdl_info_token_total', 'Jobs started with an info_token, by whether the saved extraction was used', ['result'])
+metrics.gauge('ytdl_active_subprocesses', 'Running yt-dlp download and stream processes and ffmpeg transcodes', lambda: len(active_processes))
+metrics.gauge('ytdl_runner_processes', 'Child processes owned by the process runner event loop', lambda: process_runner.running)
+metrics.gauge('ytdl_queued_jobs', 'Jobs waiting for a download worker', lambda: len(pending_jobs))
+metrics.gauge('ytdl_temp_dir_bytes', 'Bytes used under the temp download directory, as of the last probe',
+              lambda: (capabilities.get('temp_dir') or {}).get('used_bytes', 0))
+
+def command_host(command):
+    """Upstream host a yt-dlp command talks to (its URL is the last argument), or None"""
+    if command[-1].startswith(('http://', 'https://')):
+        return get_url_host(command[-1])
+    return None
+
+def run_ytdlp(command, timeout, engine=None, check=False, max_wait=None):
+    """Run a yt-dlp command list through the configured engine.
+
+    Always returns a ProcessResult (and raises TimeoutExpired /
+    CalledProcessError) so callers don't care which engine ran it. stdout is
+    complete but stderr is only its tail (see pipeline.OutputTail), already
+    classified into the result's failure outcome. Commands
+    for a URL first wait for the host's rate governor, raising
+    RateLimitedError instead of waiting longer than max_wait.
+    """
+    host = command_host(command)
+    if host:
+        rate_governor.acquire(host, max_wait=max_wait)
+    engine = engine or YT_DLP_ENGINE
+    if engine == 'pool':
+        process = ProcessResult(command, *ytdlp_pool.run(command[1:], timeout=timeout))
+    else:
+        process = process_runner.capture(command, timeout=timeout)
+    if host:
+        rate_governor.report(host, process.stderr, process.returncode == 0)
+    if check:
+        process.check_returncode()
+    return process
+
+def notify_job_update():
+    """Wake up any /download_events streams waiting for job changes"""
+    with job_events:
+        job_events.notify_all()
+
+def parse_progress_number(value):
     try:
-        download_jobs[job_id]['status'] = 'processing'
-        download_jobs[job_id]['message'] = 'Starting public download (no cookies)...'
-        
-        specific_download_dir = download_jobs[job_id]['download_dir']
-        output_template = os.path.join(specific_download_dir, "%(title)s - %(id)s.%(ext)s")
-        
-        # Basic settings without any authentication
-        command = [
-            'yt-dlp',
-            '--no-warnings',
-            '--quiet',
-            '--socket-timeout', '10',
-            '--retries', '1',
-            '--fragment-retries', '1',
-            '--no-playlist',
-            '--max-filesize', '10M',  # Smaller limit for public downloads
-            '--output', output_template,
-            '--user-agent', 'Mozilla/5.0 (compatible; bot)',  # Simple user agent
-            '--no-check-certificate'
-        ]
-        
-        # Add format selection
-        if download_type == 'video':
-            command.extend(['-f', 'worst[height<=240]/worst'])  # Very low quality for public mode
-        elif download_type == 'audio':
-            command.extend(['-f', 'worstaudio'])  # No conversion, just raw audio
-        
-        command.append(video_url)
-        
-        download_jobs[job_id]['message'] = 'Downloading without authentication...'
-        
-        # Run with shorter timeout for public mode
-        process = subprocess.run(command, capture_output=True, text=True, timeout=15)
-        
-        downloaded_files = os.listdir(specific_download_dir)
-        if downloaded_files and process.returncode == 0:
-            download_jobs[job_id]['status'] = 'completed'
-            download_jobs[job_id]['filename'] = downloaded_files[0]
-            download_jobs[job_id]['message'] = 'Public download completed!'
-        else:
-            download_jobs[job_id]['status'] = 'failed'
-            stderr_text = process.stderr if process.stderr else 'Unknown error'
-            
-            if 'private' in stderr_text.lower() or 'unavailable' in stderr_text.lower():
-                download_jobs[job_id]['message'] = 'Video is private/restricted. Try normal download with cookies.'
-                download_jobs[job_id]['error'] = 'Requires authentication'
-            else:
-                download_jobs[job_id]['message'] = 'Public download failed. Video may require authentication.'
-                download_jobs[job_id]['error'] = stderr_text[-200:] if stderr_text else 'Unknown error'
-                
-    except subprocess.TimeoutExpired:
-        download_jobs[job_id]['status'] = 'failed'
-        download_jobs[job_id]['message'] = 'Public download timed out. Try normal download.'
+        return float(value)
+    except ValueError:
+        return None  # yt-dlp prints NA for unknown values
+
+def parse_progress_line(line, progress):
+    """Turn one yt-dlp progress template line into a new progress dict.
+
+    Returns None when the line is regular output rather than progress.
+    """
+    if line.startswith('[progress] '):
+        parts = line.split()
+        if len(parts) != 5:
+            return None
+        downloaded, total, speed, eta = (parse_progress_number(value) for value in parts[1:])
+        return {
+            'phase': 'download',
+            'downloaded_bytes': int(downloaded) if downloaded is not None else None,
+            'total_bytes': int(total) if total is not None else None,
+            'speed': speed,
+            'eta': int(eta) if eta is not None else None
+        }
+    if line.startswith('[postprocess] '):
+        parts = line.split()
+        return dict(progress, phase='postprocess', postprocessor=parts[1] if len(parts) > 1 else None)
+    return None
+
+class DownloadStalled(Exception):
+    """yt-dlp went STALL_TIMEOUT_SECONDS without downloading anything"""
+
+def run_ytdlp_with_progress(job_id, command, budget):
+    """Run a download command while streaming its progress into the job.
+
+    The process runs on process_runner's event loop, which also reads its
+    output and runs the watchdog; this thread only writes progress to the
+    store. The watchdog kills the process when no bytes arrive for
+    STALL_TIMEOUT_SECONDS (raising DownloadStalled) or when the whole run
+    exceeds budget seconds (raising TimeoutExpired). The process is
+    registered in active_processes so DELETE /download_jobs can kill it,
+    and the watchdog also kills it once the shared store shows the job
+    cancelled, for cancels handled by another server process.
+
+    Returns a ProcessResult like run_ytdlp, minus the progress lines and
+    with both streams cut down to an OutputTail. The pool engine has no
+    line output and no per-job process, so there the job only reports its
+    phase and only the budget applies.
+    """
+    if YT_DLP_DOWNLOAD_ENGINE == 'pool':
+        job_store.update(job_id, progress={'phase': 'download'})
+        return run_ytdlp(command, timeout=budget, engine='pool')
+    
+    job_store.update(job_id, progress={'phase': 'extract'})
+    # handle_line and the watchdog use this on the runner's loop thread, except
+    # 'cancelled', which note_status sets from this thread for the watchdog to read
+    progress_state = {'progress': {'phase': 'extract'}, 'written_at': 0.0, 'active_at': time.time(), 'cancelled': False}
+    phase_started = {}
+    # Store writes happen on this thread, never on the loop
+    progress_updates = queue.SimpleQueue()
+    
+    def handle_line(line):
+        previous = progress_state['progress']
+        progress = parse_progress_line(line, previous)
+        if progress is None:
+            # Regular output counts as activity, e.g. extraction messages
+            progress_state['active_at'] = time.time()
+            return False
+        phase_changed = progress['phase'] != previous['phase']
+        if phase_changed:
+            phase_started[progress['phase']] = time.time()
+        if phase_changed or progress.get('downloaded_bytes') != previous.get('downloaded_bytes'):
+            progress_state['active_at'] = time.time()
+        progress_state['progress'] = progress
+        # Throttle store writes; yt-dlp can print dozens of lines a second
+        now = time.time()
+        if phase_changed or now - progress_state['written_at'] >= PROGRESS_WRITE_INTERVAL:
+            progress_state['written_at'] = now
+            progress_updates.put(progress)
+        return True
+    
+    def watchdog(elapsed):
+        if progress_state['cancelled']:
+            return 'cancelled'
+        if elapsed > budget:
+            return 'budget'
+        # ffmpeg post-processing prints nothing until it's done
+        if (progress_state['progress']['phase'] != 'postprocess'
+                and time.time() - progress_state['active_at'] > STALL_TIMEOUT_SECONDS):
+            return 'stalled'
+        return None
+    
+    host = command_host(command)
+    if host:
+        rate_governor.acquire(host)
+    
+    # Right after the executable, so the URL or --load-info-json stays last
+    command = command[:1] + PROGRESS_ARGS + command[1:]
+    progress_state['active_at'] = time.time()
+    phase_started['extract'] = time.time()
+    process, result = process_runner.stream(command, handle_line, watchdog, WATCHDOG_INTERVAL_SECONDS)
+    result.add_done_callback(lambda _: progress_updates.put(None))
+    with active_processes_lock:
+        active_processes[job_id] = process
+    # The job may have been cancelled while it waited for a rate limit token
+    job = job_store.get(job_id)
+    if job is None or job.status == 'cancelled':
+        process.kill()
+    
+    def note_status(current):
+        # A cancel handled by another server process only shows up in the shared store
+        if current is None or current.status == 'cancelled':
+            progress_state['cancelled'] = True
+    
+    try:
+        status_checked_at = time.time()
+        while True:
+            try:
+                progress = progress_updates.get(timeout=WATCHDOG_INTERVAL_SECONDS)
+            except queue.Empty:
+                progress = {}
+            if progress is None:
+                break
+            if progress:
+                note_status(job_store.update(job_id, progress=progress))
+                notify_job_update()
+                status_checked_at = time.time()
+            elif time.time() - status_checked_at >= WATCHDOG_INTERVAL_SECONDS:
+                # Polled from this thread, about once a second, so the loop never waits on the store
+                note_status(job_store.get(job_id))
+                status_checked_at = time.time()
+        completed, kill_reason = result.result()
+    finally:
+        with active_processes_lock:
+            active_processes.pop(job_id, None)
+    
+    # Make sure the last progress update isn't lost to throttling
+    job_store.update(job_id, progress=progress_state['progress'])
+    
+    if host:
+        rate_governor.report(host, completed.stderr, completed.returncode == 0)
+    if completed.returncode == 0 and job is not None:
+        observe_phase_times(job.type, phase_started, time.time())
+    if kill_reason == 'stalled':
+        raise DownloadStalled(f"No download progress for {STALL_TIMEOUT_SECONDS} seconds")
+    if kill_reason == 'budget':
+        raise subprocess.TimeoutExpired(command, budget)
+    return completed
+
+def observe_phase_times(download_type, phase_started, finished_at):
+    """Split a successful run into extraction, download and post-processing time"""
+    download_at = phase_started.get('download')
+    postprocess_at = phase_started.get('postprocess')
+    if download_at is not None:
+        extraction_seconds.observe(download_at - phase_started['extract'], type=download_type)
+        download_seconds.observe((postprocess_at or finished_at) - download_at, type=download_type)
+    if postprocess_at is not None:
+        postprocess_seconds.observe(finished_at - postprocess_at, type=download_type)
+
+def unsupported_url_response(error):
+    """400 for a URL that failed canonicalization, before any yt-dlp run"""
+    return jsonify({"error": f"Unsupported URL. {error}."}), 400
+
+def get_url_host(video_url):
+    """Return the host a job talks to, used for per-host concurrency caps"""
+    host = (urlparse(video_url).hostname or '').lower()
+    for prefix in ('www.', 'm.', 'music.'):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+    if host == 'youtu.be':
+        host = 'youtube.com'
+    return host
+
+def ensure_download_workers():
+    """Start the fixed-size worker pool on first use in this process"""
+    global worker_threads_pid
+    start_cleanup_thread()
+    with scheduler_condition:
+        if worker_threads_pid == os.getpid():
+            return
+        worker_threads_pid = os.getpid()
+        worker_threads.clear()
+        for i in range(DOWNLOAD_WORKERS):
+            worker = threading.Thread(target=download_worker, name=f'download-worker-{i}')
+            worker.daemon = True
+            worker.start()
+            worker_threads.append(worker)
+
+def enqueue_job(job_id, target, args, download_type, video_url):
+    """Queue a job for the worker pool, returns False when the queue is full"""
+    ensure_download_workers()
+    priority = JOB_PRIORITIES.get(download_type, len(JOB_PRIORITIES))
+    with scheduler_condition:
+        if len(pending_jobs) >= MAX_QUEUE_SIZE:
+            return False
+        entry = (priority, next(job_sequence), job_id, get_url_host(video_url), target, args)
+        heapq.heappush(pending_jobs, entry)
+        scheduler_condition.notify()
+    return True
+
+def take_next_job():
+    """Pop the highest priority job whose host is below its concurrency cap.
+
+    Must be called with scheduler_condition held.
+    """
+    for entry in sorted(pending_jobs):
+        host = entry[3]
+        if running_per_host.get(host, 0) < PER_HOST_CONCURRENCY:
+            pending_jobs.remove(entry)
+            heapq.heapify(pending_jobs)
+            running_per_host[host] = running_per_host.get(host, 0) + 1
+            return entry
+    return None
+
+def download_worker():
+    """Worker loop that runs queued download jobs one at a time"""
+    while True:
+        with scheduler_condition:
+            entry = take_next_job()
+            while entry is None:
+                scheduler_condition.wait()
+                entry = take_next_job()
+        host, target, args = entry[3], entry[4], entry[5]
+        try:
+            target(*args)
+        except Exception as e:
+            app.logger.error(f"Download worker error for job {entry[2]}: {e}")
+        finally:
+            with scheduler_condition:
+                running_per_host[host] -= 1
+                if not running_per_host[host]:
+                    del running_per_host[host]
+                # A freed host slot may unblock a job another worker skipped
+                scheduler_condition.notify_all()
+
+def get_queue_position(job_id):
+    """1-based position of a job in the pending queue, or None if not queued"""
+    with scheduler_condition:
+        for position, entry in enumerate(sorted(pending_jobs), start=1):
+            if entry[2] == job_id:
+                return position
+    return None
+
+def count_freed_bytes(nbytes):
+    """Note disk freed since the last temp dir probe, returns nbytes"""
+    with disk_since_probe_lock:
+        disk_since_probe['freed'] += nbytes
+    return nbytes
+
+def unshared_bytes(directory):
+    """Bytes that removing directory frees: files the artifact cache also links to stay"""
+    total = 0
+    for name in os.listdir(directory):
+        try:
+            stat = os.stat(os.path.join(directory, name))
+        except FileNotFoundError:
+            continue
+        if stat.st_nlink == 1:
+            total += stat.st_size
+    return total
+
+def remove_job(job):
+    """Delete a job record and its download directory, returns the bytes of disk freed"""
+    freed = 0
+    try:
+        if os.path.exists(job.download_dir):
+            size = unshared_bytes(job.download_dir)
+            shutil.rmtree(job.download_dir)
+            freed = count_freed_bytes(size)
     except Exception as e:
-        download_jobs[job_id]['status'] = 'failed'
-        download_jobs[job_id]['message'] = f'Public download error: {str(e)}'
+        app.logger.error(f"Error cleaning up job {job.id}: {e}")
+    job_store.delete(job.id)
+    return freed
+
+def queue_full_response(job_id=None):
+    """Drop a job that could not be queued and tell the client to back off"""
+    job = job_store.get(job_id) if job_id else None
+    if job:
+        remove_job(job)
+    response = jsonify({
+        "error": "Download queue is full. Please try again shortly.",
+        "retry_after": QUEUE_RETRY_AFTER
+    })
+    response.headers['Retry-After'] = str(QUEUE_RETRY_AFTER)
+    return response, 429
+
+def job_profile(job):
+    """The download profile a queued job runs with"""
+    return DOWNLOAD_PROFILES['public' if job.public_mode else 'standard']
+
+def get_format_args(profile, download_type, audio_codecs=()):
+    """Select stage: yt-dlp format options for a download.
 
-def background_download(job_id, video_url, download_type):
-    """Background download function that runs in a separate thread"""
+    Audio is never converted by yt-dlp itself: a stream matching audio_codecs
+    is preferred, and anything else is transcoded on the post-processing pool.
+    """
+    return select_format(profile, download_type, [AUDIO_CODECS[codec][0] for codec in audio_codecs])
+
+def negotiate_audio_codecs(profile, download_type, accept_codecs=None):
+    """Audio outputs a download may deliver, preferred first; empty means whatever yt-dlp picks"""
+    if download_type != 'audio':
+        return []
+    if accept_codecs:
+        return list(dict.fromkeys(codec for codec in accept_codecs if codec in AUDIO_CODECS))
+    # Without a preference, deliver the profile's default when ffmpeg can make it
+    if profile.transcode and ffmpeg_path():
+        return list(profile.default_audio_codecs)
+    return []
+
+def invalid_accept_codecs(accept_codecs):
+    """Error response for a malformed accept_codecs list, or None"""
+    if accept_codecs is None:
+        return None
+    if (not isinstance(accept_codecs, list) or not all(isinstance(codec, str) for codec in accept_codecs)
+            or not any(codec in AUDIO_CODECS for codec in accept_codecs)):
+        return jsonify({
+            "error": f"'accept_codecs' must be a list of codec names including one of: {', '.join(AUDIO_CODECS)}"
+        }), 400
+    return None
+
+def transcode_target(profile, audio_codecs, filename):
+    """Codec a fetched file has to be converted to, or None to serve it as-is"""
+    if not profile.transcode or not audio_codecs or not ffmpeg_path():
+        return None
+    ext = os.path.splitext(filename)[1].lstrip('.').lower()
+    if any(ext in AUDIO_CODECS[codec][1] for codec in audio_codecs):
+        return None
+    return audio_codecs[0]
+
+def transcode_audio(source_path, codec, encoder_args=None, handle=None):
+    """Convert source_path to codec with a single-threaded, niced ffmpeg.
+
+    Replaces the source file and returns the path of the converted one.
+    handle, a ProcessHandle, lets a cancel kill ffmpeg.
+    """
+    target_path = os.path.splitext(source_path)[0] + f".{codec}"
+    command = [
+        ffmpeg_path() or 'ffmpeg', '-hide_banner', '-loglevel', 'error', '-nostdin', '-y',
+        '-i', source_path,
+        '-vn', '-threads', '1'
+    ] + (encoder_args or AUDIO_CODECS[codec][2]) + [target_path]
+    if NICE_PATH:
+        command = [NICE_PATH, '-n', str(POSTPROCESS_NICE)] + command
+    process_runner.capture(command, timeout=POSTPROCESS_TIMEOUT_SECONDS, check=True, handle=handle)
+    os.remove(source_path)
+    return target_path
+
+def transcode_job(job_id, filename, codec):
+    """Post-processing pool task: convert a job's download and publish it"""
+    job = job_store.update(job_id, message='Converting audio...',
+                           progress={'phase': 'postprocess', 'postprocessor': 'ffmpeg'})
+    notify_job_update()
+    if job is None or job.status == 'cancelled':
+        return
+    profile = job_profile(job)
+    started = time.time()
+    # Registered like a download's process so DELETE /download_jobs can kill ffmpeg
+    handle = ProcessHandle(process_runner)
+    with active_processes_lock:
+        active_processes[job_id] = handle
     try:
-        download_jobs[job_id]['status'] = 'processing'
-        download_jobs[job_id]['message'] = 'Starting download...'
-        
-        specific_download_dir = download_jobs[job_id]['download_dir']
-        output_template = os.path.join(specific_download_dir, "%(title)s - %(id)s.%(ext)s")
-        
-        # Ultra-aggressive settings for cloud deployment
-        command = [
-            'yt-dlp',
-            '--no-warnings',
-            '--quiet',  # Reduce output
-            '--sleep-requests', '0.1',
-            '--socket-timeout', '8',
-            '--retries', '1',
-            '--fragment-retries', '1',
-            '--no-playlist',
-            '--max-filesize', '15M',  # Even smaller limit
-            '--output', output_template,
-            '--user-agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        ]
-        
-        # Add format selection
-        if download_type == 'video':
-            command.extend(['-f', 'worst[ext=mp4][height<=360]/worst'])  # Lowest quality for speed
-        elif download_type == 'audio':
-            if shutil.which("ffmpeg"):
-                command.extend(['-x', '--audio-format', 'mp3', '--audio-quality', '9'])  # Lowest quality
-            else:
-                command.extend(['-f', 'worstaudio[ext=m4a]/worstaudio'])
-        
-        # Add cookies if available
-        temp_cookie_path = get_cookie_path()
-        if temp_cookie_path:
-            command.extend(['--cookies', temp_cookie_path])
-            download_jobs[job_id]['using_cookies'] = True
+        path = transcode_audio(os.path.join(job.download_dir, filename), codec, profile.encoder_args.get(codec),
+                               handle=handle)
+    except subprocess.CalledProcessError as e:
+        finish_job(job_id, 'transcode', status='failed', message='Audio conversion failed.',
+                   error=(e.stderr or 'Unknown error')[-300:])
+        return
+    except subprocess.TimeoutExpired as e:
+        finish_job(job_id, 'budget', status='failed', message=f'Audio conversion took longer than {e.timeout} seconds.')
+        return
+    except Exception as e:
+        finish_job(job_id, 'error', status='failed', message=f'Error: {str(e)}')
+        return
+    finally:
+        with active_processes_lock:
+            active_processes.pop(job_id, None)
+    postprocess_seconds.observe(time.time() - started, type=job.type)
+    # A cancel that came in as ffmpeg finished must not get the file uploaded
+    job = job_store.get(job_id)
+    if job is None or job.status == 'cancelled':
+        return
+    publish_download(job_id, os.path.basename(path), profile)
+
+def create_job(video_url, download_type, message, public_mode=False, accept_codecs=None, info_token=None):
+    """Create a queued job record and its download directory, returns the job ID"""
+    job_id = str(uuid.uuid4())
+    specific_download_dir = os.path.join(TEMP_DOWNLOAD_BASE_DIR, job_id)
+    os.makedirs(specific_download_dir, exist_ok=True)
+    
+    profile = DOWNLOAD_PROFILES['public' if public_mode else 'standard']
+    audio_codecs = negotiate_audio_codecs(profile, download_type, accept_codecs)
+    format_args = get_format_args(profile, download_type, audio_codecs)
+    job_store.create(Job(
+        id=job_id,
+        url=video_url,
+        type=download_type,
+        download_dir=specific_download_dir,
+        message=message,
+        public_mode=public_mode,
+        format_args=format_args,
+        audio_codecs=audio_codecs,
+        artifact_key=ArtifactStore.key_for(canonicalize(video_url).key, profile.name, download_type, format_args,
+                                          audio_codecs),
+        info_token=info_token
+    ))
+    return job_id
+
+def info_token_for(info_json):
+    """Token naming one cached extraction result"""
+    return hashlib.sha256(info_json.encode()).hexdigest()[:32]
+
+def stream_urls_expire_at(info):
+    """Earliest expiry of the stream URLs in an info dict, or None if they don't carry one"""
+    expiries = []
+    for fmt in info.get('formats') or [info]:
+        url = fmt.get('url') or ''
+        # YouTube signs stream URLs with expire=<unix time>, manifests with /expire/<unix time>/
+        expire = parse_qs(urlparse(url).query).get('expire', [None])[0]
+        if expire is None and '/expire/' in url:
+            expire = url.split('/expire/', 1)[1].split('/', 1)[0]
+        if expire and expire.isdigit():
+            expiries.append(int(expire))
+    return min(expiries) if expiries else None
+
+def save_info_json(job, min_remaining):
+    """Write the extraction a job's info_token names to disk for --load-info-json.
+
+    Returns the file path, or None when the token no longer matches the
+    cached extraction or its stream URLs expire within min_remaining seconds.
+    """
+    if not job.info_token:
+        return None
+    info_json = info_cache.get(canonicalize(job.url).key)
+    if info_json is None or info_token_for(info_json) != job.info_token:
+        info_token_uses.inc(result='missing')
+        return None
+    expires_at = stream_urls_expire_at(json.loads(info_json))
+    if expires_at is not None and expires_at - time.time() < min_remaining:
+        info_token_uses.inc(result='expired')
+        return None
+    os.makedirs(INFO_JSON_DIR, exist_ok=True)
+    path = os.path.join(INFO_JSON_DIR, f"{job.id}.json")
+    with open(path, 'w') as f:
+        f.write(info_json)
+    return path
+
+def submit_job(job_id, target):
+    """Complete a job from the artifact cache, attach it to an identical
+    in-flight job, or hand it to the worker pool.
+
+    Returns an error response when the queue is full, otherwise None.
+    """
+    if not dispatch_job(job_id, target):
+        return queue_full_response(job_id)
+    return None
+
+def dispatch_job(job_id, target):
+    """submit_job without the HTTP response, returns False when the queue is full"""
+    job = job_store.get(job_id)
+    filename = artifact_store.lookup(job.artifact_key, job.download_dir)
+    if filename:
+        job_store.update(job_id, status='completed', filename=filename,
+                         storage_key=storage.existing_key(job.artifact_key),
+                         message='Download completed (served from cache)!',
+                         expires_at=expiry_deadline('completed'))
+        job_outcomes.inc(outcome='cached')
+        return True
+    
+    with inflight_lock:
+        leader_id = inflight_downloads.get(job.artifact_key)
+        # Follow the running job instead of downloading the same file again
+        if leader_id and job_store.add_follower(leader_id, job_id):
+            job_store.update(job_id, leader=leader_id,
+                             message='Waiting for an identical download already in progress...')
+            return True
+        inflight_downloads[job.artifact_key] = job_id
+    
+    if not enqueue_job(job_id, run_download_job, (target, job_id), job.type, job.url):
+        with inflight_lock:
+            inflight_downloads.pop(job.artifact_key, None)
+        return False
+    return True
+
+def finish_job(job_id, outcome, **changes):
+    """Record a running job's outcome unless it was cancelled meanwhile.
+
+    outcome is the error category counted on /metrics. Returns the updated
+    job, or None when the job is no longer processing.
+    """
+    changes.setdefault('expires_at', expiry_deadline(changes['status']))
+    job = job_store.transition(job_id, ['processing'], **changes)
+    if job is not None:
+        job_outcomes.inc(outcome=outcome)
+    return job
+
+def expiry_deadline(status):
+    """When a job that just reached a final status should be cleaned up.
+
+    The deadline is also handed to the cleanup thread so it wakes up in time.
+    """
+    if status == 'completed':
+        deadline = time.time() + UNFETCHED_RETENTION_SECONDS
+    else:
+        deadline = time.time() + FAILED_JOB_RETENTION_SECONDS
+    schedule_expiry(deadline)
+    return deadline
+
+def schedule_expiry(deadline):
+    """Wake the cleanup thread early if deadline comes before everything it knows about"""
+    with cleanup_condition:
+        heapq.heappush(expiry_deadlines, deadline)
+        if expiry_deadlines[0] == deadline:
+            cleanup_condition.notify()
+
+def run_download_job(target, job_id):
+    """Run a job on a worker, then hand its result to any followers.
+
+    A target that passes the job on to the post-processing pool returns that
+    Future, and the job is wrapped up once it finishes instead.
+    """
+    job = job_store.get(job_id)
+    queue_wait_seconds.observe(time.time() - job.created_at, type=job.type)
+    pending = None
+    try:
+        pending = target(job_id, job.url, job.type)
+    finally:
+        if isinstance(pending, Future):
+            pending.add_done_callback(lambda _: complete_download_job(target, job))
         else:
-            download_jobs[job_id]['using_cookies'] = False
+            complete_download_job(target, job)
+
+def complete_download_job(target, job):
+    """Retire a finished job's in-flight entry and pass its result to followers"""
+    try:
+        with inflight_lock:
+            if inflight_downloads.get(job.artifact_key) == job.id:
+                del inflight_downloads[job.artifact_key]
+        leader = job_store.get(job.id)
+        if leader and leader.status == 'cancelled':
+            requeue_followers(leader, target)
+        elif leader:
+            for follower_id in leader.followers:
+                release_follower(leader, follower_id)
+    finally:
+        notify_job_update()
+
+def requeue_followers(job, target):
+    """Give the followers of a cancelled job a download of their own"""
+    for follower_id in job.followers:
+        if job_store.transition(follower_id, ['queued'], leader=None, message='Download queued...') is None:
+            continue
+        if not dispatch_job(follower_id, target):
+            job_store.update(follower_id, status='failed', message='Download queue is full. Please try again shortly.',
+                             expires_at=expiry_deadline('failed'))
+
+def release_follower(leader, follower_id):
+    """Give a follower its own hard link to the leader's file, or its failure"""
+    follower = job_store.get(follower_id)
+    if follower is None:
+        return
+    try:
+        filename = None
+        if leader.status == 'completed':
+            source = os.path.join(leader.download_dir, leader.filename)
+            link_or_copy(source, os.path.join(follower.download_dir, leader.filename))
+            filename = leader.filename
+        # A follower that was cancelled on its own keeps its status
+        job_store.transition(
+            follower_id,
+            ['queued'],
+            status=leader.status,
+            message=leader.message,
+            filename=filename,
+            storage_key=leader.storage_key,
+            error=leader.error,
+            help=leader.help,
+            using_cookies=leader.using_cookies,
+            progress=leader.progress,
+            expires_at=expiry_deadline(leader.status)
+        )
+        job_outcomes.inc(outcome='coalesced')
+    except Exception as e:
+        job_store.transition(follower_id, ['queued'], status='failed', message=f'Error: {str(e)}',
+                             expires_at=expiry_deadline('failed'))
+
+def link_or_copy(source, destination):
+    """Hard link a file, copying when the filesystem can't link"""
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+def publish_artifact(job_id):
+    """Share a completed job's file with later jobs for the same video and format"""
+    job = job_store.get(job_id)
+    try:
+        # Publishing can evict older artifacts to stay within the cache's budget
+        count_freed_bytes(artifact_store.publish(job.artifact_key, os.path.join(job.download_dir, job.filename)))
+    except Exception as e:
+        app.logger.error(f"Failed to cache artifact for job {job_id}: {e}")
+
+def publish_download(job_id, filename, profile, upload=None):
+    """Publish stage: put the file in storage, complete the job and share the
+    file through the artifact cache.
+
+    upload is the storage's streaming upload of this download, if it has one.
+    """
+    job = job_store.get(job_id)
+    if job is None:
+        return
+    storage_key = None
+    path = os.path.join(job.download_dir, filename)
+    with disk_since_probe_lock:
+        disk_since_probe['written'] += os.path.getsize(path)
+    try:
+        storage_key = upload.finish(path) if upload else storage.put(job.artifact_key, path)
+    except Exception as e:
+        # This instance can still send the file itself
+        app.logger.error(f"Failed to upload job {job_id} to storage: {e}")
+    if finish_job(job_id, 'completed', status='completed', filename=filename, storage_key=storage_key,
+                  message=profile.messages['completed']):
+        publish_artifact(job_id)
+
+@app.route('/')
+def home():
+    return render_template('index.html')
+
+def run_pipeline(job_id, video_url, download_type):
+    """Worker target for every queued job: resolve, select, fetch,
+    post-process and publish it with its mode's download profile.
+
+    Returns a Future when the job continues on the post-processing pool.
+    """
+    job = job_store.get(job_id)
+    if job is None:
+        return
+    profile = job_profile(job)
+    upload = None
+    try:
+        job = job_store.transition(job_id, ['queued'], status='processing', message=profile.messages['started'])
+        if job is None:
+            return
         
-        command.append(video_url)
+        # Resolve: the profile's options, plus a private cookie copy if it uses cookies,
+        # and the /get_info extraction when the job has a still-valid token.
+        # Select already happened - format_args are part of the job's artifact key.
+        budget = JOB_TIME_BUDGETS.get(download_type, JOB_TIME_BUDGETS['video'])
+        info_path = save_info_json(job, budget)
+        cookie_lease = cookie_manager.acquire() if profile.use_cookies else CookieLease(None, None, None)
+        output_template = os.path.join(job.download_dir, "%(title)s - %(id)s.%(ext)s")
+        command = build_command(profile, output_template, job.format_args, video_url,
+                                CONCURRENT_FRAGMENTS, cookie_lease.path, info_path)
         
-        download_jobs[job_id]['message'] = 'Downloading...'
+        with cookie_lease:
+            job_store.update(job_id, using_cookies=cookie_lease.path is not None, message=profile.messages['fetching'])
+            
+            # Remote storage receives the file while yt-dlp is still writing it
+            upload = storage.start_upload(job.artifact_key, job.download_dir)
+            try:
+                process = run_ytdlp_with_progress(job_id, command, budget)
+                if info_path:
+                    info_token_uses.inc(result='reused' if process.returncode == 0 else 'failed')
+                if info_path and process.returncode != 0:
+                    # Stream URLs can be revoked before they expire; extract the page afresh
+                    app.logger.warning(f"Download from saved info failed for job {job_id}, extracting again")
+                    command = build_command(profile, output_template, job.format_args, video_url,
+                                            CONCURRENT_FRAGMENTS, cookie_lease.path)
+                    process = run_ytdlp_with_progress(job_id, command, budget)
+            finally:
+                if info_path:
+                    os.remove(info_path)
         
-        # Run with very short timeout
-        process = subprocess.run(command, capture_output=True, text=True, timeout=20)
+        downloaded_files = os.listdir(job.download_dir)
+        if not downloaded_files or process.returncode != 0:
+            finish_job(job_id, process.outcome, status='failed',
+                       **failure_fields(profile, process.outcome, process.stderr))
+            return
         
-        downloaded_files = os.listdir(specific_download_dir)
-        if downloaded_files and process.returncode == 0:
-            download_jobs[job_id]['status'] = 'completed'
-            download_jobs[job_id]['filename'] = downloaded_files[0]
-            download_jobs[job_id]['message'] = 'Download completed successfully!'
-        else:
-            download_jobs[job_id]['status'] = 'failed'
-            stderr_text = process.stderr if process.stderr else 'Unknown error'
-            
-            # Provide specific error messages based on stderr content
-            if 'cookies' in stderr_text.lower() or 'sign in to confirm' in stderr_text.lower():
-                download_jobs[job_id]['message'] = 'YouTube requires cookies for this video. Please add fresh cookies.txt file.'
-                download_jobs[job_id]['error'] = 'Cookie authentication required'
-                download_jobs[job_id]['help'] = 'Export cookies from your browser and upload to Render secrets'
-            elif 'age-restricted' in stderr_text.lower():
-                download_jobs[job_id]['message'] = 'Age-restricted video requires authentication. Add cookies.txt file.'
-                download_jobs[job_id]['error'] = 'Age restriction detected'
-            elif 'private' in stderr_text.lower() or 'unavailable' in stderr_text.lower():
-                download_jobs[job_id]['message'] = 'Video is private, deleted, or unavailable.'
-                download_jobs[job_id]['error'] = 'Video access denied'
-            elif 'timeout' in stderr_text.lower():
-                download_jobs[job_id]['message'] = 'Download timed out. Try a shorter video.'
-                download_jobs[job_id]['error'] = 'Network timeout'
-            elif 'file size' in stderr_text.lower():
-                download_jobs[job_id]['message'] = 'Video file too large (>15MB limit). Try audio download.'
-                download_jobs[job_id]['error'] = 'File size exceeded'
-            else:
-                download_jobs[job_id]['message'] = 'Download failed. Try a different video or format.'
-                download_jobs[job_id]['error'] = stderr_text[-300:] if stderr_text else 'Unknown error'
+        codec = transcode_target(profile, job.audio_codecs, downloaded_files[0])
+        if codec:
+            # No native stream the client accepts; convert it off the download worker
+            return postprocess_pool.submit(transcode_job, job_id, downloaded_files[0], codec)
+        publish_download(job_id, downloaded_files[0], profile, upload)
             
-    except subprocess.TimeoutExpired:
-        download_jobs[job_id]['status'] = 'failed'
-        download_jobs[job_id]['message'] = 'Download timed out after 20 seconds. Try a very short video.'
+    except DownloadStalled as e:
+        finish_job(job_id, 'stalled', status='failed', **failure_fields(profile, 'stalled', detail=e))
+    except subprocess.TimeoutExpired as e:
+        finish_job(job_id, 'budget', status='failed', **failure_fields(profile, 'budget', detail=e.timeout))
     except Exception as e:
-        download_jobs[job_id]['status'] = 'failed'
-        download_jobs[job_id]['message'] = f'Error: {str(e)}'
-
-def get_cookie_path():
-    app.logger.info(f"Looking for cookies at: {COOKIE_FILE_PATH}")
-    
-    if COOKIE_FILE_PATH and os.path.exists(COOKIE_FILE_PATH):
-        app.logger.info(f"Found cookies file at: {COOKIE_FILE_PATH}")
-        # Use temp directory that's guaranteed to be writable
-        temp_cookie_path = os.path.join(TEMP_DOWNLOAD_BASE_DIR, 'cookies.txt')
-        try:
-            shutil.copy(COOKIE_FILE_PATH, temp_cookie_path)
-            app.logger.info(f"Successfully copied cookies to writable path: {temp_cookie_path}")
-            return temp_cookie_path
-        except Exception as e:
-            app.logger.error(f"Failed to copy cookie file from {COOKIE_FILE_PATH} to {temp_cookie_path}: {e}")
-            app.logger.info("Proceeding without cookies due to copy failure")
-    else:
-        app.logger.info(f"Cookies file not found at {COOKIE_FILE_PATH} - proceeding without cookies.")
-    return None
+        finish_job(job_id, 'error', status='failed', message=f'Error: {str(e)}')
+    finally:
+        # Failed, cancelled or handed to a transcode that uploads its own output
+        if upload:
+            upload.abort()
 
 @app.route('/get_info', methods=['GET'])
 def get_info():
     video_url = request.args.get('url')
     if not video_url:
         return jsonify({"error": "Missing 'url' parameter."}), 400
-
     try:
+        video_url = canonicalize(video_url).url
+    except UnsupportedURL as e:
+        return unsupported_url_response(e)
+
+    def extract_info():
         command = [
             'yt-dlp',
             '-J',
             '--no-warnings',
-            '--verbose',
-            '--sleep-requests', '0.5',
-            '--min-sleep-interval', '1',
-            '--max-sleep-interval', '3',
             '--no-playlist'
 
         ]
 
-        temp_cookie_path = get_cookie_path()
-        if temp_cookie_path:
-            command.extend(['--cookies', temp_cookie_path])
-        else:
-            app.logger.info("Proceeding without cookies.")
+        with cookie_manager.acquire() as cookie_lease:
+            if cookie_lease.path:
+                command.extend(['--cookies', cookie_lease.path])
+            else:
+                app.logger.info("Proceeding without cookies.")
+
+            command.append(video_url)
 
-        command.append(video_url)
+            app.logger.info(f"Running get_info command: {' '.join(command)}")
+            started = time.time()
+            process = run_ytdlp(command, timeout=15, check=True, max_wait=RATE_LIMIT_MAX_WAIT)
+            extraction_seconds.observe(time.time() - started, type='info')
+        # Validate before caching so bad output is never served twice
+        json.loads(process.stdout)
+        return process.stdout
 
-        app.logger.info(f"Running get_info command: {' '.join(command)}")
-        process = subprocess.run(command, capture_output=True, text=True, check=True, timeout=15)
-        video_info = json.loads(process.stdout)
-        return jsonify(video_info)
+    try:
+        # Concurrent lookups of the same video share one extraction
+        info_json = info_cache.get_or_load(canonicalize(video_url).key, extract_info)
+        response = app.response_class(info_json, mimetype='application/json')
+        # Passing this to /start_download skips extracting the video a second time
+        response.headers['X-Info-Token'] = info_token_for(info_json)
+        return response
 
+    except RateLimitedError as e:
+        retry_after = max(1, int(e.retry_after))
+        response = jsonify({
+            "error": "The video site is rate limiting this server. Please try again shortly.",
+            "retry_after": retry_after
+        })
+        response.headers['Retry-After'] = str(retry_after)
+        return response, 429
     except subprocess.TimeoutExpired:
         return jsonify({
             "error": "Video info extraction timed out (15 second limit). The video might be unavailable or restricted.",
         }), 408
     except subprocess.CalledProcessError as e:
-        app.logger.error(f"get_info yt-dlp failed: {e.stderr}")
+        app.logger.error(f"get_info yt-dlp failed: {(e.stderr or '')[-ERROR_OUTPUT_LENGTH:]}")
         return jsonify({
             "error": "yt-dlp command failed for get_info",
             "returncode": e.returncode,
-            "stderr": e.stderr,
-            "stdout": e.stdout
+            "stderr": (e.stderr or '')[-ERROR_OUTPUT_LENGTH:],
+            "stdout": (e.stdout or '')[-ERROR_OUTPUT_LENGTH:]
         }), 500
     except json.JSONDecodeError as e:
         return jsonify({
             "error": "Failed to parse yt-dlp JSON output for get_info",
             "details": str(e),
-            "raw_stdout": getattr(process, 'stdout', 'N/A')
+            "raw_stdout": e.doc[:ERROR_OUTPUT_LENGTH]
         }), 500
     except Exception as e:
         return jsonify({
@@ -242,87 +1140,47 @@ def get_info():
         }), 500
 
 def handle_download(video_url, download_type):
+    """Run the pipeline synchronously with the direct profile and send the file"""
     if not video_url:
         return jsonify({"error": "Missing 'url' parameter"}), 400
+    try:
+        video_url = canonicalize(video_url).url
+    except UnsupportedURL as e:
+        return unsupported_url_response(e)
 
+    profile = DOWNLOAD_PROFILES['direct']
     download_id = str(uuid.uuid4())
     specific_download_dir = os.path.join(TEMP_DOWNLOAD_BASE_DIR, download_id)
     os.makedirs(specific_download_dir, exist_ok=True)
 
-    output_template = os.path.join(specific_download_dir, "%(title)s - %(id)s.%(ext)s")
-    command = [
-        'yt-dlp',
-        '--no-warnings',
-        '--verbose',
-        '--sleep-requests', '0.5',
-        '--min-sleep-interval', '1',
-        '--max-sleep-interval', '3',
-        '--no-playlist',
-        '--user-agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36',
-        '--output', output_template,
-        '--no-check-certificate',
-        '--prefer-free-formats',
-        '--max-filesize', '25M',  # Smaller limit for faster cloud deployment
-        '--socket-timeout', '15',
-        '--fragment-retries', '2',
-        '--retries', '2',
-        '--file-access-retries', '2'
-    ]
+    audio_codecs = negotiate_audio_codecs(profile, download_type)
+    format_args = get_format_args(profile, download_type, audio_codecs)
 
-    temp_cookie_path = get_cookie_path()
-    if temp_cookie_path:
-        command.extend(['--cookies', temp_cookie_path])
-    else:
+    cookie_lease = cookie_manager.acquire()
+    if not cookie_lease.path:
         app.logger.info("Proceeding without cookies.")
 
-    if download_type == 'video':
-        # Optimized format selection for fast cloud deployment
-        command.extend(['-f', 'best[ext=mp4][height<=480][filesize<=50M]/best[height<=480]/worst[ext=mp4]/worst'])
-    elif download_type == 'audio':
-        # Check if ffmpeg is available
-        if shutil.which("ffmpeg"):
-            command.extend(['-x', '--audio-format', 'mp3', '--audio-quality', '192'])
-        else:
-            # Fallback: download best audio format without conversion
-            app.logger.warning("FFmpeg not available, downloading audio without conversion")
-            command.extend(['-f', 'bestaudio[ext=m4a]/bestaudio'])
-
-    command.append(video_url)
+    output_template = os.path.join(specific_download_dir, "%(title)s - %(id)s.%(ext)s")
+    command = build_command(profile, output_template, format_args, video_url, CONCURRENT_FRAGMENTS, cookie_lease.path)
 
     try:
         app.logger.info(f"Running download command: {' '.join(command)}")
-        # Add timeout for cloud deployment (Render has ~30s request timeout)
-        process = subprocess.run(command, capture_output=True, text=True, timeout=25)
+        budget = JOB_TIME_BUDGETS.get(download_type, JOB_TIME_BUDGETS['video'])
+        process = run_ytdlp(command, timeout=budget, engine=YT_DLP_DOWNLOAD_ENGINE)
 
-        app.logger.info(f"Download stdout: {process.stdout}")
         if process.stderr:
-            app.logger.info(f"Download stderr: {process.stderr}")
+            app.logger.info(f"Download stderr: {process.stderr[-ERROR_OUTPUT_LENGTH:]}")
 
         downloaded_files = os.listdir(specific_download_dir)
         if not downloaded_files:
             shutil.rmtree(specific_download_dir)
             
-            # Provide more specific error messages for common cloud deployment issues
-            error_msg = f"yt-dlp {download_type} download failed or produced no file."
-            stderr_lower = process.stderr.lower() if process.stderr else ""
-            
-            if "http error 429" in stderr_lower:
-                error_msg = "YouTube rate limiting detected. Please wait a few minutes and try again."
-            elif "unable to download webpage" in stderr_lower:
-                error_msg = "Unable to access YouTube. This might be due to network restrictions or rate limiting."
-            elif "ffmpeg" in stderr_lower and "not found" in stderr_lower:
-                error_msg = "Audio conversion failed. FFmpeg might not be available on this server."
-            elif "timeout" in stderr_lower:
-                error_msg = "Download timed out. Try again with a shorter video."
-            elif "file size exceeds" in stderr_lower:
-                error_msg = "Video file is too large (>25MB limit). Try downloading audio instead or a shorter video."
-                
             return jsonify({
-                "error": error_msg,
+                "error": failure_fields(profile, process.outcome, process.stderr)['message'],
                 "returncode": process.returncode,
                 "debug_info": {
-                    "stdout": process.stdout[-500:] if process.stdout else "",  # Last 500 chars
-                    "stderr": process.stderr[-500:] if process.stderr else "",   # Last 500 chars
+                    "stdout": process.stdout[-ERROR_OUTPUT_LENGTH:],
+                    "stderr": process.stderr[-ERROR_OUTPUT_LENGTH:],
                     "expected_dir": specific_download_dir
                 }
             }), 500
@@ -336,10 +1194,18 @@ def handle_download(video_url, download_type):
             return jsonify({
                 "error": f"yt-dlp {download_type} download failed.",
                 "returncode": process.returncode,
-                "stderr": process.stderr,
-                "stdout": process.stdout
+                "stderr": process.stderr[-ERROR_OUTPUT_LENGTH:],
+                "stdout": process.stdout[-ERROR_OUTPUT_LENGTH:]
             }), 500
 
+        codec = transcode_target(profile, audio_codecs, downloaded_filename)
+        if codec:
+            source_path = os.path.join(specific_download_dir, downloaded_filename)
+            converted = postprocess_pool.submit(transcode_audio, source_path, codec, profile.encoder_args.get(codec))
+            downloaded_filename = os.path.basename(converted.result())
+        elif download_type == 'audio' and not audio_codecs:
+            app.logger.warning("FFmpeg not available, sending audio without conversion")
+
         @after_this_request
         def cleanup(response):
             try:
@@ -354,7 +1220,7 @@ def handle_download(video_url, download_type):
     except subprocess.TimeoutExpired:
         shutil.rmtree(specific_download_dir)
         return jsonify({
-            "error": "Download timed out (25 second limit). Try a shorter video or audio-only download.",
+            "error": f"Download timed out ({budget} second limit). Try a shorter video or audio-only download.",
             "suggestion": "For longer videos, try downloading audio instead of video."
         }), 408
     except Exception as e:
@@ -363,6 +1229,131 @@ def handle_download(video_url, download_type):
             "error": f"Unexpected error in {download_type} download",
             "details": str(e)
         }), 500
+    finally:
+        cookie_lease.release()
+
+def attachment_header(filename):
+    """Content-Disposition value that survives non-ASCII video titles"""
+    ascii_name = filename.encode('ascii', 'ignore').decode('ascii').replace('"', '') or 'download'
+    return f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(filename)}"
+
+@app.route('/stream_download', methods=['GET'])
+def stream_download():
+    """Stream a single-file format to the client while yt-dlp is still downloading it"""
+    video_url = request.args.get('url')
+    download_type = request.args.get('type', 'audio')
+    
+    if not video_url:
+        return jsonify({"error": "Missing 'url' parameter"}), 400
+    try:
+        video_url = canonicalize(video_url).url
+    except UnsupportedURL as e:
+        return unsupported_url_response(e)
+    
+    if download_type not in STREAM_FORMATS:
+        return jsonify({"error": "Type must be 'video' or 'audio'"}), 400
+    
+    if not stream_slots.acquire(blocking=False):
+        response = jsonify({"error": "Too many streaming downloads. Please try again shortly."})
+        response.headers['Retry-After'] = str(QUEUE_RETRY_AFTER)
+        return response, 429
+    
+    profile = DOWNLOAD_PROFILES['stream']
+    ext, mimetype = STREAM_FORMATS[download_type]
+    host = get_url_host(video_url)
+    try:
+        rate_governor.acquire(host, max_wait=RATE_LIMIT_MAX_WAIT)
+    except RateLimitedError as e:
+        stream_slots.release()
+        response = jsonify({"error": "The video site is rate limiting this server. Please try again shortly."})
+        response.headers['Retry-After'] = str(max(1, int(e.retry_after)))
+        return response, 429
+    
+    cookie_lease = cookie_manager.acquire()
+    command = build_command(profile, '-', get_format_args(profile, download_type), video_url,
+                            CONCURRENT_FRAGMENTS, cookie_lease.path)
+    
+    # The same watchdog as queued jobs: a read waiting STALL_TIMEOUT_SECONDS for
+    # bytes, or a stream running past its type's budget, kills yt-dlp so the
+    # blocked read returns and the request thread and stream slot come back
+    budget = JOB_TIME_BUDGETS[download_type]
+    reading_since = [None]
+    def watchdog(elapsed):
+        if elapsed > budget:
+            return 'budget'
+        if reading_since[0] is not None and time.time() - reading_since[0] > STALL_TIMEOUT_SECONDS:
+            return 'stalled'
+        return None
+    
+    def read_chunk():
+        reading_since[0] = time.time()
+        try:
+            return process.read(STREAM_CHUNK_SIZE)
+        finally:
+            reading_since[0] = None
+    
+    try:
+        process = process_runner.open(command, watchdog, WATCHDOG_INTERVAL_SECONDS)
+    except Exception as e:
+        cookie_lease.release()
+        stream_slots.release()
+        return jsonify({"error": "Failed to start yt-dlp", "details": str(e)}), 500
+    stream_id = f"stream-{uuid.uuid4()}"
+    with active_processes_lock:
+        active_processes[stream_id] = process
+    
+    released = threading.Event()
+    def finish():
+        # Runs when the stream ends or the client disconnects
+        if released.is_set():
+            return
+        released.set()
+        process.close()
+        with active_processes_lock:
+            active_processes.pop(stream_id, None)
+        cookie_lease.release()
+        stream_slots.release()
+        rate_governor.report(host, process.stderr_tail.text(), process.returncode == 0)
+    
+    # Wait for the first bytes so extraction errors still get a proper error response
+    first_chunk = read_chunk()
+    if not first_chunk:
+        finish()
+        stderr_text = process.stderr_tail.text()
+        outcome = process.kill_reason or process.stderr_tail.outcome
+        detail = f"No data for {STALL_TIMEOUT_SECONDS} seconds" if outcome == 'stalled' else budget
+        return jsonify({
+            "error": failure_fields(profile, outcome, detail=detail)['message'],
+            "returncode": process.returncode,
+            "stderr": stderr_text[-ERROR_OUTPUT_LENGTH:]
+        }), 500
+    
+    def generate():
+        yield first_chunk
+        sent = len(first_chunk)
+        try:
+            while True:
+                # Returns whatever is in the pipe, so chunks go out as they arrive
+                chunk = read_chunk()
+                if not chunk:
+                    if process.kill_reason:
+                        app.logger.warning(f"Stream {stream_id} cut short: {process.kill_reason}")
+                    break
+                yield chunk
+                sent += len(chunk)
+        finally:
+            served_bytes.observe(sent, endpoint='stream_download')
+    
+    cached_info = info_cache.get(canonicalize(video_url).key)
+    title = json.loads(cached_info).get('title') if cached_info else None
+    filename = f"{title or download_type}.{ext}"
+    
+    response = Response(generate(), mimetype=mimetype, headers={
+        'Content-Disposition': attachment_header(filename),
+        'X-Accel-Buffering': 'no'
+    })
+    response.call_on_close(finish)
+    return response
 
 @app.route('/start_download', methods=['POST'])
 def start_download():
@@ -370,106 +1361,424 @@ def start_download():
     data = request.get_json()
     video_url = data.get('url')
     download_type = data.get('type', 'audio')  # 'video' or 'audio'
+    # Optional audio outputs the client can play, e.g. ["m4a", "opus"]; a
+    # matching native stream skips transcoding entirely
+    accept_codecs = data.get('accept_codecs')
+    # Optional X-Info-Token from /get_info for the same URL, to skip re-extraction
+    info_token = data.get('info_token')
     
     if not video_url:
         return jsonify({"error": "Missing 'url' parameter"}), 400
+    try:
+        video_url = canonicalize(video_url).url
+    except UnsupportedURL as e:
+        return unsupported_url_response(e)
     
     if download_type not in ['video', 'audio']:
         return jsonify({"error": "Type must be 'video' or 'audio'"}), 400
     
-    # Create job
-    job_id = str(uuid.uuid4())
-    specific_download_dir = os.path.join(TEMP_DOWNLOAD_BASE_DIR, job_id)
-    os.makedirs(specific_download_dir, exist_ok=True)
+    if info_token is not None and not isinstance(info_token, str):
+        return jsonify({"error": "'info_token' must be a string"}), 400
     
-    download_jobs[job_id] = {
-        'status': 'queued',
-        'message': 'Download queued...',
-        'download_dir': specific_download_dir,
-        'created_at': time.time(),
-        'type': download_type,
-        'url': video_url
-    }
+    error_response = invalid_accept_codecs(accept_codecs) or disk_full_response()
+    if error_response:
+        return error_response
     
-    # Start background download
-    thread = threading.Thread(target=background_download, args=(job_id, video_url, download_type))
-    thread.daemon = True
-    thread.start()
+    # Create job and hand it to the worker pool
+    job_id = create_job(video_url, download_type, 'Download queued...', accept_codecs=accept_codecs,
+                        info_token=info_token)
+    error_response = submit_job(job_id, run_pipeline)
+    if error_response:
+        return error_response
     
     return jsonify({
         "job_id": job_id,
-        "status": "queued",
+        "status": job_store.get(job_id).status,
+        "queue_position": get_queue_position(job_id),
         "message": "Download started in background"
     })
 
-@app.route('/download_status/<job_id>')
-def download_status(job_id):
-    """Check the status of a background download"""
-    if job_id not in download_jobs:
+def expand_playlist(playlist_url):
+    """Video URLs of a playlist, from a flat extraction that skips per-video requests"""
+    command = [
+        'yt-dlp',
+        '-J',
+        '--no-warnings',
+        '--flat-playlist',
+        '--playlist-end', str(MAX_BATCH_SIZE + 1),
+        playlist_url
+    ]
+    process = run_ytdlp(command, timeout=30, check=True, max_wait=RATE_LIMIT_MAX_WAIT)
+    info = json.loads(process.stdout)
+    # A plain video URL comes back as a single entry
+    entries = info.get('entries') if info.get('_type') == 'playlist' else [info]
+    urls = []
+    for entry in entries or []:
+        try:
+            urls.append(canonicalize(entry.get('webpage_url') or entry.get('url')).url)
+        except UnsupportedURL:
+            continue  # e.g. a deleted video with no URL
+    return urls
+
+@app.route('/start_batch', methods=['POST'])
+def start_batch():
+    """Fan a list of URLs or a playlist out into child jobs tracked by one batch ID"""
+    data = request.get_json()
+    urls = data.get('urls')
+    playlist_url = data.get('playlist_url')
+    download_type = data.get('type', 'audio')
+    
+    if not urls and not playlist_url:
+        return jsonify({"error": "Provide either 'urls' (a list) or 'playlist_url'"}), 400
+    
+    if urls is not None and (not isinstance(urls, list) or not all(isinstance(url, str) and url for url in urls)):
+        return jsonify({"error": "'urls' must be a list of URL strings"}), 400
+    
+    if download_type not in ['video', 'audio']:
+        return jsonify({"error": "Type must be 'video' or 'audio'"}), 400
+    
+    error_response = invalid_accept_codecs(data.get('accept_codecs'))
+    if error_response:
+        return error_response
+    
+    try:
+        if playlist_url:
+            playlist_url = canonicalize_playlist(playlist_url)
+        else:
+            urls = [canonicalize(url).url for url in urls]
+    except UnsupportedURL as e:
+        return unsupported_url_response(e)
+    
+    if playlist_url:
+        try:
+            urls = expand_playlist(playlist_url)
+        except RateLimitedError as e:
+            response = jsonify({"error": "The video site is rate limiting this server. Please try again shortly."})
+            response.headers['Retry-After'] = str(max(1, int(e.retry_after)))
+            return response, 429
+        except subprocess.TimeoutExpired:
+            return jsonify({"error": "Playlist extraction timed out"}), 408
+        except (subprocess.CalledProcessError, json.JSONDecodeError) as e:
+            return jsonify({"error": "Failed to read playlist", "details": str(e)}), 500
+        if not urls:
+            return jsonify({"error": "Playlist has no videos"}), 400
+    
+    if len(urls) > MAX_BATCH_SIZE:
+        return jsonify({"error": f"A batch can hold at most {MAX_BATCH_SIZE} videos"}), 400
+    
+    # Admit the whole batch or none of it rather than queueing a partial one
+    with scheduler_condition:
+        queue_space = MAX_QUEUE_SIZE - len(pending_jobs)
+    if len(urls) > queue_space:
+        return queue_full_response()
+    
+    error_response = disk_full_response(len(urls))
+    if error_response:
+        return error_response
+    
+    child_ids = []
+    for video_url in urls:
+        job_id = create_job(video_url, download_type, 'Download queued (batch)...',
+                            accept_codecs=data.get('accept_codecs'))
+        if submit_job(job_id, run_pipeline) is None:
+            child_ids.append(job_id)
+    
+    batch_id = str(uuid.uuid4())
+    job_store.create(Job(
+        id=batch_id,
+        url=playlist_url or urls[0],
+        type=download_type,
+        download_dir=os.path.join(TEMP_DOWNLOAD_BASE_DIR, batch_id),
+        status='processing',
+        message=f'Batch of {len(child_ids)} downloads',
+        children=child_ids
+    ))
+    
+    response = {
+        "batch_id": batch_id,
+        "job_ids": child_ids,
+        "status_url": f"/download_status/{batch_id}",
+        "message": "Batch download started in background"
+    }
+    if len(child_ids) < len(urls):
+        response['rejected'] = len(urls) - len(child_ids)
+    if data.get('zip'):
+        response['zip_url'] = f"/download_batch/{batch_id}"
+    return jsonify(response)
+
+def get_batch_status(batch):
+    """Aggregate status of a batch's child jobs"""
+    counts = {}
+    jobs = []
+    downloaded_bytes = total_bytes = 0
+    for child_id in batch.children:
+        child, _ = get_job_status(child_id)
+        status = child.get('status', 'expired')
+        counts[status] = counts.get(status, 0) + 1
+        progress = child.get('progress') or {}
+        downloaded_bytes += progress.get('downloaded_bytes') or 0
+        total_bytes += progress.get('total_bytes') or progress.get('downloaded_bytes') or 0
+        entry = {"job_id": child_id, "status": status}
+        if 'download_url' in child:
+            entry['download_url'] = child['download_url']
+        jobs.append(entry)
+    
+    finished = sum(count for status, count in counts.items() if status not in ['queued', 'processing'])
+    if finished < len(batch.children):
+        status = 'processing'
+    else:
+        status = 'completed' if counts.get('completed') else 'cancelled' if counts.get('cancelled') == len(batch.children) else 'failed'
+    
+    response = {
+        "status": status,
+        "message": f"{finished} of {len(batch.children)} downloads finished",
+        "type": batch.type,
+        "total": len(batch.children),
+        "counts": counts,
+        "progress": {"downloaded_bytes": downloaded_bytes, "total_bytes": total_bytes},
+        "jobs": jobs
+    }
+    if status == 'completed':
+        response['zip_url'] = f"/download_batch/{batch.id}"
+    return response, 200
+
+@app.route('/download_batch/<batch_id>')
+def download_batch(batch_id):
+    """Stream every completed file of a finished batch as one ZIP"""
+    batch = job_store.get(batch_id)
+    if batch is None or not batch.children:
+        return jsonify({"error": "Batch not found"}), 404
+    
+    status, _ = get_batch_status(batch)
+    if status['status'] not in FINAL_STATUSES:
+        return jsonify({"error": "Batch not finished", "message": status['message']}), 409
+    
+    paths = []
+    for child_id in batch.children:
+        child = job_store.get(child_id)
+        if child is None or child.status != 'completed' or child.filename is None:
+            continue
+        paths.append(os.path.join(child.download_dir, child.filename))
+        # Start the same retention window a direct download would
+        shorten_expiry(child)
+    
+    if not paths:
+        return jsonify({"error": "No completed files in this batch"}), 404
+    
+    def generate():
+        sent = 0
+        try:
+            for chunk in stream_zip(paths, STREAM_CHUNK_SIZE):
+                yield chunk
+                sent += len(chunk)
+        finally:
+            served_bytes.observe(sent, endpoint='download_batch')
+    
+    return Response(generate(), mimetype='application/zip', headers={
+        'Content-Disposition': attachment_header(f"batch-{batch_id[:8]}.zip"),
+        'X-Accel-Buffering': 'no'
+    })
+
+def cancel_job(job_id):
+    """Stop a queued, following or running job.
+
+    Returns False when the job has already finished.
+    """
+    job = job_store.transition(job_id, ['queued', 'processing'], status='cancelled',
+                               message='Download cancelled.',
+                               expires_at=expiry_deadline('cancelled'))
+    if job is None:
+        return False
+    job_outcomes.inc(outcome='cancelled')
+    
+    # A queued job leaves the queue so it never takes a worker slot
+    entry = None
+    with scheduler_condition:
+        for queued in pending_jobs:
+            if queued[2] == job_id:
+                entry = queued
+                pending_jobs.remove(queued)
+                heapq.heapify(pending_jobs)
+                break
+    if entry is not None:
+        # It will never reach run_download_job, so hand off its followers here
+        with inflight_lock:
+            if inflight_downloads.get(job.artifact_key) == job_id:
+                del inflight_downloads[job.artifact_key]
+        requeue_followers(job, entry[5][0])
+    
+    # A running job's process is killed; its worker slot frees as soon as it exits
+    with active_processes_lock:
+        process = active_processes.get(job_id)
+    if process is not None:
+        process.kill()
+    
+    notify_job_update()
+    return True
+
+@app.route('/download_jobs/<job_id>', methods=['DELETE'])
+def cancel_download(job_id):
+    """Cancel a download job, or every unfinished job of a batch"""
+    job = job_store.get(job_id)
+    if job is None:
         return jsonify({"error": "Job not found"}), 404
     
-    job = download_jobs[job_id]
+    if job.children:
+        cancelled = [child_id for child_id in job.children if cancel_job(child_id)]
+        return jsonify({"batch_id": job_id, "cancelled": cancelled})
+    
+    if not cancel_job(job_id):
+        return jsonify({"error": "Job already finished", "status": job_store.get(job_id).status}), 409
+    
+    return jsonify({"job_id": job_id, "status": "cancelled"})
+
+def get_job_status(job_id):
+    """Status payload and HTTP code for a job, shared by polling and SSE"""
+    job = job_store.get(job_id)
+    if job is None:
+        return {"error": "Job not found"}, 404
+    
+    if job.children:
+        return get_batch_status(job)
     
-    # Clean up old failed jobs
-    if job['status'] in ['failed'] and time.time() - job['created_at'] > 300:  # 5 minutes
-        if os.path.exists(job['download_dir']):
-            shutil.rmtree(job['download_dir'])
-        del download_jobs[job_id]
-        return jsonify({"error": "Job expired"}), 404
+    # A follower reports the progress of the job it is attached to
+    leader = job_store.get(job.leader) if job.leader else None
+    if job.status == 'queued' and leader and leader.status in ['queued', 'processing']:
+        response = {
+            "status": leader.status,
+            "message": leader.message,
+            "type": job.type,
+            "queue_position": get_queue_position(job.leader),
+            "coalesced_with": job.leader
+        }
+        if leader.progress is not None:
+            response['progress'] = leader.progress
+        return response, 200
     
     response = {
-        "status": job['status'],
-        "message": job['message'],
-        "type": job['type']
+        "status": job.status,
+        "message": job.message,
+        "type": job.type
     }
     
     # Add extra info for debugging
-    if 'using_cookies' in job:
-        response['using_cookies'] = job['using_cookies']
-    if 'public_mode' in job:
-        response['public_mode'] = job['public_mode']
+    if job.using_cookies is not None:
+        response['using_cookies'] = job.using_cookies
+    if job.public_mode:
+        response['public_mode'] = job.public_mode
+    if job.status == 'queued':
+        response['queue_position'] = get_queue_position(job_id)
+    if job.progress is not None:
+        response['progress'] = job.progress
     
-    if job['status'] == 'completed':
+    if job.status == 'completed':
         response['download_url'] = f"/download_file/{job_id}"
-    elif job['status'] == 'failed':
-        if 'error' in job:
-            response['error_details'] = job['error']
-        if 'help' in job:
-            response['help'] = job['help']
+    elif job.status == 'failed':
+        if job.error is not None:
+            response['error_details'] = job.error
+        if job.help is not None:
+            response['help'] = job.help
     
-    return jsonify(response)
+    return response, 200
+
+@app.route('/download_status/<job_id>')
+def download_status(job_id):
+    """Check the status of a background download"""
+    response, status_code = get_job_status(job_id)
+    return jsonify(response), status_code
+
+@app.route('/download_events/<job_id>')
+def download_events(job_id):
+    """Stream status and progress updates for a job as Server-Sent Events.
+
+    The stream holds a server thread, so only MAX_SSE_SUBSCRIBERS may be
+    open at once; past that clients get 429 and poll /download_status. A
+    stream ends when its job does or after SSE_MAX_STREAM_SECONDS, when the
+    client reconnects.
+    """
+    if not sse_slots.acquire(blocking=False):
+        response = jsonify({"error": "Too many open event streams. Poll /download_status instead."})
+        response.headers['Retry-After'] = str(QUEUE_RETRY_AFTER)
+        return response, 429
+    
+    def generate():
+        last_response = None
+        last_sent = started = time.time()
+        while True:
+            response, status_code = get_job_status(job_id)
+            if response != last_response:
+                yield f"data: {json.dumps(response)}\n\n"
+                last_response = response
+                last_sent = time.time()
+            elif time.time() - last_sent >= SSE_KEEPALIVE_SECONDS:
+                yield ": keepalive\n\n"
+                last_sent = time.time()
+            
+            if status_code != 200 or response['status'] in FINAL_STATUSES:
+                return
+            if time.time() - started >= SSE_MAX_STREAM_SECONDS:
+                return  # EventSource reconnects and gets the current status first
+            
+            # Progress updates notify right away; the timeout catches plain status changes
+            with job_events:
+                job_events.wait(timeout=1)
+    
+    response = Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # Runs when the stream ends or the client disconnects
+    response.call_on_close(sse_slots.release)
+    return response
+
+def shorten_expiry(job):
+    """Once a file is fetched it only needs to last for resumes and retries"""
+    deadline = time.time() + DOWNLOAD_RETENTION_SECONDS
+    if job.expires_at is None or job.expires_at > deadline:
+        job_store.update(job.id, expires_at=deadline)
+        schedule_expiry(deadline)
 
 @app.route('/download_file/<job_id>')
 def download_file(job_id):
     """Download the completed file"""
-    if job_id not in download_jobs:
+    job = job_store.get(job_id)
+    if job is None:
         return jsonify({"error": "Job not found"}), 404
     
-    job = download_jobs[job_id]
-    
-    if job['status'] != 'completed':
+    if job.status != 'completed':
         return jsonify({"error": "Download not completed"}), 400
     
-    if 'filename' not in job:
+    if job.filename is None:
         return jsonify({"error": "File not found"}), 404
     
-    # Clean up after download
-    @after_this_request
-    def cleanup(response):
-        try:
-            if os.path.exists(job['download_dir']):
-                shutil.rmtree(job['download_dir'])
-            if job_id in download_jobs:
-                del download_jobs[job_id]
-        except Exception as e:
-            app.logger.error(f"Cleanup error: {e}")
+    # Keep the file around for resumes and retries instead of deleting it right away
+    shorten_expiry(job)
+    
+    if job.storage_key:
+        # The object store serves the bytes, whichever instance ran the job
+        return redirect(storage.url_for(job.storage_key, job.filename, attachment_header(job.filename)))
+    
+    if X_ACCEL_REDIRECT_PREFIX:
+        # nginx serves the bytes (including Range requests) straight from disk
+        response = Response(mimetype='application/octet-stream')
+        response.headers['X-Accel-Redirect'] = f"{X_ACCEL_REDIRECT_PREFIX.rstrip('/')}/{job_id}/{quote(job.filename)}"
+        response.headers['Content-Disposition'] = attachment_header(job.filename)
+        served_bytes.observe(os.path.getsize(os.path.join(job.download_dir, job.filename)), endpoint='download_file')
         return response
     
-    return send_from_directory(
-        directory=job['download_dir'], 
-        path=job['filename'], 
-        as_attachment=True
+    # Conditional responses give Range/206, ETag and Last-Modified support, and
+    # the server's wsgi.file_wrapper can hand the file to sendfile()
+    response = send_from_directory(
+        directory=job.download_dir, 
+        path=job.filename, 
+        as_attachment=True,
+        conditional=True,
+        etag=True,
+        max_age=DOWNLOAD_RETENTION_SECONDS
     )
+    if response.status_code in (200, 206):
+        served_bytes.observe(response.content_length or 0, endpoint='download_file')
+    return response
 
 # Legacy endpoints for backward compatibility
 @app.route('/download_video', methods=['GET'])
@@ -499,23 +1808,15 @@ def test_download():
     """Test endpoint with a known working video"""
     test_url = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"  # Rick Roll - should always work
     
-    # Start background download
-    job_id = str(uuid.uuid4())
-    specific_download_dir = os.path.join(TEMP_DOWNLOAD_BASE_DIR, job_id)
-    os.makedirs(specific_download_dir, exist_ok=True)
-    
-    download_jobs[job_id] = {
-        'status': 'queued',
-        'message': 'Testing with known working video...',
-        'download_dir': specific_download_dir,
-        'created_at': time.time(),
-        'type': 'audio',
-        'url': test_url
-    }
+    error_response = disk_full_response()
+    if error_response:
+        return error_response
     
-    thread = threading.Thread(target=background_download, args=(job_id, test_url, 'audio'))
-    thread.daemon = True
-    thread.start()
+    # Start background download
+    job_id = create_job(test_url, 'audio', 'Testing with known working video...')
+    error_response = submit_job(job_id, run_pipeline)
+    if error_response:
+        return error_response
     
     return jsonify({
         "job_id": job_id,
@@ -532,29 +1833,26 @@ def start_public_download():
     
     if not video_url:
         return jsonify({"error": "Missing 'url' parameter"}), 400
+    try:
+        video_url = canonicalize(video_url).url
+    except UnsupportedURL as e:
+        return unsupported_url_response(e)
     
-    job_id = str(uuid.uuid4())
-    specific_download_dir = os.path.join(TEMP_DOWNLOAD_BASE_DIR, job_id)
-    os.makedirs(specific_download_dir, exist_ok=True)
-    
-    download_jobs[job_id] = {
-        'status': 'queued',
-        'message': 'Starting public download (no cookies)...',
-        'download_dir': specific_download_dir,
-        'created_at': time.time(),
-        'type': download_type,
-        'url': video_url,
-        'public_mode': True
-    }
+    error_response = invalid_accept_codecs(data.get('accept_codecs')) or disk_full_response()
+    if error_response:
+        return error_response
     
-    # Start background download without cookies
-    thread = threading.Thread(target=background_download_no_cookies, args=(job_id, video_url, download_type))
-    thread.daemon = True
-    thread.start()
+    # Create job and hand it to the worker pool without cookies
+    job_id = create_job(video_url, download_type, 'Starting public download (no cookies)...', public_mode=True,
+                        accept_codecs=data.get('accept_codecs'))
+    error_response = submit_job(job_id, run_pipeline)
+    if error_response:
+        return error_response
     
     return jsonify({
         "job_id": job_id,
-        "status": "queued",
+        "status": job_store.get(job_id).status,
+        "queue_position": get_queue_position(job_id),
         "message": "Public download started (no authentication)"
     })
 
@@ -562,83 +1860,310 @@ def start_public_download():
 def list_jobs():
     """List all active download jobs (for debugging)"""
     jobs_info = {}
-    for job_id, job in download_jobs.items():
-        jobs_info[job_id] = {
-            "status": job['status'],
-            "message": job['message'],
-            "type": job['type'],
-            "created_at": job['created_at'],
-            "age_seconds": int(time.time() - job['created_at']),
-            "url": job['url'][:50] + "..." if len(job['url']) > 50 else job['url']
+    jobs = job_store.list()
+    for job in jobs:
+        jobs_info[job.id] = {
+            "status": job.status,
+            "message": job.message,
+            "type": job.type,
+            "created_at": job.created_at,
+            "age_seconds": int(time.time() - job.created_at),
+            "url": job.url[:50] + "..." if len(job.url) > 50 else job.url
         }
     
     return jsonify({
-        "total_jobs": len(download_jobs),
+        "total_jobs": len(jobs),
         "jobs": jobs_info
     })
 
+def probe_yt_dlp():
+    result = run_ytdlp(['yt-dlp', '--version'], timeout=10)
+    if result.returncode != 0:
+        return {'available': False, 'version': None, 'error': (result.stderr or '').strip()[-200:]}
+    return {'available': True, 'version': result.stdout.strip()}
+
+def probe_ffmpeg():
+    path = shutil.which('ffmpeg')
+    if not path:
+        return {'path': None, 'version': None}
+    result = process_runner.capture([path, '-version'], timeout=10)
+    return {'path': path, 'version': result.stdout.split('\n', 1)[0] or None}
+
+def probe_temp_dir():
+    exists = os.path.isdir(TEMP_DOWNLOAD_BASE_DIR)
+    writable = False
+    if exists:
+        try:
+            with tempfile.TemporaryFile(dir=TEMP_DOWNLOAD_BASE_DIR):
+                writable = True
+        except OSError:
+            pass
+    disk = shutil.disk_usage(TEMP_DOWNLOAD_BASE_DIR) if exists else None
+    with disk_since_probe_lock:
+        disk_since_probe['written'] = 0
+    used_bytes = temp_dir_usage() if exists else 0
+    # Evictions during the walk may already be counted in used_bytes; keeping them would undercount
+    with disk_since_probe_lock:
+        disk_since_probe['freed'] = 0
+    return {
+        'exists': exists,
+        'writable': writable,
+        'used_bytes': used_bytes,
+        'disk_free_bytes': disk.free if disk else None,
+        'disk_total_bytes': disk.total if disk else None
+    }
+
+# Slow environment checks, run once and then refreshed in the background so
+# /health and the per-job ffmpeg check never spawn a process
+CAPABILITY_PROBE_INTERVAL_SECONDS = int(os.environ.get('CAPABILITY_PROBE_INTERVAL_SECONDS', 60))
+
+capabilities = CapabilityRegistry({
+    'yt_dlp': probe_yt_dlp,
+    'ffmpeg': probe_ffmpeg,
+    'temp_dir': probe_temp_dir
+}, CAPABILITY_PROBE_INTERVAL_SECONDS)
+
+def ffmpeg_path():
+    """Where ffmpeg is installed, as of the last probe, or None"""
+    return (capabilities.get('ffmpeg') or {}).get('path')
+
 @app.route('/health')
 def health_check():
-    """Health check endpoint for debugging deployment issues"""
+    """Health check endpoint for debugging deployment issues.
+
+    Everything slow comes from the capability registry's last probe.
+    """
+    snapshot = capabilities.snapshot()
+    yt_dlp = snapshot.get('yt_dlp') or {}
+    temp_dir = snapshot.get('temp_dir') or {}
     
     health_info = {
         "status": "healthy",
         "temp_dir": TEMP_DOWNLOAD_BASE_DIR,
-        "temp_dir_exists": os.path.exists(TEMP_DOWNLOAD_BASE_DIR),
-        "temp_dir_writable": os.access(TEMP_DOWNLOAD_BASE_DIR, os.W_OK) if os.path.exists(TEMP_DOWNLOAD_BASE_DIR) else False,
+        "temp_dir_exists": temp_dir.get('exists', False),
+        "temp_dir_writable": temp_dir.get('writable', False),
         "cookie_file_env": COOKIE_FILE_PATH,
         "cookie_file_exists": os.path.exists(COOKIE_FILE_PATH) if COOKIE_FILE_PATH else False,
-        "ffmpeg_available": shutil.which("ffmpeg") is not None,
-        "yt_dlp_version": None,
-        "active_jobs": len(download_jobs),
-        "background_download_system": "enabled"
+        "cookies": cookie_manager.snapshot(),
+        "ffmpeg_available": ffmpeg_path() is not None,
+        "yt_dlp_version": yt_dlp.get('version'),
+        "active_jobs": job_store.count(),
+        "job_store": JOB_STORE,
+        "background_download_system": "enabled",
+        "yt_dlp_engine": YT_DLP_ENGINE,
+        "yt_dlp_download_engine": YT_DLP_DOWNLOAD_ENGINE,
+        "download_workers": DOWNLOAD_WORKERS,
+        "queued_jobs": len(pending_jobs),
+        "max_queue_size": MAX_QUEUE_SIZE,
+        "postprocess_workers": POSTPROCESS_WORKERS,
+        "info_cache": info_cache.snapshot(),
+        "artifact_cache": artifact_store.snapshot(),
+        "storage": storage.snapshot(),
+        "temp_dir_bytes": temp_dir.get('used_bytes'),
+        "temp_dir_max_bytes": TEMP_DIR_MAX_BYTES,
+        "rate_limits": rate_governor.snapshot(),
+        "capabilities": snapshot
     }
     
-    # Check yt-dlp version
-    try:
-        result = subprocess.run(['yt-dlp', '--version'], capture_output=True, text=True, timeout=10)
-        if result.returncode == 0:
-            health_info["yt_dlp_version"] = result.stdout.strip()
-    except:
-        health_info["yt_dlp_version"] = "Error checking version"
-    
     return jsonify(health_info)
 
+@app.route('/ready')
+def readiness_check():
+    """Readiness probe: 503 while this instance can't take more downloads"""
+    with scheduler_condition:
+        queued = len(pending_jobs)
+        busy_workers = sum(running_per_host.values())
+    
+    reasons = []
+    if queued >= MAX_QUEUE_SIZE:
+        reasons.append('download queue is full')
+    if not (capabilities.get('yt_dlp') or {}).get('available'):
+        reasons.append('yt-dlp is unavailable')
+    if not (capabilities.get('temp_dir') or {}).get('writable'):
+        reasons.append('temp dir is not writable')
+    
+    return jsonify({
+        "ready": not reasons,
+        "reasons": reasons,
+        "busy_workers": busy_workers,
+        "download_workers": DOWNLOAD_WORKERS,
+        "queued_jobs": queued,
+        "max_queue_size": MAX_QUEUE_SIZE,
+        "saturation": round((busy_workers + queued) / (DOWNLOAD_WORKERS + MAX_QUEUE_SIZE), 3)
+    }), 503 if reasons else 200
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus scrape endpoint, for this worker process only (see metrics.py)"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 def cleanup_old_jobs():
-    """Clean up old download jobs and directories"""
+    """Remove jobs whose expiry passed or that outlived MAX_JOB_AGE_SECONDS, then enforce the disk quota"""
     current_time = time.time()
-    jobs_to_remove = []
+    removed = set()
     
-    for job_id, job in download_jobs.items():
-        # Remove jobs older than 1 hour
-        if current_time - job['created_at'] > 3600:
-            jobs_to_remove.append(job_id)
+    for job in job_store.expiring_before(current_time) + job_store.created_before(current_time - MAX_JOB_AGE_SECONDS):
+        if job.id not in removed:
+            remove_job(job)
+            removed.add(job.id)
+    
+    enforce_disk_quota()
+    if removed:
+        app.logger.info(f"Cleaned up {len(removed)} old jobs")
+
+def sweep_orphan_dirs():
+    """Remove job directories that have no job record, e.g. left behind by a crash"""
+    cutoff = time.time() - ORPHAN_GRACE_SECONDS
+    removed = 0
+    for entry in os.scandir(TEMP_DOWNLOAD_BASE_DIR):
+        # _artifacts, _cookies and the job database aren't job directories
+        if not entry.is_dir(follow_symlinks=False) or entry.name.startswith(('_', '.')):
+            continue
+        try:
+            # The grace period covers jobs whose record is still being created
+            if entry.stat().st_mtime > cutoff or job_store.get(entry.name) is not None:
+                continue
+            size = unshared_bytes(entry.path)
+        except FileNotFoundError:
+            continue
+        shutil.rmtree(entry.path, ignore_errors=True)
+        count_freed_bytes(size)
+        removed += 1
+    if removed:
+        app.logger.info(f"Removed {removed} orphaned download directories")
+
+def temp_dir_usage():
+    """Bytes used under TEMP_DOWNLOAD_BASE_DIR, counting hard-linked files once"""
+    seen = set()
+    total = 0
+    for root, _, files in os.walk(TEMP_DOWNLOAD_BASE_DIR):
+        for name in files:
             try:
-                if os.path.exists(job['download_dir']):
-                    shutil.rmtree(job['download_dir'])
-            except Exception as e:
-                app.logger.error(f"Error cleaning up job {job_id}: {e}")
+                stat = os.lstat(os.path.join(root, name))
+            except FileNotFoundError:
+                continue
+            if (stat.st_dev, stat.st_ino) in seen:
+                continue
+            seen.add((stat.st_dev, stat.st_ino))
+            total += stat.st_size
+    return total
+
+def estimated_temp_dir_usage():
+    """Bytes used under TEMP_DOWNLOAD_BASE_DIR: the last probe's count plus
+    files published and minus files removed since, without walking the tree"""
+    probed = (capabilities.get('temp_dir') or {}).get('used_bytes')
+    if probed is None:
+        return temp_dir_usage()
+    with disk_since_probe_lock:
+        return max(0, probed + disk_since_probe['written'] - disk_since_probe['freed'])
+
+def enforce_disk_quota(reserve_bytes=0):
+    """Evict finished jobs oldest first, then unreferenced cached artifacts,
+    until usage plus reserve_bytes fits TEMP_DIR_MAX_BYTES.
+
+    Returns True when it fits.
+    """
+    usage = estimated_temp_dir_usage()
+    if usage + reserve_bytes <= TEMP_DIR_MAX_BYTES:
+        return True
     
-    for job_id in jobs_to_remove:
-        del download_jobs[job_id]
+    finished = sorted(
+        (job for status in FINAL_STATUSES for job in job_store.list(status) if not job.children),
+        key=lambda job: job.created_at
+    )
+    for job in finished:
+        usage -= remove_job(job)
+        app.logger.info(f"Evicted job {job.id} to stay within the disk quota")
+        if usage + reserve_bytes <= TEMP_DIR_MAX_BYTES:
+            return True
     
-    app.logger.info(f"Cleaned up {len(jobs_to_remove)} old jobs")
+    usage -= count_freed_bytes(artifact_store.shrink(usage + reserve_bytes - TEMP_DIR_MAX_BYTES))
+    return usage + reserve_bytes <= TEMP_DIR_MAX_BYTES
+
+def disk_full_response(job_count=1):
+    """507 when job_count more jobs would push the temp dir past its quota, else None"""
+    with scheduler_condition:
+        active_jobs = len(pending_jobs) + sum(running_per_host.values())
+    if enforce_disk_quota((active_jobs + job_count) * JOB_DISK_ESTIMATE_BYTES):
+        return None
+    response = jsonify({
+        "error": "The server is out of download space. Please try again shortly.",
+        "retry_after": QUEUE_RETRY_AFTER
+    })
+    response.headers['Retry-After'] = str(QUEUE_RETRY_AFTER)
+    return response, 507
 
 # Start background cleanup thread
 def start_cleanup_thread():
+    global cleanup_thread_pid
+    with scheduler_condition:
+        if cleanup_thread_pid == os.getpid():
+            return
+        cleanup_thread_pid = os.getpid()
+    
     def cleanup_loop():
+        next_sweep = 0
         while True:
-            time.sleep(1800)  # Run every 30 minutes
-            cleanup_old_jobs()
+            try:
+                if time.time() >= next_sweep:
+                    sweep_orphan_dirs()
+                    next_sweep = time.time() + ORPHAN_SWEEP_INTERVAL_SECONDS
+                cleanup_old_jobs()
+            except Exception as e:
+                app.logger.error(f"Cleanup error: {e}")
+            
+            # Sleep until the earliest deadline this process knows about
+            with cleanup_condition:
+                now = time.time()
+                while expiry_deadlines and expiry_deadlines[0] <= now:
+                    heapq.heappop(expiry_deadlines)
+                timeout = CLEANUP_INTERVAL_SECONDS
+                if expiry_deadlines:
+                    timeout = min(timeout, expiry_deadlines[0] - now)
+                cleanup_condition.wait(timeout)
     
     cleanup_thread = threading.Thread(target=cleanup_loop)
     cleanup_thread.daemon = True
     cleanup_thread.start()
 
-if __name__ == '__main__':
-    # Start cleanup thread
+def init_runtime():
+    """Start the per-process background machinery exactly once per process"""
+    global runtime_pid
+    if runtime_pid == os.getpid():
+        return
+    with scheduler_condition:
+        if runtime_pid == os.getpid():
+            return
+        runtime_pid = os.getpid()
+    
+    # Start cleanup thread and the download worker pool
     start_cleanup_thread()
+    ensure_download_workers()
+    
+    # Pre-fork the warm yt-dlp workers before the first request needs them
+    if YT_DLP_ENGINE == 'pool' or YT_DLP_DOWNLOAD_ENGINE == 'pool':
+        ytdlp_pool.start()
     
+    process_runner.start()
+    capabilities.start()
+
+@app.before_request
+def ensure_runtime():
+    # A no-op once this process is running; covers servers that don't call init_runtime themselves
+    init_runtime()
+
+def create_app():
+    """App factory for production servers, e.g. gunicorn 'main:create_app()'.
+
+    Starts no threads or processes: with gunicorn --preload this runs in the
+    master, and forked workers would inherit half of that machinery. Each
+    serving process calls init_runtime() itself (gunicorn.conf.py's
+    post_worker_init), or it runs on the process's first request.
+    """
+    return app
+
+if __name__ == '__main__':
     port = int(os.environ.get('PORT', 8080))
     debug_mode = os.environ.get('FLASK_DEBUG', 'false').lower() == 'true'
-    app.run(host='0.0.0.0', port=port, debug=debug_mode)
\ No newline at end of file
+    init_runtime()
+    create_app().run(host='0.0.0.0', port=port, debug=debug_mode, threaded=True)
\ No newline at end of file
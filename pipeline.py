@@ -0,0 +1,204 @@
+"""Declarative download profiles and the pieces of the download pipeline
+that don't depend on the running service.
+
+Every download goes through the same stages: resolve (profile options and
+cookies), select (format selector), fetch (one yt-dlp run), post-process
+(ffmpeg, when the fetched file isn't acceptable) and publish. Modes differ
+only in their DownloadProfile - limits, network settings, format selectors
+and failure messages - so tuning a mode means editing its profile.
+"""
+import subprocess
+from collections import deque
+from dataclasses import dataclass, field
+
+# Bounds on what is kept of a process's output: enough to classify a failure
+# and show the user the last error, not the whole run
+OUTPUT_TAIL_LINES = 50
+OUTPUT_LINE_LENGTH = 1000
+
+# First match wins: (outcome, lowercase substrings of yt-dlp's stderr)
+FAILURE_RULES = (
+    ('cookies', ('cookies', 'sign in to confirm')),
+    ('age_restricted', ('age-restricted',)),
+    ('private', ('private', 'unavailable')),
+    ('rate_limited', ('http error 429',)),
+    ('unreachable', ('unable to download webpage',)),
+    ('timeout', ('timeout', 'timed out')),
+    ('file_size', ('file size',)),
+    ('format_unavailable', ('requested format is not available',))
+)
+
+# Default job fields per outcome. {limit} is the profile's size cap in MB and
+# {detail} the reason a stalled or over-budget run was killed.
+FAILURE_MESSAGES = {
+    'cookies': {
+        'message': 'YouTube requires cookies for this video. Please add fresh cookies.txt file.',
+        'error': 'Cookie authentication required',
+        'help': 'Export cookies from your browser and upload to Render secrets'
+    },
+    'age_restricted': {
+        'message': 'Age-restricted video requires authentication. Add cookies.txt file.',
+        'error': 'Age restriction detected'
+    },
+    'private': {
+        'message': 'Video is private, deleted, or unavailable.',
+        'error': 'Video access denied'
+    },
+    'rate_limited': {
+        'message': 'YouTube rate limiting detected. Please wait a few minutes and try again.',
+        'error': 'Rate limited'
+    },
+    'unreachable': {
+        'message': 'Unable to access YouTube. This might be due to network restrictions or rate limiting.',
+        'error': 'Site unreachable'
+    },
+    'timeout': {
+        'message': 'Download timed out. Try a shorter video.',
+        'error': 'Network timeout'
+    },
+    'file_size': {
+        'message': 'Video file too large (>{limit}MB limit). Try audio download.',
+        'error': 'File size exceeded'
+    },
+    'stalled': {
+        'message': 'Download stalled. {detail}.',
+        'error': 'Download stalled'
+    },
+    'format_unavailable': {
+        'message': 'No format matching the requested type is available for this video.',
+        'error': 'Format unavailable'
+    },
+    'budget': {
+        'message': 'Download took longer than {detail} seconds. Try a shorter video.',
+        'error': 'Time budget exceeded'
+    },
+    'error': {
+        'message': 'Download failed. Try a different video or format.'
+    }
+}
+
+
+@dataclass(frozen=True)
+class DownloadProfile:
+    name: str
+    max_filesize_mb: int
+    socket_timeout: int
+    retries: int
+    fragment_retries: int
+    user_agent: str
+    video_format: str
+    audio_quality: str = 'worstaudio'  # base of the native audio selector
+    audio_fallback: str = 'worstaudio'  # selector when no codec is negotiated
+    use_cookies: bool = True
+    transcode: bool = True  # convert audio that matches none of the accepted codecs
+    default_audio_codecs: tuple = ()  # used when the client doesn't send accept_codecs
+    encoder_args: dict = field(default_factory=dict)  # codec -> ffmpeg args, overriding the defaults
+    extra_args: tuple = ()
+    messages: dict = field(default_factory=dict)  # 'started', 'fetching', 'completed'
+    failure_messages: dict = field(default_factory=dict)  # outcome -> job fields, overriding FAILURE_MESSAGES
+
+
+def native_audio_selector(quality, codec_filters):
+    """Format selector trying a native stream for each yt-dlp filter in order, then any audio"""
+    return '/'.join(f"{quality}[{codec_filter}]" for codec_filter in codec_filters) + f"/{quality}"
+
+
+def select_format(profile, download_type, codec_filters=()):
+    """yt-dlp format options for a download type under profile"""
+    if download_type == 'video':
+        return ['-f', profile.video_format]
+    if download_type == 'audio':
+        if codec_filters:
+            return ['-f', native_audio_selector(profile.audio_quality, codec_filters)]
+        return ['-f', profile.audio_fallback]
+    return []
+
+
+def build_command(profile, output_template, format_args, video_url, concurrent_fragments, cookie_path=None,
+                  info_json_path=None):
+    """The yt-dlp command line for one fetch.
+
+    With info_json_path, yt-dlp downloads from that saved extraction result
+    instead of extracting video_url again.
+    """
+    command = [
+        'yt-dlp',
+        '--no-warnings',
+        '--quiet',
+        '--no-playlist',
+        '--socket-timeout', str(profile.socket_timeout),
+        '--retries', str(profile.retries),
+        '--fragment-retries', str(profile.fragment_retries),
+        '--concurrent-fragments', str(concurrent_fragments),
+        '--max-filesize', f'{profile.max_filesize_mb}M',
+        '--output', output_template,
+        '--user-agent', profile.user_agent
+    ]
+    command.extend(profile.extra_args)
+    command.extend(format_args)
+    if cookie_path:
+        command.extend(['--cookies', cookie_path])
+    if info_json_path:
+        command.extend(['--load-info-json', info_json_path])
+    else:
+        command.append(video_url)
+    return command
+
+
+class OutputTail:
+    """Ring buffer of the last lines of a process stream.
+
+    Lines are matched against FAILURE_RULES as they arrive, so outcome is
+    known without scanning the output again. The first line hitting each
+    rule is kept even after it scrolls out of the tail, so the rate governor
+    sees those lines in text() as it would in the full output.
+    """
+
+    def __init__(self, max_lines=OUTPUT_TAIL_LINES, max_line_length=OUTPUT_LINE_LENGTH):
+        self.max_line_length = max_line_length
+        self.lines = deque(maxlen=max_lines)
+        self.matches = {}  # outcome -> (line number, line)
+        self.line_count = 0
+
+    def append(self, line):
+        if len(line) > self.max_line_length:
+            line = line[:self.max_line_length] + '...\n'
+        self.line_count += 1
+        self.lines.append((self.line_count, line))
+        lowered = line.lower()
+        for outcome, needles in FAILURE_RULES:
+            if outcome not in self.matches and any(needle in lowered for needle in needles):
+                self.matches[outcome] = (self.line_count, line)
+
+    @property
+    def outcome(self):
+        """Failure category of everything appended so far"""
+        for outcome, _ in FAILURE_RULES:
+            if outcome in self.matches:
+                return outcome
+        return 'error'
+
+    def text(self):
+        """Matched lines that scrolled out of the tail, then the tail"""
+        first_kept = self.lines[0][0] if self.lines else self.line_count + 1
+        scrolled = sorted(match for match in self.matches.values() if match[0] < first_kept)
+        return ''.join(line for _, line in scrolled + list(self.lines))
+
+
+class ProcessResult(subprocess.CompletedProcess):
+    """CompletedProcess whose stderr is an OutputTail's text, carrying the
+    failure category that tail classified as the lines arrived"""
+
+    def __init__(self, args, returncode, stdout, stderr, outcome):
+        super().__init__(args, returncode, stdout, stderr)
+        self.outcome = outcome
+
+
+def failure_fields(profile, outcome, stderr_text=None, detail=None):
+    """Job fields (message, error, help) describing a failure under profile"""
+    fields = dict(FAILURE_MESSAGES.get(outcome, FAILURE_MESSAGES['error']))
+    fields.update(profile.failure_messages.get(outcome, {}))
+    fields['message'] = fields['message'].format(limit=profile.max_filesize_mb, detail=detail)
+    if 'error' not in fields:
+        fields['error'] = stderr_text[-300:] if stderr_text else 'Unknown error'
+    return fields
@@ -0,0 +1,102 @@
+"""Process-wide rate governor for upstream extractor hosts.
+
+Each host gets a token bucket. Its refill rate adapts to how the host is
+behaving. When yt-dlp output shows throttling (HTTP 429, the "not a
+bot" check), the rate halves and the host enters an exponentially growing
+cooldown. While runs succeed, the rate climbs back in small steps. Healthy
+hosts run at full speed instead of paying a fixed sleep on every request,
+and bursts back off before they get the service banned.
+"""
+import threading
+import time
+
+# 'not a bot' is YouTube's bot check; "Sign in to confirm your age" is an age gate, not throttling
+THROTTLE_MARKERS = ('http error 429', 'too many requests', 'not a bot')
+
+
+class RateLimitedError(Exception):
+    """Raised when a caller would have to wait longer than it allows"""
+
+    def __init__(self, host, retry_after):
+        super().__init__(f'{host} is rate limited, retry in {retry_after:.0f}s')
+        self.host = host
+        self.retry_after = retry_after
+
+
+class RateGovernor:
+    def __init__(self, rate, min_rate, max_rate, burst, increase_step=0.1,
+                 initial_backoff=5.0, max_backoff=300.0):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.increase_step = increase_step
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, host, now):
+        bucket = self._hosts.get(host)
+        if bucket is None:
+            bucket = self._hosts[host] = {
+                'rate': self.rate, 'tokens': float(self.burst), 'updated': now,
+                'cooldown_until': 0.0, 'backoff': 0.0, 'throttled': 0
+            }
+        # Refill for the time since the last look
+        bucket['tokens'] = min(self.burst, bucket['tokens'] + (now - bucket['updated']) * bucket['rate'])
+        bucket['updated'] = now
+        return bucket
+
+    def acquire(self, host, max_wait=None):
+        """Take one request token for host, sleeping until one is available.
+
+        Raises RateLimitedError instead of sleeping longer than max_wait.
+        Returns the number of seconds spent waiting.
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.time()
+                bucket = self._bucket(host, now)
+                wait = max(0.0, bucket['cooldown_until'] - now)
+                if not wait and bucket['tokens'] >= 1:
+                    bucket['tokens'] -= 1
+                    return waited
+                if not wait:
+                    wait = (1 - bucket['tokens']) / bucket['rate']
+            if max_wait is not None and waited + wait > max_wait:
+                raise RateLimitedError(host, wait)
+            time.sleep(wait)
+            waited += wait
+
+    def report(self, host, output, success):
+        """Feed back the outcome of a run so the host's rate can adapt"""
+        throttled = any(marker in (output or '').lower() for marker in THROTTLE_MARKERS)
+        with self._lock:
+            now = time.time()
+            bucket = self._bucket(host, now)
+            if throttled:
+                # Multiplicative decrease plus a cooldown that doubles while throttling continues
+                bucket['rate'] = max(self.min_rate, bucket['rate'] / 2)
+                bucket['backoff'] = min(self.max_backoff, bucket['backoff'] * 2 or self.initial_backoff)
+                bucket['cooldown_until'] = now + bucket['backoff']
+                bucket['tokens'] = 0.0
+                bucket['throttled'] += 1
+            elif success:
+                bucket['rate'] = min(self.max_rate, bucket['rate'] + self.increase_step)
+                bucket['backoff'] = 0.0
+        return throttled
+
+    def snapshot(self):
+        """Per-host rates and cooldowns for /health"""
+        with self._lock:
+            now = time.time()
+            return {
+                host: {
+                    'rate': round(bucket['rate'], 3),
+                    'cooldown_remaining': max(0, round(bucket['cooldown_until'] - now, 1)),
+                    'throttled': bucket['throttled']
+                }
+                for host, bucket in self._hosts.items()
+            }
@@ -0,0 +1,250 @@
+"""Where finished downloads are delivered from.
+
+Two backends share one interface:
+
+* ``LocalStorage`` - files stay in the job directory and the web worker (or
+  nginx) sends them, as before
+* ``S3Storage`` - any S3-compatible object store (AWS, MinIO, ...). Files
+  are uploaded while yt-dlp is still writing them and clients are
+  redirected to a presigned URL, so any instance can serve any job and no
+  web worker streams the bytes
+
+S3Storage needs boto3 installed unless it is given a client.
+
+Objects are keyed by artifact key, so jobs for the same video and format
+share one object. They are never deleted by the service; give the bucket a
+lifecycle rule that expires them.
+"""
+import logging
+import mimetypes
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# S3 rejects multipart parts under 5 MB, except the last one
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+class LocalStorage:
+    remote = False
+
+    def start_upload(self, artifact_key, directory):
+        return None
+
+    def put(self, artifact_key, path):
+        return None
+
+    def existing_key(self, artifact_key):
+        return None
+
+    def url_for(self, key, filename, disposition):
+        return None
+
+    def snapshot(self):
+        return {'backend': 'local'}
+
+
+class TailUpload:
+    """Multipart upload of a file that yt-dlp is still writing.
+
+    Follows the first ``*.part`` file to appear in directory and sends a part
+    whenever part_size new bytes are on disk. yt-dlp renames the finished
+    file, which keeps its inode, so finish(path) uploads the remaining bytes
+    from the open handle and completes the upload. If path is some other
+    file (a re-encode, a restarted download), the multipart upload is
+    aborted and path is uploaded in one go.
+    """
+
+    def __init__(self, storage, key, directory, part_size, poll_interval=0.5):
+        self.storage = storage
+        self.key = key
+        self.directory = directory
+        self.part_size = part_size
+        self.poll_interval = poll_interval
+        self.finished = False
+        self._file = None
+        self._inode = None
+        self._upload_id = None
+        self._parts = []
+        self._buffer = bytearray()
+        self._error = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'upload-{os.path.basename(directory)}')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _find_part_file(self):
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return None
+        for name in names:
+            if name.endswith('.part'):
+                return os.path.join(self.directory, name)
+        return None
+
+    def _run(self):
+        try:
+            while self._file is None and not self._stop.is_set():
+                path = self._find_part_file()
+                if path:
+                    try:
+                        self._file = open(path, 'rb')
+                        self._inode = os.fstat(self._file.fileno()).st_ino
+                    except FileNotFoundError:
+                        pass  # Renamed or removed between listdir and open
+                if self._file is None:
+                    self._stop.wait(self.poll_interval)
+            while not self._stop.is_set():
+                if not self._read_available():
+                    self._stop.wait(self.poll_interval)
+        except Exception as e:
+            logger.error(f"Streaming upload of {self.key} failed: {e}")
+            self._error = e
+
+    def _read_available(self):
+        """Upload whole parts from what is on disk, returns False when nothing new arrived"""
+        if self._file is None:
+            return False
+        data = self._file.read(self.part_size - len(self._buffer))
+        if not data:
+            return False
+        self._buffer.extend(data)
+        if len(self._buffer) >= self.part_size:
+            self._send_part()
+        return True
+
+    def _send_part(self):
+        client = self.storage.client
+        if self._upload_id is None:
+            content_type = mimetypes.guess_type(self._file.name[:-len('.part')])[0] or 'application/octet-stream'
+            self._upload_id = client.create_multipart_upload(
+                Bucket=self.storage.bucket, Key=self.key, ContentType=content_type)['UploadId']
+        number = len(self._parts) + 1
+        result = client.upload_part(Bucket=self.storage.bucket, Key=self.key, UploadId=self._upload_id,
+                                    PartNumber=number, Body=bytes(self._buffer))
+        self._parts.append({'PartNumber': number, 'ETag': result['ETag']})
+        self._buffer = bytearray()
+
+    def _stop_following(self):
+        self._stop.set()
+        self._thread.join()
+
+    def finish(self, path):
+        """Complete the upload with path's contents, returns the object key"""
+        self._stop_following()
+        self.finished = True
+        try:
+            # Anything smaller than one part is cheaper to send with a single PUT
+            if self._parts and self._error is None and os.stat(path).st_ino == self._inode:
+                while self._read_available():
+                    pass
+                if self._buffer:
+                    self._send_part()
+                self.storage.client.complete_multipart_upload(
+                    Bucket=self.storage.bucket, Key=self.key, UploadId=self._upload_id,
+                    MultipartUpload={'Parts': self._parts})
+                self.storage.stats['multipart_uploads'] += 1
+                return self.key
+            self._abort_multipart()
+        finally:
+            self._close()
+        return self.storage.put_key(self.key, path)
+
+    def abort(self):
+        """Give up on the upload, e.g. because the download failed"""
+        if self.finished:
+            return
+        self._stop_following()
+        self.finished = True
+        try:
+            self._abort_multipart()
+        finally:
+            self._close()
+
+    def _abort_multipart(self):
+        if self._upload_id is not None:
+            try:
+                self.storage.client.abort_multipart_upload(
+                    Bucket=self.storage.bucket, Key=self.key, UploadId=self._upload_id)
+            except Exception as e:
+                logger.error(f"Failed to abort multipart upload of {self.key}: {e}")
+            self._upload_id = None
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class S3Storage:
+    """Artifacts in an S3-compatible bucket, delivered by presigned redirect.
+
+    Pass a client (boto3 S3 client compatible, e.g. a local stand-in in
+    tests) or the connection settings.
+    """
+
+    remote = True
+
+    def __init__(self, bucket, prefix='', client=None, endpoint_url=None, region=None,
+                 presign_seconds=600, part_size=8 * 1024 * 1024):
+        if client is None:
+            import boto3
+            client = boto3.client('s3', endpoint_url=endpoint_url, region_name=region)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.presign_seconds = presign_seconds
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.stats = {'uploads': 0, 'multipart_uploads': 0, 'upload_errors': 0}
+
+    def object_key(self, artifact_key):
+        return f'{self.prefix}{artifact_key}'
+
+    def start_upload(self, artifact_key, directory):
+        """Start following a download into directory, returns a TailUpload"""
+        return TailUpload(self, self.object_key(artifact_key), directory, self.part_size)
+
+    def put(self, artifact_key, path):
+        """Upload a finished file in one request, returns the object key"""
+        return self.put_key(self.object_key(artifact_key), path)
+
+    def put_key(self, key, path):
+        content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        try:
+            with open(path, 'rb') as f:
+                self.client.put_object(Bucket=self.bucket, Key=key, Body=f, ContentType=content_type)
+        except Exception:
+            self.stats['upload_errors'] += 1
+            raise
+        self.stats['uploads'] += 1
+        return key
+
+    def existing_key(self, artifact_key):
+        """The object key if the artifact was uploaded before, else None"""
+        key = self.object_key(artifact_key)
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+        except Exception:
+            return None
+        return key
+
+    def url_for(self, key, filename, disposition):
+        """Presigned GET URL that serves the object with the given Content-Disposition"""
+        return self.client.generate_presigned_url('get_object', Params={
+            'Bucket': self.bucket,
+            'Key': key,
+            'ResponseContentDisposition': disposition,
+            'ResponseContentType': mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        }, ExpiresIn=self.presign_seconds)
+
+    def snapshot(self):
+        return dict(self.stats, backend='s3', bucket=self.bucket, prefix=self.prefix)
+
+
+def create_storage(kind, **settings):
+    """Build the storage backend named by the STORAGE_BACKEND setting"""
+    if kind == 's3':
+        return S3Storage(**settings)
+    return LocalStorage()
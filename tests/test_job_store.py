@@ -0,0 +1,72 @@
+"""The three job store backends behave the same.
+
+Redis runs against fakeredis, an in-process stand-in for the server.
+"""
+import pytest
+
+from job_store import Job, MemoryJobStore, RedisJobStore, SqliteJobStore
+
+
+@pytest.fixture(params=['memory', 'sqlite', 'redis'])
+def store(request, tmp_path):
+    if request.param == 'sqlite':
+        return SqliteJobStore(str(tmp_path / 'jobs.db'))
+    if request.param == 'redis':
+        fakeredis = pytest.importorskip('fakeredis')
+        return RedisJobStore(client=fakeredis.FakeRedis())
+    return MemoryJobStore()
+
+
+def make_job(job_id, **fields):
+    return Job(id=job_id, url=f'https://www.youtube.com/watch?v={job_id}', type='video',
+               download_dir=f'/tmp/{job_id}', **fields)
+
+
+def test_create_and_get(store):
+    store.create(make_job('a', message='queued'))
+    job = store.get('a')
+    assert job.status == 'queued'
+    assert job.message == 'queued'
+    assert store.get('missing') is None
+
+
+def test_transition_only_from_listed_statuses(store):
+    store.create(make_job('a'))
+    job = store.transition('a', ['queued'], status='processing')
+    assert job.status == 'processing'
+    assert store.transition('a', ['queued'], status='cancelled') is None
+    assert store.get('a').status == 'processing'
+    assert store.count('processing') == 1
+    assert store.count('queued') == 0
+    assert store.transition('missing', ['queued'], status='processing') is None
+
+
+def test_add_follower_while_leader_unfinished(store):
+    store.create(make_job('leader'))
+    assert store.add_follower('leader', 'f1').followers == ['f1']
+    store.transition('leader', ['queued'], status='completed')
+    assert store.add_follower('leader', 'f2') is None
+    assert store.get('leader').followers == ['f1']
+
+
+def test_created_before_is_oldest_first(store):
+    store.create(make_job('new', created_at=300.0))
+    # Created after 'new' but with an older timestamp
+    store.create(make_job('old', created_at=100.0))
+    store.create(make_job('mid', created_at=200.0))
+    assert [job.id for job in store.created_before(250.0)] == ['old', 'mid']
+    assert [job.id for job in store.created_before(100.0)] == []
+
+
+def test_expiring_before(store):
+    store.create(make_job('a', expires_at=100.0))
+    store.create(make_job('b', expires_at=200.0))
+    store.create(make_job('c'))
+    store.update('b', expires_at=50.0)
+    assert sorted(job.id for job in store.expiring_before(150.0)) == ['a', 'b']
+
+
+def test_text_fields_are_capped(store):
+    store.create(make_job('a'))
+    store.update('a', error='x' * 5000)
+    assert len(store.get('a').error) == 1000
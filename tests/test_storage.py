@@ -0,0 +1,160 @@
+"""S3Storage and its streaming TailUpload against an in-memory S3 stand-in."""
+import os
+import time
+
+import pytest
+
+from storage import MIN_PART_SIZE, LocalStorage, S3Storage, TailUpload, create_storage
+
+
+class FakeS3Client:
+    """The part of the boto3 S3 client the storage backend uses"""
+
+    def __init__(self, fail_parts=False):
+        self.objects = {}
+        self.uploads = {}  # upload ID -> {part number: bytes}
+        self.aborted = []
+        self.part_sizes = []
+        self.fail_parts = fail_parts
+
+    def create_multipart_upload(self, Bucket, Key, ContentType):
+        upload_id = f'upload-{len(self.uploads) + 1}'
+        self.uploads[upload_id] = {}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        if self.fail_parts:
+            raise ConnectionError('connection reset')
+        self.uploads[UploadId][PartNumber] = Body
+        self.part_sizes.append(len(Body))
+        return {'ETag': f'etag-{PartNumber}'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.uploads.pop(UploadId)
+        self.objects[Key] = b''.join(parts[part['PartNumber']] for part in MultipartUpload['Parts'])
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.uploads.pop(UploadId)
+        self.aborted.append(UploadId)
+
+    def put_object(self, Bucket, Key, Body, ContentType):
+        self.objects[Key] = Body.read()
+
+    def head_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise KeyError(Key)
+        return {'ContentLength': len(self.objects[Key])}
+
+    def generate_presigned_url(self, method, Params, ExpiresIn):
+        return f"https://s3.test/{Params['Bucket']}/{Params['Key']}?expires={ExpiresIn}"
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def storage():
+    return S3Storage('bucket', prefix='downloads/', client=FakeS3Client())
+
+
+def start_download(storage, directory, first_bytes, part_size=4):
+    """A TailUpload following a .part file that already holds first_bytes"""
+    part_path = os.path.join(directory, 'video.mp4.part')
+    with open(part_path, 'wb') as f:
+        f.write(first_bytes)
+    upload = TailUpload(storage, 'downloads/key', directory, part_size, poll_interval=0.01)
+    return upload, part_path
+
+
+def test_part_size_has_s3_minimum():
+    assert S3Storage('bucket', client=FakeS3Client(), part_size=1024).part_size == MIN_PART_SIZE
+
+
+@pytest.mark.parametrize('content, part_sizes', [
+    (b'abcdefghij', [4, 4, 2]),  # last part is the remainder
+    (b'abcdefgh', [4, 4]),  # exact multiple: no empty trailing part
+])
+def test_multipart_parts_split_at_part_size(storage, tmp_path, content, part_sizes):
+    upload, part_path = start_download(storage, str(tmp_path), content[:5])
+    wait_for(lambda: len(upload._parts) == 1)
+    with open(part_path, 'ab') as f:
+        f.write(content[5:])
+    final_path = part_path[:-len('.part')]
+    os.rename(part_path, final_path)
+
+    assert upload.finish(final_path) == 'downloads/key'
+    client = storage.client
+    assert client.objects['downloads/key'] == content
+    assert client.part_sizes == part_sizes
+    assert storage.stats['multipart_uploads'] == 1
+    assert not client.uploads
+
+
+def test_file_smaller_than_a_part_is_one_put(storage, tmp_path):
+    upload, part_path = start_download(storage, str(tmp_path), b'abc')
+    final_path = part_path[:-len('.part')]
+    os.rename(part_path, final_path)
+
+    assert upload.finish(final_path) == 'downloads/key'
+    assert storage.client.objects['downloads/key'] == b'abc'
+    assert storage.stats == {'uploads': 1, 'multipart_uploads': 0, 'upload_errors': 0}
+
+
+def test_abort_discards_uploaded_parts(storage, tmp_path):
+    upload, _ = start_download(storage, str(tmp_path), b'abcdefgh')
+    wait_for(lambda: len(upload._parts) == 2)
+    upload.abort()
+
+    assert storage.client.aborted == ['upload-1']
+    assert not storage.client.uploads
+    assert 'downloads/key' not in storage.client.objects
+    upload.abort()  # Safe to call again, e.g. after finish()
+
+
+def test_replaced_file_is_uploaded_whole(storage, tmp_path):
+    upload, part_path = start_download(storage, str(tmp_path), b'abcdefgh')
+    wait_for(lambda: len(upload._parts) == 2)
+    # A re-encode writes a new file instead of renaming the one being followed
+    converted_path = os.path.join(str(tmp_path), 'video.m4a')
+    with open(converted_path, 'wb') as f:
+        f.write(b'converted')
+
+    assert upload.finish(converted_path) == 'downloads/key'
+    assert storage.client.aborted == ['upload-1']
+    assert storage.client.objects['downloads/key'] == b'converted'
+
+
+def test_failed_part_upload_falls_back_to_one_put(tmp_path):
+    storage = S3Storage('bucket', prefix='downloads/', client=FakeS3Client(fail_parts=True))
+    upload, part_path = start_download(storage, str(tmp_path), b'abcdefgh')
+    wait_for(lambda: upload._error is not None)
+    final_path = part_path[:-len('.part')]
+    os.rename(part_path, final_path)
+
+    assert upload.finish(final_path) == 'downloads/key'
+    assert storage.client.aborted == ['upload-1']
+    assert storage.client.objects['downloads/key'] == b'abcdefgh'
+
+
+def test_presigned_url_for_uploaded_artifacts(storage, tmp_path):
+    path = tmp_path / 'song.m4a'
+    path.write_bytes(b'audio')
+    assert storage.existing_key('abc') is None
+
+    key = storage.put('abc', str(path))
+    assert key == 'downloads/abc'
+    assert storage.existing_key('abc') == key
+    assert storage.url_for(key, 'song.m4a', 'attachment') == 'https://s3.test/bucket/downloads/abc?expires=600'
+
+
+def test_local_storage_leaves_delivery_to_the_server(tmp_path):
+    storage = create_storage('local')
+    assert isinstance(storage, LocalStorage)
+    # No upload and no object key, so /download_file sends the file itself
+    assert storage.start_upload('abc', str(tmp_path)) is None
+    assert storage.put('abc', str(tmp_path / 'song.m4a')) is None
+    assert storage.existing_key('abc') is None
@@ -0,0 +1,75 @@
+"""Every spelling of a video maps to one canonical URL and cache key."""
+import pytest
+
+from url_canonicalizer import MAX_URL_LENGTH, UnsupportedURL, canonicalize, canonicalize_playlist
+
+VIDEO = 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'
+PLAYLIST = 'https://www.youtube.com/playlist?list=PLrAXtmErZgOeiKm4sgNOknGvNjby9efdf'
+
+
+@pytest.mark.parametrize('raw_url, key, url', [
+    # Already canonical: left unchanged
+    (VIDEO, 'youtube:dQw4w9WgXcQ', VIDEO),
+    ('https://vimeo.com/76979871', 'vimeo:76979871', 'https://vimeo.com/76979871'),
+    ('https://www.dailymotion.com/video/x7tgad0', 'dailymotion:x7tgad0', 'https://www.dailymotion.com/video/x7tgad0'),
+    # Other YouTube hosts and paths
+    ('https://youtu.be/dQw4w9WgXcQ', 'youtube:dQw4w9WgXcQ', VIDEO),
+    ('https://www.youtube.com/shorts/dQw4w9WgXcQ', 'youtube:dQw4w9WgXcQ', VIDEO),
+    ('https://m.youtube.com/watch?v=dQw4w9WgXcQ', 'youtube:dQw4w9WgXcQ', VIDEO),
+    ('https://music.youtube.com/watch?v=dQw4w9WgXcQ', 'youtube:dQw4w9WgXcQ', VIDEO),
+    ('https://www.youtube.com/embed/dQw4w9WgXcQ', 'youtube:dQw4w9WgXcQ', VIDEO),
+    ('https://www.youtube.com/live/dQw4w9WgXcQ', 'youtube:dQw4w9WgXcQ', VIDEO),
+    ('https://www.youtube-nocookie.com/embed/dQw4w9WgXcQ', 'youtube:dQw4w9WgXcQ', VIDEO),
+    ('youtu.be/dQw4w9WgXcQ', 'youtube:dQw4w9WgXcQ', VIDEO),
+    ('HTTPS://WWW.YOUTUBE.COM/watch?v=dQw4w9WgXcQ', 'youtube:dQw4w9WgXcQ', VIDEO),
+    # Tracking parameters are dropped
+    ('https://youtu.be/dQw4w9WgXcQ?si=aBcD1234', 'youtube:dQw4w9WgXcQ', VIDEO),
+    ('https://www.youtube.com/shorts/dQw4w9WgXcQ?feature=share', 'youtube:dQw4w9WgXcQ', VIDEO),
+    ('https://www.youtube.com/watch?app=desktop&v=dQw4w9WgXcQ&utm_source=twitter', 'youtube:dQw4w9WgXcQ', VIDEO),
+    ('https://m.youtube.com/watch?v=dQw4w9WgXcQ&pp=ygUEcmljaw%3D%3D', 'youtube:dQw4w9WgXcQ', VIDEO),
+    # A start time or playlist context doesn't change the file a video download fetches
+    ('https://youtu.be/dQw4w9WgXcQ?t=42', 'youtube:dQw4w9WgXcQ', VIDEO),
+    ('https://www.youtube.com/watch?v=dQw4w9WgXcQ&list=PLrAXtmErZgOeiKm4sgNOknGvNjby9efdf&index=2',
+     'youtube:dQw4w9WgXcQ', VIDEO),
+    # Other sites
+    ('https://player.vimeo.com/video/76979871?h=abc123', 'vimeo:76979871', 'https://vimeo.com/76979871'),
+    ('https://vimeo.com/channels/staffpicks/76979871', 'vimeo:76979871', 'https://vimeo.com/76979871'),
+    ('https://dai.ly/x7tgad0', 'dailymotion:x7tgad0', 'https://www.dailymotion.com/video/x7tgad0'),
+    ('https://www.dailymotion.com/embed/video/x7tgad0?autoplay=1', 'dailymotion:x7tgad0',
+     'https://www.dailymotion.com/video/x7tgad0'),
+])
+def test_canonicalize(raw_url, key, url):
+    canonical = canonicalize(raw_url)
+    assert canonical.key == key
+    assert canonical.url == url
+
+
+@pytest.mark.parametrize('raw_url', [
+    None,
+    '',
+    'https://youtu.be/' + 'a' * MAX_URL_LENGTH,
+    'ftp://www.youtube.com/watch?v=dQw4w9WgXcQ',
+    'https://example.com/watch?v=dQw4w9WgXcQ',
+    'https://www.youtube.com/watch?v=tooShort',
+    'https://www.youtube.com/watch?v=dQw4w9WgXcQX',
+    'https://www.youtube.com/watch?vv=dQw4w9WgXcQ',
+    'https://www.youtube.com/feed/subscriptions',
+])
+def test_canonicalize_rejects(raw_url):
+    with pytest.raises(UnsupportedURL):
+        canonicalize(raw_url)
+
+
+@pytest.mark.parametrize('raw_url, url', [
+    (PLAYLIST, PLAYLIST),
+    # For a playlist download, list= is what the URL means
+    (PLAYLIST + '&si=aBcD1234', PLAYLIST),
+    ('https://www.youtube.com/watch?v=dQw4w9WgXcQ&list=PLrAXtmErZgOeiKm4sgNOknGvNjby9efdf', PLAYLIST),
+    ('https://youtu.be/dQw4w9WgXcQ?list=PLrAXtmErZgOeiKm4sgNOknGvNjby9efdf&si=aBcD1234', PLAYLIST),
+    ('https://www.youtube.com/@SomeChannel?si=aBcD1234', 'https://www.youtube.com/@SomeChannel/videos'),
+    ('https://www.youtube.com/@SomeChannel/shorts', 'https://www.youtube.com/@SomeChannel/shorts'),
+    # A single video is accepted as a one-entry batch
+    ('https://youtu.be/dQw4w9WgXcQ?t=42', VIDEO),
+])
+def test_canonicalize_playlist(raw_url, url):
+    assert canonicalize_playlist(raw_url) == url
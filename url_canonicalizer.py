@@ -0,0 +1,125 @@
+"""Table-driven URL canonicalization for the sites the service accepts.
+
+A user URL is matched against a small table of compiled patterns, one
+split and at most two regex matches per call, so junk, unsupported sites and
+duplicate spellings of the same video (youtu.be vs watch?v=, tracking
+parameters, timestamps) are sorted out before any yt-dlp process starts.
+
+Every accepted video maps to one canonical URL, which is what gets passed to
+yt-dlp, and one key (``<site>:<id>``) used by the info cache, the artifact
+cache and in-flight dedup.
+"""
+import re
+from dataclasses import dataclass
+from urllib.parse import urlsplit
+
+MAX_URL_LENGTH = 2048
+
+# Host prefixes that serve the same content as the bare domain
+HOST_PREFIXES = ('www.', 'm.', 'music.', 'player.')
+
+YOUTUBE_ID = r'([A-Za-z0-9_-]{11})'
+
+# host -> ((site, 'path' or 'query', pattern), ...); first match wins
+VIDEO_PATTERNS = {
+    'youtube.com': (
+        ('youtube', 'query', re.compile(r'(?:^|&)v=' + YOUTUBE_ID + r'(?:&|$)')),
+        ('youtube', 'path', re.compile(r'^/(?:shorts|embed|live|v|e)/' + YOUTUBE_ID + r'(?:[/?]|$)'))
+    ),
+    'youtube-nocookie.com': (
+        ('youtube', 'path', re.compile(r'^/embed/' + YOUTUBE_ID + r'(?:[/?]|$)')),
+    ),
+    'youtu.be': (
+        ('youtube', 'path', re.compile(r'^/' + YOUTUBE_ID + r'/?$')),
+    ),
+    'vimeo.com': (
+        ('vimeo', 'path', re.compile(r'^/(?:video/|channels/[^/]+/|groups/[^/]+/videos/)?(\d+)/?$')),
+    ),
+    'dailymotion.com': (
+        ('dailymotion', 'path', re.compile(r'^/(?:embed/)?video/([A-Za-z0-9]+)')),
+    ),
+    'dai.ly': (
+        ('dailymotion', 'path', re.compile(r'^/([A-Za-z0-9]+)/?$')),
+    )
+}
+
+CANONICAL_VIDEO_URLS = {
+    'youtube': 'https://www.youtube.com/watch?v={id}',
+    'vimeo': 'https://vimeo.com/{id}',
+    'dailymotion': 'https://www.dailymotion.com/video/{id}'
+}
+
+YOUTUBE_PLAYLIST_ID = re.compile(r'(?:^|&)list=([A-Za-z0-9_-]{10,64})(?:&|$)')
+YOUTUBE_CHANNEL_PATH = re.compile(r'^/(@[\w.-]+|channel/UC[\w-]{22}|c/[\w.-]+|user/[\w.-]+)(/videos|/shorts|/streams)?/?$')
+
+
+class UnsupportedURL(ValueError):
+    """The input is not a URL of a video the service can download"""
+
+
+@dataclass(frozen=True)
+class CanonicalURL:
+    site: str
+    id: str
+    url: str
+
+    @property
+    def key(self):
+        """Cache and dedup key, e.g. youtube:dQw4w9WgXcQ"""
+        return f'{self.site}:{self.id}'
+
+
+def _split(raw_url):
+    """(host without HOST_PREFIXES, path, query) of an http(s) URL"""
+    if not isinstance(raw_url, str):
+        raise UnsupportedURL('URL must be a string')
+    raw_url = raw_url.strip()
+    if not raw_url or len(raw_url) > MAX_URL_LENGTH:
+        raise UnsupportedURL('URL is empty or too long')
+    if '://' not in raw_url:
+        # Pasted without a scheme, e.g. youtu.be/dQw4w9WgXcQ
+        raw_url = 'https://' + raw_url
+    try:
+        parts = urlsplit(raw_url)
+        host = (parts.hostname or '').lower()
+    except ValueError:
+        raise UnsupportedURL('Malformed URL')
+    if parts.scheme.lower() not in ('http', 'https') or not host:
+        raise UnsupportedURL('Only http(s) URLs are supported')
+    for prefix in HOST_PREFIXES:
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+            break
+    return host, parts.path, parts.query
+
+
+def canonicalize(raw_url):
+    """CanonicalURL for a video URL, raises UnsupportedURL"""
+    host, path, query = _split(raw_url)
+    patterns = VIDEO_PATTERNS.get(host)
+    if patterns is None:
+        raise UnsupportedURL(f'Unsupported site: {host}')
+    for site, source, pattern in patterns:
+        match = pattern.search(query if source == 'query' else path)
+        if match:
+            video_id = match.group(1)
+            return CanonicalURL(site, video_id, CANONICAL_VIDEO_URLS[site].format(id=video_id))
+    raise UnsupportedURL(f'No video ID found in {host} URL')
+
+
+def canonicalize_playlist(raw_url):
+    """Canonical URL for a YouTube playlist or channel, raises UnsupportedURL.
+
+    A plain video URL is accepted too and canonicalized as a video.
+    """
+    host, path, query = _split(raw_url)
+    # Share links carry the playlist too, e.g. youtu.be/<id>?list=<playlist>
+    if host in ('youtube.com', 'youtu.be'):
+        match = YOUTUBE_PLAYLIST_ID.search(query)
+        if match:
+            return f'https://www.youtube.com/playlist?list={match.group(1)}'
+    if host == 'youtube.com':
+        match = YOUTUBE_CHANNEL_PATH.match(path)
+        if match:
+            return f'https://www.youtube.com/{match.group(1)}{match.group(2) or "/videos"}'
+    return canonicalize(raw_url).url
@@ -0,0 +1,201 @@
+"""Warm yt-dlp worker processes.
+
+Each worker imports yt-dlp once and then runs yt-dlp command lines sent to it
+over a pipe through the YoutubeDL Python API, so jobs skip the interpreter
+start-up and extractor imports a fresh ``yt-dlp`` subprocess pays every time.
+
+Workers run this file as their main script rather than through
+multiprocessing's spawn, which would import the parent's ``__main__`` (the
+whole web app) in every child. This module stays free of Flask so the
+children only load it and yt-dlp.
+"""
+import json
+import os
+import queue
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing.connection import Connection
+
+from pipeline import OutputTail
+
+# How many YoutubeDL instances a worker keeps around for info extraction
+INFO_INSTANCE_CACHE_SIZE = 8
+
+
+class CaptureLogger:
+    """yt-dlp logger that keeps the tail of what the CLI would print to stderr"""
+
+    def __init__(self):
+        self.tail = OutputTail()
+
+    def debug(self, msg):
+        self.tail.append(msg + '\n')
+
+    def info(self, msg):
+        self.tail.append(msg + '\n')
+
+    def warning(self, msg):
+        self.tail.append(msg + '\n')
+
+    def error(self, msg):
+        self.tail.append(msg + '\n')
+
+    def result(self, returncode, stdout=''):
+        """(returncode, stdout, stderr tail, failure outcome) as sent back to the pool"""
+        return returncode, stdout, self.tail.text(), self.tail.outcome
+
+
+def run_command(yt_dlp, argv, info_instances):
+    """Run one yt-dlp command line, returning (returncode, stdout, stderr, outcome)"""
+    if '--version' in argv:
+        return CaptureLogger().result(0, yt_dlp.version.__version__ + '\n')
+
+    parsed = yt_dlp.parse_options(argv)
+    opts = parsed.ydl_opts
+    logger = CaptureLogger()
+
+    if opts.get('dump_single_json'):
+        # Reuse one YoutubeDL per option set so extractor state and HTTP
+        # sessions survive between info lookups
+        key = json.dumps([arg for arg in argv if arg not in parsed.urls])
+        ydl = info_instances.pop(key, None)
+        if ydl is None:
+            ydl = yt_dlp.YoutubeDL(dict(opts, dump_single_json=False))
+        info_instances[key] = ydl
+        while len(info_instances) > INFO_INSTANCE_CACHE_SIZE:
+            info_instances.popitem(last=False)[1].close()
+
+        ydl.params['logger'] = logger
+        try:
+            info = ydl.extract_info(parsed.urls[0], download=False)
+        except yt_dlp.utils.DownloadError:
+            info = None
+        if info is None:
+            # Extraction errors are logged and swallowed under ignoreerrors
+            return logger.result(1)
+        return logger.result(0, json.dumps(ydl.sanitize_info(info)))
+
+    with yt_dlp.YoutubeDL(dict(opts, logger=logger)) as ydl:
+        try:
+            if parsed.options.load_info_filename:
+                # --load-info-json: download from a saved extraction without fetching the page
+                returncode = ydl.download_with_info_file(parsed.options.load_info_filename)
+            else:
+                returncode = ydl.download(parsed.urls)
+        except yt_dlp.utils.DownloadError:
+            returncode = 1
+    return logger.result(returncode)
+
+
+def worker_main(conn):
+    """Child process loop: import yt-dlp once, then serve commands forever"""
+    import yt_dlp
+    from yt_dlp.extractor import gen_extractor_classes
+
+    # Pay the extractor import cost up front instead of on the first job
+    list(gen_extractor_classes())
+    info_instances = OrderedDict()
+
+    while True:
+        try:
+            argv = conn.recv()
+        except EOFError:
+            break
+        try:
+            result = run_command(yt_dlp, argv, info_instances)
+        except Exception as e:
+            logger = CaptureLogger()
+            logger.error(f'ERROR: {e}')
+            result = logger.result(1)
+        conn.send(result)
+
+
+class WorkerPool:
+    """Fixed-size pool of pre-forked yt-dlp workers.
+
+    Each worker runs one command at a time. A command that times out gets its
+    worker killed and replaced, so a hung extraction never blocks the pool.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._spawned = 0
+        self._pid = os.getpid()
+
+    def _forget_inherited_workers(self):
+        """After a fork, leave the parent's workers to the parent and start afresh.
+
+        Must be called with _lock held.
+        """
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            # Close this process's copies of the connections so the workers still see EOF when the parent exits
+            while not self._idle.empty():
+                self._idle.get_nowait()[1].close()
+            self._idle = queue.Queue()
+            self._spawned = 0
+
+    def _spawn(self):
+        """Start a worker, returns (Popen, Connection to it)"""
+        parent_socket, child_socket = socket.socketpair()
+        with child_socket:
+            # A worker exits on EOF, i.e. once this process goes away
+            process = subprocess.Popen([sys.executable, os.path.abspath(__file__), str(child_socket.fileno())],
+                                       stdin=subprocess.DEVNULL, pass_fds=(child_socket.fileno(),))
+        return process, Connection(parent_socket.detach())
+
+    def start(self):
+        """Pre-fork every worker so the first jobs don't pay start-up cost"""
+        with self._lock:
+            self._forget_inherited_workers()
+            while self._spawned < self.size:
+                self._spawned += 1
+                self._idle.put(self._spawn())
+
+    def _checkout(self, timeout=None):
+        """An idle worker, or None when none frees up within timeout seconds"""
+        with self._lock:
+            self._forget_inherited_workers()
+            if self._spawned < self.size and self._idle.empty():
+                self._spawned += 1
+                return self._spawn()
+        try:
+            return self._idle.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def run(self, argv, timeout=None):
+        """Run a yt-dlp argument list (without the program name) in a worker.
+
+        Returns (returncode, stdout, stderr tail, failure outcome). timeout
+        covers waiting for a free worker as well as the run itself.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        worker = self._checkout(timeout)
+        if worker is None:
+            raise subprocess.TimeoutExpired(['yt-dlp'] + argv, timeout)
+        process, conn = worker
+        try:
+            conn.send(argv)
+            remaining = max(0, deadline - time.monotonic()) if deadline is not None else None
+            if not conn.poll(remaining):
+                raise subprocess.TimeoutExpired(['yt-dlp'] + argv, timeout)
+            result = conn.recv()
+        except BaseException:
+            process.kill()
+            process.wait()
+            conn.close()
+            self._idle.put(self._spawn())
+            raise
+        self._idle.put(worker)
+        return result
+
+
+if __name__ == '__main__':
+    worker_main(Connection(int(sys.argv[1])))
@@ -0,0 +1,57 @@
+"""Stream a ZIP archive of files on disk without building it first.
+
+zipfile can write to a stream that isn't seekable by using data descriptors.
+So the archive is generated piece by piece as a file is read, and the
+response starts right away with flat memory use. Media files are already
+compressed, so entries are stored rather than deflated.
+"""
+import os
+import zipfile
+
+
+class _ChunkBuffer:
+    """Write-only file object that holds what zipfile wrote until it is drained"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(paths, chunk_size=64 * 1024):
+    """Yield the bytes of a ZIP holding paths, named by their basenames"""
+    buffer = _ChunkBuffer()
+    used_names = set()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for path in paths:
+            # The same video can appear twice in a batch
+            name = os.path.basename(path)
+            stem, ext = os.path.splitext(name)
+            counter = 1
+            while name in used_names:
+                counter += 1
+                name = f'{stem} ({counter}){ext}'
+            used_names.add(name)
+
+            info = zipfile.ZipInfo.from_file(path, name)
+            info.compress_type = zipfile.ZIP_STORED
+            with open(path, 'rb') as source, archive.open(info, 'w', force_zip64=True) as entry:
+                while True:
+                    chunk = source.read(chunk_size)
+                    if not chunk:
+                        break
+                    entry.write(chunk)
+                    yield buffer.drain()
+            yield buffer.drain()
+    # Central directory, written when the archive closes
+    yield buffer.drain()